@@ -0,0 +1,330 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: asyncio version of CosmosSQL over the Cosmos REST API
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## ref: https://docs.microsoft.com/en-us/rest/api/cosmos-db/
+## Usage:
+## 1. Import our library
+##    from AsyncCosmosSQLService import AsyncCosmosSQL
+##
+## 2. Open an instance with a database, which will be created if not existing
+##    async with AsyncCosmosSQL('myDatabase') as cosmos:
+##
+## 3. Create a container/collection if it doesn't exist
+##        await cosmos.createContainer('collection_name', '/fieldname')
+##
+## 4. Iterate a query
+##        async for item in cosmos.queryItems('SELECT * FROM c'):
+##
+## uri and key come from config.py unless passed in. 429s are retried honoring x-ms-retry-after-ms.
+## The shared session is closed when the last instance opened with async with exits.
+##############################################################################################
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+from email.utils import formatdate
+from urllib.parse import quote
+
+import aiohttp
+
+import azure.cosmos.errors as errors
+import azure.cosmos.http_constants as http_constants
+
+from CosmosSQLService import _throttleDelay, partitionKeyValue
+
+API_VERSION = '2018-12-31'
+
+def _authorization(master_key, verb, resource_type, resource_link, date):
+    """Master key authorization header for a REST request"""
+    text = '{0}\n{1}\n{2}\n{3}\n\n'.format(verb.lower(), resource_type.lower(), resource_link, date.lower())
+    digest = hmac.new(base64.b64decode(master_key), text.encode('utf-8'), hashlib.sha256).digest()
+    return quote('type=master&ver=1.0&sig=' + base64.b64encode(digest).decode(), safe = '')
+
+class _QueryIterator:
+    """Async iterator over a query, following x-ms-continuation page by page"""
+    def __init__(self, cosmos, query, headers):
+        self.__cosmos = cosmos
+        self.__query = query
+        self.__headers = headers
+        self.__page = []
+        self.__continuation = None
+        self.__done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.__page:
+            if self.__done:
+                raise StopAsyncIteration
+            headers = dict(self.__headers)
+            if self.__continuation:
+                headers[http_constants.HttpHeaders.Continuation] = self.__continuation
+            body, response_headers = await self.__cosmos._request('POST', 'docs', self.__cosmos._collectionLink(), '/docs', self.__query, headers)
+            self.__page = body['Documents']
+            self.__page.reverse()
+            self.__continuation = response_headers.get(http_constants.HttpHeaders.Continuation)
+            self.__done = not self.__continuation
+        return self.__page.pop()
+
+class AsyncCosmosSQL:
+    """Azure Cosmos SQL Service for asyncio
+    All instances share one aiohttp session (and its connection pool) per event loop.
+
+    Attributes:
+        __database_id  - A cosmos database id
+        __container    - A cosmos database container/collection object
+        __container_id - A cosmos database container/collection id
+        last_response_headers - headers of the latest response
+    Methods:
+        open() / release() / close()
+        createContainer(container_id, container_path)
+        readContainer(container_id)
+        upsertItem(document)
+        readItem(itemId, partitionKey = None)
+        queryItems(sql = "", parameters = None, max_item_count = None)
+        deleteItem(itemId, partitionKey = None)
+        patchItem(id, partialDoc, partitionKey = None)
+    """
+    __sessions = {}
+    __users = {}       # event loop -> instances opened with async with on its shared session
+
+    def __init__(self, database_id = 'testDatabase', session = None, connection_limit = 0, uri = None, key = None, max_retries = 9):
+        if uri is None or key is None:
+            # config.py only when needed
+            import config as cfg
+            uri = uri or cfg.settings['URI']
+            key = key or cfg.settings['PRIMARY_KEY']
+        self.__uri = uri.rstrip('/')
+        self.__master_key = key
+        self.__max_retries = max_retries
+        self.__shared = session is None
+        self.__database_id = database_id
+        self.__container = None
+        self.__container_id = None
+        self.__session = session
+        self.__connection_limit = connection_limit
+        self.last_response_headers = {}
+
+    async def __aenter__(self):
+        if self.__shared:
+            loop = asyncio.get_event_loop()
+            AsyncCosmosSQL.__users[loop] = AsyncCosmosSQL.__users.get(loop, 0) + 1
+        try:
+            await self.open()
+        except Exception:
+            await self.release()
+            raise
+        return self
+
+    async def __aexit__(self, exception_type, exception_val, trace):
+        await self.release()
+
+    async def release(self):
+        """Done with the instance: the shared session of the loop is closed once its last user released it"""
+        if not self.__shared:
+            return
+        loop = asyncio.get_event_loop()
+        users = AsyncCosmosSQL.__users.get(loop, 0) - 1
+        if users > 0:
+            AsyncCosmosSQL.__users[loop] = users
+            return
+        AsyncCosmosSQL.__users.pop(loop, None)
+        session = AsyncCosmosSQL.__sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+        self.__session = None
+
+    @property
+    def session(self):
+        """Shared aiohttp session for the running event loop"""
+        if self.__shared and (self.__session is None or self.__session.closed):
+            loop = asyncio.get_event_loop()
+            session = AsyncCosmosSQL.__sessions.get(loop)
+            if session is None or session.closed:
+                # limit = 0 lifts aiohttp's default cap of 100 connections
+                session = aiohttp.ClientSession(connector = aiohttp.TCPConnector(limit = self.__connection_limit))
+                AsyncCosmosSQL.__sessions[loop] = session
+            self.__session = session
+        return self.__session
+
+    @staticmethod
+    async def close():
+        """Close the shared sessions"""
+        for session in list(AsyncCosmosSQL.__sessions.values()):
+            await session.close()
+        AsyncCosmosSQL.__sessions.clear()
+        AsyncCosmosSQL.__users.clear()
+
+    @property
+    def database_id(self):
+        """Database name"""
+        return self.__database_id
+
+    @property
+    def container(self):
+        """Current container"""
+        return self.__container
+
+    @property
+    def container_id(self):
+        """Current container name"""
+        return self.__container_id
+
+    def _collectionLink(self):
+        return "dbs/" + self.database_id + "/colls/" + self.container_id
+
+    @property
+    def partitionKeyPath(self):
+        """Partition key path of the current container, e.g. /id"""
+        return self.__container['partitionKey']['paths'][0]
+
+    def _partitionKeyHeader(self, partitionKey):
+        return {'x-ms-documentdb-partitionkey': json.dumps([partitionKey])}
+
+    async def _request(self, verb, resource_type, resource_link, path_suffix = '', body = None, headers = None):
+        """Send a signed REST request, retrying 429s, raising errors.HTTPFailure on a non 2xx status"""
+        attempt = 0
+        while True:
+            try:
+                return await self._send(verb, resource_type, resource_link, path_suffix, body, headers)
+            except errors.HTTPFailure as e:
+                if e.status_code != http_constants.StatusCodes.TOO_MANY_REQUESTS or attempt >= self.__max_retries:
+                    raise
+                await asyncio.sleep(_throttleDelay(e, attempt))
+                attempt += 1
+
+    async def _send(self, verb, resource_type, resource_link, path_suffix = '', body = None, headers = None):
+        """One signed REST request"""
+        date = formatdate(usegmt = True)
+        request_headers = {
+            'authorization': _authorization(self.__master_key, verb, resource_type, resource_link, date),
+            'x-ms-date': date,
+            'x-ms-version': API_VERSION,
+            'Accept': 'application/json'
+        }
+        request_headers.update(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            request_headers.setdefault('Content-Type', 'application/json')
+        url = self.__uri + '/' + (resource_link + path_suffix).lstrip('/')
+        async with self.session.request(verb, url, data = data, headers = request_headers) as response:
+            text = await response.text()
+            self.last_response_headers = dict(response.headers)
+            if response.status >= 400:
+                raise errors.HTTPFailure(response.status, text, self.last_response_headers)
+            return (json.loads(text) if text else {}), self.last_response_headers
+
+    async def open(self):
+        """Create the database if it does not exist"""
+        try:
+            await self._request('POST', 'dbs', '', 'dbs', {'id': self.database_id})
+        except errors.HTTPFailure as e:
+            if e.status_code != http_constants.StatusCodes.CONFLICT:
+                raise
+
+    async def createContainer(self, container_id, container_path = '/id'):
+        """Create a container if it does not exist"""
+        container_definition = {'id': container_id}
+        container_definition['partitionKey'] = {
+                                                    'paths': [container_path],
+                                                    'kind': 'Hash'
+                                               }
+        try:
+            self.__container, _ = await self._request('POST', 'colls', 'dbs/' + self.database_id, '/colls', container_definition, {'x-ms-offer-throughput': '400'})
+            self.__container_id = container_id
+        except errors.HTTPFailure as e:
+            if e.status_code == http_constants.StatusCodes.CONFLICT:
+                await self.readContainer(container_id)
+            else:
+                raise e
+
+    async def readContainer(self, container_id):
+        """Set a new container and read it"""
+        link = "dbs/" + self.database_id + "/colls/" + container_id
+        self.__container, _ = await self._request('GET', 'colls', link)
+        self.__container_id = container_id
+        return self.__container
+
+    def partitionKeyOf(self, document):
+        """Partition key value of a document per the container definition"""
+        return partitionKeyValue(document, self.__container['partitionKey']['paths'][0])
+
+    async def upsertItem(self, document):
+        """Insert or update a document"""
+        headers = self._partitionKeyHeader(self.partitionKeyOf(document))
+        headers['x-ms-documentdb-is-upsert'] = 'True'
+        result, _ = await self._request('POST', 'docs', self._collectionLink(), '/docs', document, headers)
+        return result
+
+    async def _findItem(self, itemId):
+        """Document of an ID by a cross partition query, None if not found"""
+        async for item in self.queryItems('SELECT * FROM root r WHERE r.id=@id', [{'name': '@id', 'value': itemId}]):
+            return item
+        return None
+
+    async def readItem(self, itemId, partitionKey = None):
+        """Point read a document per ID and partition key, None if not found"""
+        if partitionKey is None:
+            if self.partitionKeyPath != '/id':
+                # Unknown partition key, fall back to a cross partition lookup
+                return await self._findItem(itemId)
+            partitionKey = itemId
+        try:
+            result, _ = await self._request('GET', 'docs', self._collectionLink() + "/docs/" + itemId, headers = self._partitionKeyHeader(partitionKey))
+            return result
+        except errors.HTTPFailure as e:
+            if e.status_code == http_constants.StatusCodes.NOT_FOUND:
+                return None
+            raise
+
+    def queryItems(self, sql = "", parameters = None, max_item_count = None):
+        """Query documents with the sql, an async iterator over the results.
+        The gateway serves filters and projections; cross partition ORDER BY/aggregates need the sync CosmosSQL.
+        """
+        if sql == "":
+            sql = 'SELECT * FROM ' + self.container_id
+        query = sql if isinstance(sql, dict) else {'query': sql, 'parameters': parameters or []}
+        headers = {
+            'Content-Type': 'application/query+json',
+            'x-ms-documentdb-isquery': 'True',
+            'x-ms-documentdb-query-enablecrosspartition': 'True'
+        }
+        if max_item_count:
+            headers['x-ms-max-item-count'] = str(max_item_count)
+        return _QueryIterator(self, query, headers)
+
+    async def deleteItem(self, itemId, partitionKey = None):
+        """Delete a document per ID"""
+        if partitionKey is None:
+            partitionKey = itemId
+            if self.partitionKeyPath != '/id':
+                item = await self._findItem(itemId)
+                if item is not None:
+                    partitionKey = self.partitionKeyOf(item)
+        result, _ = await self._request('DELETE', 'docs', self._collectionLink() + "/docs/" + itemId, headers = self._partitionKeyHeader(partitionKey))
+        return result
+
+    async def patchItem(self, id, partialDoc, partitionKey = None, max_retries = 10):
+        """Patch a document: point read, then replace guarded by If-Match on _etag, retried on 412"""
+        partialDoc = {key: value for key, value in partialDoc.items() if key != 'id'}
+        for attempt in range(max_retries):
+            item = await self.readItem(id, partitionKey)
+            if item is None:
+                return None
+            document = {key: value for key, value in item.items() if key[0] != '_'}
+            document.update(partialDoc)
+            headers = self._partitionKeyHeader(self.partitionKeyOf(item))
+            headers['If-Match'] = item['_etag']
+            try:
+                result, _ = await self._request('PUT', 'docs', self._collectionLink() + "/docs/" + id, body = document, headers = headers)
+                return result
+            except errors.HTTPFailure as e:
+                if e.status_code != http_constants.StatusCodes.PRECONDITION_FAILED or attempt == max_retries - 1:
+                    raise
@@ -0,0 +1,108 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Transactional batch of writes to one logical partition
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    with cosmos.batch('Andersen') as batch:
+##        batch.upsertItem(family)
+##        batch.createItem(child)
+##        batch.patchItem(family['id'], {'registered': True})
+##        batch.deleteItem('Andersen_old')
+##    for result in batch.results:              # ItemResult per operation, in order
+##        print(result.item['op'], result.error or 'ok')
+##
+## The operations run in one executeBatch stored procedure call, all or nothing, so they must share
+## the partition key. Large batches are split into chunks of max_operations within max_bytes of
+## payload; every chunk is its own transaction and the chunks run in order, stopping at the first
+## one that fails. A chunk that runs out of the stored procedure's time budget is run again in halves.
+##############################################################################################
+from CosmosSQLJson import getCodec
+
+def _operationSize(operation):
+    return len(getCodec().dumpb(operation))
+
+def chunkOperations(operations, max_operations = 100, max_bytes = 1500000):
+    """Split batch operations into chunks of at most max_operations and max_bytes of JSON.
+    An operation larger than max_bytes goes in a chunk of its own.
+    """
+    chunk, size = [], 0
+    for operation in operations:
+        operation_size = _operationSize(operation)
+        if chunk and (len(chunk) >= max_operations or size + operation_size > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(operation)
+        size += operation_size
+    if chunk:
+        yield chunk
+
+class Batch:
+    """Writes to one partition key collected and executed together by CosmosSQL.executeBatch.
+
+    Attributes:
+        partitionKey - partition key value shared by every operation
+        operations   - the operations collected, {'op', 'id', 'document'}
+        results      - ItemResult per operation once executed, else None
+    Methods:
+        createItem(document)
+        upsertItem(document)
+        replaceItem(document)
+        deleteItem(itemId)
+        patchItem(itemId, partialDoc)
+        execute()
+    """
+    def __init__(self, cosmos, partitionKey, max_operations = 100, max_bytes = 1500000):
+        self.cosmos = cosmos
+        self.partitionKey = partitionKey
+        self.max_operations = max_operations
+        self.max_bytes = max_bytes
+        self.operations = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        # Nothing is written when the block fails
+        if exception_type is None:
+            self.execute()
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __add(self, op, itemId, document = None):
+        if self.results is not None:
+            raise RuntimeError('Batch already executed')
+        self.operations.append({'op': op, 'id': itemId, 'document': document})
+        return self
+
+    def __document(self, op, document):
+        partition_key = self.cosmos.partitionKeyOf(document)
+        if partition_key != self.partitionKey:
+            raise ValueError('{0} {1}: partition key {2!r} is not the batch partition key {3!r}'.format(
+                op, document.get('id'), partition_key, self.partitionKey))
+        return self.__add(op, document['id'], document)
+
+    def createItem(self, document):
+        return self.__document('create', document)
+
+    def upsertItem(self, document):
+        return self.__document('upsert', document)
+
+    def replaceItem(self, document):
+        return self.__document('replace', document)
+
+    def deleteItem(self, itemId):
+        return self.__add('delete', itemId)
+
+    def patchItem(self, itemId, partialDoc):
+        """Merge the changed fields into the document, which must exist"""
+        return self.__add('patch', itemId, {key: value for key, value in partialDoc.items() if key != 'id'})
+
+    def execute(self):
+        """Run the operations, returns and keeps the ItemResult per operation"""
+        self.results = self.cosmos.executeBatch(self.partitionKey, self.operations, self.max_operations, self.max_bytes)
+        return self.results
@@ -0,0 +1,183 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: In-process read-through cache for CosmosSQL documents
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    from CosmosSQLCache import ItemCache
+##    cosmos = CosmosSQL('myDatabase', cache = ItemCache(max_size = 10000, ttl = 30))
+##    cosmos.readItem('id', 'partitionKey')   # served from the cache while fresh
+##    print(cosmos.cache.stats())
+##
+##    CosmosSQLClient.metadata = MetadataCache('/var/tmp/cosmos-metadata.json')  # warm restarts
+##############################################################################################
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+class ItemCache:
+    """Bounded LRU cache of documents with a per entry TTL.
+    Keys are (database_id, container_id, partition key, id); documents are shared, treat them as read-only.
+
+    Attributes:
+        max_size   - maximum number of entries, the least recently used is evicted first
+        ttl        - seconds an entry is served without asking the server
+        revalidate - keep expired entries and revalidate them with If-None-Match on _etag
+        hits, misses, revalidations - counters
+    Methods:
+        get(key)
+        stale(key)
+        put(key, document)
+        touch(key)
+        invalidate(key)
+        clear()
+        stats()
+    """
+    def __init__(self, max_size = 10000, ttl = 60, revalidate = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.revalidate = revalidate
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.__entries = OrderedDict()   # key -> (expires, document)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        """Fresh document for the key, None on a miss"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None and not self.revalidate:
+                del self.__entries[key]
+            self.misses += 1
+            return None
+
+    def stale(self, key):
+        """Expired document kept for revalidation, None if there is none"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def put(self, key, document):
+        """Cache a document, evicting the least recently used entries beyond max_size"""
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.ttl, document)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last = False)
+
+    def touch(self, key):
+        """Extend an entry the server confirmed as unchanged (304)"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries[key] = (time.monotonic() + self.ttl, entry[1])
+                self.__entries.move_to_end(key)
+                self.revalidations += 1
+
+    def invalidate(self, key):
+        """Drop an entry"""
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        """Drop all the entries"""
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        """Snapshot of the counters"""
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.__entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'hitRatio': self.hits / lookups if lookups else 0.0
+            }
+
+class MetadataCache:
+    """Database and container definitions keyed by account URI and resource link.
+    Shared by the CosmosSQL instances of a process; with a path it is also kept in a JSON file
+    so a warm restart resolves its metadata without any round trip. Entries may be stale, changed by
+    another process since. CosmosSQL drops and reads again a container when an upsert or a partition key
+    range read gets a 404, a database when creating a container in it does, and an offer when replacing it
+    gets a 404/412; other 404s (e.g. point reads) are taken as missing documents and keep the entries.
+
+    Methods:
+        get(uri, link)
+        put(uri, link, resource)
+        invalidate(uri, link)
+        clear()
+    """
+    def __init__(self, path = None):
+        self.path = path
+        self.__entries = {}
+        self.__lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.__entries = json.load(f)
+            except ValueError:
+                # A corrupt cache file only costs the round trips it would have saved
+                self.__entries = {}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def _key(uri, link):
+        return uri + ' ' + link
+
+    def get(self, uri, link):
+        """Cached resource, None if unknown"""
+        return self.__entries.get(self._key(uri, link))
+
+    def put(self, uri, link, resource):
+        """Cache a resource"""
+        with self.__lock:
+            self.__entries[self._key(uri, link)] = resource
+            self.__save()
+        return resource
+
+    def invalidate(self, uri, link):
+        """Forget a resource and everything under it"""
+        prefix = self._key(uri, link)
+        with self.__lock:
+            for key in [key for key in self.__entries if key == prefix or key.startswith(prefix + '/')]:
+                del self.__entries[key]
+            self.__save()
+
+    def clear(self):
+        """Forget everything"""
+        with self.__lock:
+            self.__entries.clear()
+            self.__save()
+
+    def __save(self):
+        if not self.path:
+            return
+        # A temp file of our own, processes sharing the path each replace it atomically
+        directory, name = os.path.split(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir = directory, prefix = name + '.', suffix = '.tmp', delete = False) as f:
+            temp_path = f.name
+            try:
+                json.dump(self.__entries, f)
+            except Exception:
+                f.close()
+                os.unlink(temp_path)
+                raise
+        os.replace(temp_path, self.path)
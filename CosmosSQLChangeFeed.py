@@ -0,0 +1,168 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Change feed reader with checkpoints per partition key range, for incremental sync
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    feed = cosmos.changeFeed(FileCheckpointStore('/var/lib/sync/checkpoints.json'), name = 'search-index')
+##    for batch in feed.batches():              # changes since the last run, then stops
+##        index(batch.items)                    # checkpointed once the next batch is asked for
+##
+##    feed.process(index_batch, max_degree_of_parallelism = 4, follow = True, stop = stop_event)
+##
+## Every partition key range keeps its own continuation (the change feed etag); ranges are read
+## in parallel while each range delivers its changes in order. Delivery is at least once: a batch
+## is checkpointed only after it has been handled, so a crash replays it.
+## A checkpoint store is any object with get(name, range_id) and put(name, range_id, continuation).
+##############################################################################################
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Changes of one partition key range, continuation resumes right after them
+ChangeBatch = namedtuple('ChangeBatch', ['range_id', 'items', 'continuation'])
+
+class MemoryCheckpointStore:
+    """Checkpoints kept in memory, for tests and one-off catch ups"""
+    def __init__(self):
+        self.__checkpoints = {}
+        self.__lock = threading.Lock()
+
+    def get(self, name, range_id):
+        with self.__lock:
+            return self.__checkpoints.get(name, {}).get(range_id)
+
+    def put(self, name, range_id, continuation):
+        with self.__lock:
+            self.__checkpoints.setdefault(name, {})[range_id] = continuation
+
+class FileCheckpointStore:
+    """Checkpoints in a local JSON file, rewritten atomically on every put"""
+    def __init__(self, path):
+        self.path = path
+        self.__checkpoints = {}
+        self.__lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.__checkpoints = json.load(f)
+
+    def get(self, name, range_id):
+        with self.__lock:
+            return self.__checkpoints.get(name, {}).get(range_id)
+
+    def put(self, name, range_id, continuation):
+        with self.__lock:
+            self.__checkpoints.setdefault(name, {})[range_id] = continuation
+            # A temp file of our own, processes checkpointing the same feed each replace the file atomically
+            directory, file_name = os.path.split(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile('w', dir = directory, prefix = file_name + '.', suffix = '.tmp', delete = False) as f:
+                temp_path = f.name
+                try:
+                    json.dump(self.__checkpoints, f)
+                except Exception:
+                    f.close()
+                    os.unlink(temp_path)
+                    raise
+            os.replace(temp_path, self.path)
+
+class ChangeFeedReader:
+    """Change feed of a container read per partition key range from the stored continuations.
+
+    Attributes:
+        name  - checkpoint name, one per consumer of the feed
+        store - checkpoint store
+    Methods:
+        batches(max_degree_of_parallelism = 4, follow = False, poll_interval = 5.0, stop = None)
+        process(callback, max_degree_of_parallelism = 4, follow = False, poll_interval = 5.0, stop = None)
+        continuations()
+    """
+    def __init__(self, fetch, ranges, store, name, start_from_beginning = True):
+        """fetch(range_id, continuation, start_from_beginning) returns (items, continuation) for one batch;
+        ranges are partition key range dicts, a split range's children resume from their parent's checkpoint
+        """
+        self.__fetch = fetch
+        self.__ranges = ranges
+        self.store = store
+        self.name = name
+        self.__start_from_beginning = start_from_beginning
+
+    def continuations(self):
+        """Stored continuation per range id (None for a range read from the start)"""
+        continuations = {}
+        for r in self.__ranges:
+            continuation = self.store.get(self.name, r['id'])
+            for parent in reversed(r.get('parents') or []):
+                if continuation is not None:
+                    break
+                continuation = self.store.get(self.name, parent)
+            continuations[r['id']] = continuation
+        return continuations
+
+    def __step(self, range_id, continuation, delay, stop, callback = None):
+        """Read (and with a callback handle and checkpoint) one batch of a range"""
+        if delay:
+            if stop is None:
+                time.sleep(delay)
+            elif stop.wait(delay):
+                return None
+        items, next_continuation = self.__fetch(range_id, continuation, self.__start_from_beginning)
+        batch = ChangeBatch(range_id, items, next_continuation or continuation)
+        if callback is not None and items:
+            callback(batch)
+            self.store.put(self.name, range_id, batch.continuation)
+        elif not items and continuation is None and next_continuation:
+            # A feed read from now on keeps its starting point even before the first change
+            self.store.put(self.name, range_id, next_continuation)
+        return batch
+
+    def __run(self, max_degree_of_parallelism, follow, poll_interval, stop, callback):
+        """Schedule the ranges, one batch in flight per range; yields the batches read"""
+        continuations = self.continuations()
+        with ThreadPoolExecutor(max_workers = max(1, max_degree_of_parallelism)) as executor:
+            pending = {executor.submit(self.__step, range_id, continuation, 0, stop, callback): range_id
+                       for range_id, continuation in continuations.items()}
+            try:
+                while pending:
+                    done, _ = wait(pending, return_when = FIRST_COMPLETED)
+                    for future in done:
+                        del pending[future]
+                        batch = future.result()
+                        if batch is None:
+                            continue
+                        if batch.items:
+                            yield batch
+                        if stop is not None and stop.is_set():
+                            continue
+                        if batch.items or follow:
+                            # Caught up ranges are polled again after poll_interval when following the feed
+                            delay = 0 if batch.items else poll_interval
+                            pending[executor.submit(self.__step, batch.range_id, batch.continuation, delay, stop, callback)] = batch.range_id
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def batches(self, max_degree_of_parallelism = 4, follow = False, poll_interval = 5.0, stop = None):
+        """Yield ChangeBatch as the ranges deliver them. A batch is checkpointed when the next one is
+        asked for (or the iteration ends), so a consumer that fails on a batch gets it again next time.
+        Without follow the iteration ends once every range is caught up; stop is an optional threading.Event.
+        """
+        previous = None
+        for batch in self.__run(max_degree_of_parallelism, follow, poll_interval, stop, None):
+            if previous is not None:
+                self.store.put(self.name, previous.range_id, previous.continuation)
+            previous = batch
+            yield batch
+        if previous is not None:
+            self.store.put(self.name, previous.range_id, previous.continuation)
+
+    def process(self, callback, max_degree_of_parallelism = 4, follow = False, poll_interval = 5.0, stop = None):
+        """Call callback(batch) on the range workers, ranges in parallel, and checkpoint after each call.
+        Returns the number of changes handled; an exception from the callback stops the processing.
+        """
+        return sum(len(batch.items) for batch in self.__run(max_degree_of_parallelism, follow, poll_interval, stop, callback))
@@ -0,0 +1,202 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Query results decoded page by page into NumPy or Arrow column chunks
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    for chunk in cosmos.queryColumns('SELECT * FROM c WHERE c.year = 2019',
+##                                     columns = ['id', 'price', 'address.city'], dtypes = {'price': 'float32'}):
+##        totals += chunk['price'].sum()                     # {column: numpy array}
+##
+##    tables = cosmos.queryColumns(query, columns = ['id', 'price'], output = 'arrow')
+##    table = pyarrow.concat_tables(tables)
+##
+## With SELECT * and columns the query is rewritten to project just those fields, so the pages
+## carry nothing else. Each page is written straight into preallocated column arrays of
+## chunk_size rows and dropped, a chunk is handed out once full.
+## Column types come from dtypes, else from the values of each chunk: bool, int64, float64, widened
+## as the data requires (int64 to float64, anything mixed to object); give dtypes for the same types
+## in every chunk. Missing values are NaN in float columns, None in object ones and nulls in Arrow;
+## int and bool columns with missing values become float64 and object NumPy arrays.
+## Needs numpy ($pip install numpy), and pyarrow for Arrow output ($pip install pyarrow).
+##############################################################################################
+try:
+    import numpy
+except ImportError:
+    # Optional, only queryColumns needs it
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    # Optional, only Arrow output needs it
+    pyarrow = None
+
+from CosmosSQLQuery import pathExpression
+
+_MISSING = object()
+
+def _kindOf(value):
+    """Inferred dtype of a value, None for null"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int64'
+    if isinstance(value, float):
+        return 'float64'
+    return 'object'
+
+def _widen(kind, value_kind):
+    """dtype holding both kinds"""
+    if value_kind is None or kind == value_kind:
+        return kind
+    if kind is None:
+        return value_kind
+    if kind in ('int64', 'float64') and value_kind in ('int64', 'float64'):
+        return 'float64'
+    return 'object'
+
+def _lookup(row, path):
+    """Value at a path of a result, _MISSING if absent"""
+    value = row
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def flattenFields(document, prefix = ''):
+    """Leaf field paths of a document ('address.city'), system properties left out"""
+    fields = []
+    for key, value in document.items():
+        if not prefix and key[:1] == '_':
+            continue
+        if isinstance(value, dict) and value:
+            fields += flattenFields(value, prefix + key + '.')
+        else:
+            fields.append(prefix + key)
+    return fields
+
+def projectColumns(query, plan, columns):
+    """Rewrite a SELECT * query ({'query', 'parameters'}) to project only the columns, as c0, c1, ...
+    Returns (query, paths) where paths locate every column in the results, None to infer the columns.
+    """
+    if not columns:
+        return query, None
+    if plan is None or plan.projection is not None or plan.value:
+        return query, [column.split('.') for column in columns]
+    projection = ', '.join('{0} AS c{1}'.format(pathExpression(column, plan.alias), i) for i, column in enumerate(columns))
+    text = plan.select_text + ' ' + projection + ' ' + plan.from_text
+    return {'query': text, 'parameters': query.get('parameters', [])}, [['c{0}'.format(i)] for i in range(len(columns))]
+
+class _Column:
+    """Preallocated array of one column in the current chunk, widened when a value does not fit"""
+    def __init__(self, capacity, dtype = None):
+        self.fixed = dtype is not None
+        self.kind = None
+        self.values = None
+        self.mask = numpy.zeros(capacity, dtype = bool)
+        if self.fixed:
+            self.kind = numpy.dtype(object if dtype in ('str', str) else dtype)
+            self.values = numpy.zeros(capacity, dtype = self.kind)
+
+    def set(self, i, value):
+        if value is None or value is _MISSING:
+            self.mask[i] = True
+            return
+        if not self.fixed:
+            kind = _widen(self.kind, _kindOf(value))
+            if kind != self.kind:
+                self.values = numpy.zeros(len(self.mask), dtype = kind) if self.values is None else self.values.astype(kind)
+                self.kind = kind
+        try:
+            self.values[i] = value
+        except OverflowError:
+            if self.fixed:
+                raise
+            # Beyond int64
+            self.values, self.kind = self.values.astype(object), 'object'
+            self.values[i] = value
+
+    def numpy(self, n):
+        values = self.values[:n] if self.values is not None else numpy.full(n, None, dtype = object)
+        mask = self.mask[:n]
+        if not mask.any():
+            return values
+        if values.dtype.kind in 'iu':
+            values = values.astype('float64')
+        elif values.dtype.kind == 'b':
+            values = values.astype(object)
+        if values.dtype.kind == 'f':
+            values[mask] = numpy.nan
+        elif values.dtype.kind in 'mM':
+            values[mask] = numpy.datetime64('NaT')
+        else:
+            values[mask] = None
+        return values
+
+    def arrow(self, n):
+        values = self.values[:n] if self.values is not None else numpy.full(n, None, dtype = object)
+        mask = self.mask[:n]
+        if values.dtype == object:
+            values = values.copy()
+            values[mask] = None
+            return pyarrow.array(values, from_pandas = True)
+        return pyarrow.array(values, mask = mask if mask.any() else None)
+
+class ColumnDecoder:
+    """Decodes query results into column chunks of at most chunk_size rows.
+
+    Attributes:
+        columns - column names, inferred from the first result when not given
+    Methods:
+        add(rows)
+        finish()
+    """
+    def __init__(self, columns = None, dtypes = None, chunk_size = 10000, output = 'numpy', paths = None):
+        if numpy is None:
+            raise ImportError('queryColumns needs the numpy package')
+        if output == 'arrow' and pyarrow is None:
+            raise ImportError('Arrow output needs the pyarrow package')
+        if output not in ('numpy', 'arrow'):
+            raise ValueError('Unknown output ' + str(output))
+        self.columns = list(columns) if columns else None
+        self.__paths = paths or ([column.split('.') for column in self.columns] if self.columns else None)
+        self.__dtypes = dtypes or {}
+        self.__chunk_size = chunk_size
+        self.__output = output
+        self.__chunk = None
+        self.__rows = 0
+
+    def __start(self):
+        self.__chunk = [_Column(self.__chunk_size, self.__dtypes.get(column)) for column in self.columns]
+        self.__rows = 0
+
+    def add(self, rows):
+        """Write rows (result dicts) into the columns, yields every chunk filled up"""
+        for row in rows:
+            if self.columns is None:
+                self.columns = flattenFields(row) if isinstance(row, dict) else []
+                self.__paths = [column.split('.') for column in self.columns]
+            if self.__chunk is None:
+                self.__start()
+            for column, path in zip(self.__chunk, self.__paths):
+                column.set(self.__rows, _lookup(row, path))
+            self.__rows += 1
+            if self.__rows == self.__chunk_size:
+                yield self.__emit()
+
+    def finish(self):
+        """The last, partial chunk, None if there is none"""
+        return self.__emit() if self.__chunk is not None and self.__rows else None
+
+    def __emit(self):
+        chunk, rows = self.__chunk, self.__rows
+        self.__chunk, self.__rows = None, 0
+        if self.__output == 'arrow':
+            return pyarrow.Table.from_arrays([column.arrow(rows) for column in chunk], names = self.columns)
+        return {name: column.numpy(rows) for name, column in zip(self.columns, chunk)}
@@ -0,0 +1,149 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Deadlines and hedged requests for point reads, to cut the latency tail
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    hedge = HedgePolicy(percentile = 95, max_ratio = 0.05)   # share one policy between calls
+##    item = cosmos.readItem('Andersen.1', 'Andersen', deadline = 0.2, hedge = hedge)
+##    items = cosmos.readItems(keys, deadline = 1.0, hedge = hedge)
+##    print(hedge.stats())                                    # reads, hedges, hedge wins, delay
+##
+## A read still running after the hedge delay (by default the 95th percentile of the latest reads)
+## is sent a second time, the first response wins. Hedges are capped at max_ratio of the reads, so a
+## slow service is not loaded twice over. Reads beyond their deadline raise a 408 HTTPFailure.
+## A read that already started can't be interrupted: the loser or a read past its deadline runs to
+## completion on a pool thread and its result is dropped, while a read still queued is cancelled.
+##############################################################################################
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import azure.cosmos.errors as errors
+import azure.cosmos.http_constants as http_constants
+
+from CosmosSQLMetrics import LatencyHistogram
+
+# Reads past their deadline keep a thread until they complete, so the pool is roomy
+MAX_WORKERS = 128
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers = MAX_WORKERS)
+        return _executor
+
+def deadlineExceeded(operation, deadline):
+    return errors.HTTPFailure(http_constants.StatusCodes.REQUEST_TIMEOUT,
+                              '{0} exceeded its deadline of {1}s'.format(operation, deadline))
+
+class HedgePolicy:
+    """When to send a duplicate of a slow read, learnt from the latency of the reads it hedges.
+
+    Attributes:
+        delay       - fixed seconds before hedging, None to use the percentile of the latest reads
+        percentile  - latency percentile used as the delay
+        max_ratio   - hedges allowed per read
+        min_samples - reads observed before hedging with a learnt delay
+        window      - reads per latency window, the delay follows the latest full window
+    Methods:
+        hedgeDelay()
+        allow()
+        observe(latency)
+        won()
+        stats()
+    """
+    def __init__(self, delay = None, percentile = 95, max_ratio = 0.1, min_samples = 100, window = 10000):
+        self.delay = delay
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self.__latency = LatencyHistogram()
+        self.__learnt = None
+        self.__windows = 0
+        self.__reads = 0           # reads and hedges of the current window, for max_ratio
+        self.__hedges = 0
+        self.__stats = {'reads': 0, 'hedges': 0, 'hedgeWins': 0}
+        self.__lock = threading.Lock()
+
+    def hedgeDelay(self):
+        """Seconds to wait for a read before hedging it, None not to hedge"""
+        return self.delay if self.delay is not None else self.__learnt
+
+    def allow(self):
+        """Take a hedge from the budget, False when max_ratio is reached"""
+        with self.__lock:
+            if self.__hedges + 1 > self.max_ratio * max(self.__reads, 1):
+                return False
+            self.__hedges += 1
+            self.__stats['hedges'] += 1
+            return True
+
+    def observe(self, latency):
+        """Account for a first attempt that completed in latency seconds"""
+        with self.__lock:
+            self.__reads += 1
+            self.__stats['reads'] += 1
+            self.__latency.record(latency)
+            count = self.__latency.count
+            if count == self.window:
+                self.__learnt = self.__latency.percentile(self.percentile)
+                self.__latency = LatencyHistogram()
+                self.__reads = self.__hedges = 0
+                self.__windows += 1
+            elif not self.__windows and count % self.min_samples == 0:
+                # Until the first window is full
+                self.__learnt = self.__latency.percentile(self.percentile)
+
+    def won(self):
+        with self.__lock:
+            self.__stats['hedgeWins'] += 1
+
+    def stats(self):
+        with self.__lock:
+            return dict(self.__stats, delay = self.hedgeDelay())
+
+def hedgedCall(operation, fn, deadline = None, hedge = None):
+    """fn() on a pool thread, hedged after hedge.hedgeDelay() and bounded by deadline seconds.
+    Returns the first successful result; when every attempt fails, the first error.
+    """
+    start = time.perf_counter()
+    expires = start + deadline if deadline is not None else None
+    remaining = lambda: None if expires is None else max(0.0, expires - time.perf_counter())
+    primary = _pool().submit(fn)
+    if hedge is not None:
+        primary.add_done_callback(lambda future: future.cancelled() or hedge.observe(time.perf_counter() - start))
+    attempts = [primary]
+    delay = hedge.hedgeDelay() if hedge is not None else None
+    if delay is not None and (expires is None or start + delay < expires):
+        wait(attempts, timeout = delay)
+        if not primary.done() and hedge.allow():
+            attempts.append(_pool().submit(fn))
+    pending = set(attempts)
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout = remaining(), return_when = FIRST_COMPLETED)
+        if not done:
+            break
+        for future in attempts:
+            if future not in done:
+                continue
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                if future is not primary:
+                    hedge.won()
+                return future.result()
+            error = error or future.exception()
+    for future in pending:
+        future.cancel()
+    if error is not None and not pending:
+        raise error
+    raise deadlineExceeded(operation, deadline)
@@ -0,0 +1,96 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Declarative indexing policies, compared with the one a container has
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    policy = indexingPolicy(included = ['category', 'price', 'address.city'],
+##                            excluded = ['/*', 'payload'],
+##                            composite = [['category', 'price DESC']],
+##                            spatial = ['location'])
+##    cosmos.createContainer('products', '/category', indexing_policy = policy)
+##    cosmos.replaceIndexingPolicy(policy)                  # only sent when it differs, returns the diff
+##    cosmos.waitForIndexing(progress = lambda percent: print(percent, '%'))
+##
+## Fields are written as in queries ('address.city') or as index paths ('/address/city/?').
+## A field includes or excludes its whole subtree; composite indexes serve ORDER BY on several
+## fields (and filters with ORDER BY), in the order given. Excluding large fields that are never
+## queried saves write RU and storage, every path is indexed by default.
+##############################################################################################
+
+SPATIAL_TYPES = ['Point', 'LineString', 'Polygon', 'MultiPolygon']
+
+# The service always excludes _etag, so a policy without it still matches
+_ETAG_PATH = '/"_etag"/?'
+
+def indexPath(field, suffix = '/*'):
+    """Index path of a field: 'address.city' gives /address/city/*, paths starting with / are kept"""
+    if field.startswith('/'):
+        return field
+    return '/' + '/'.join(field.split('.')) + suffix
+
+def _compositePath(entry):
+    """{'path', 'order'} of 'price', 'price DESC' or ('price', 'descending')"""
+    if isinstance(entry, (list, tuple)):
+        field, order = entry
+    else:
+        field, _, order = entry.strip().partition(' ')
+    order = order.strip().lower() or 'ascending'
+    order = {'asc': 'ascending', 'desc': 'descending'}.get(order, order)
+    if order not in ('ascending', 'descending'):
+        raise ValueError('Unknown composite index order ' + order)
+    return {'path': indexPath(field, ''), 'order': order}
+
+def indexingPolicy(included = None, excluded = None, composite = None, spatial = None, mode = 'consistent', automatic = True):
+    """Indexing policy of a container.
+    included, excluded - fields or index paths; everything is included by default
+    composite          - lists of fields, each 'field' or 'field DESC'
+    spatial            - fields of GeoJSON values, or (field, types) to index only some geometry types
+    """
+    policy = {
+        'indexingMode': mode,
+        'automatic': automatic,
+        'includedPaths': [{'path': indexPath(field)} for field in (included or ['/*'])],
+        'excludedPaths': [{'path': indexPath(field)} for field in (excluded or [])]
+    }
+    if composite:
+        policy['compositeIndexes'] = [[_compositePath(entry) for entry in fields] for fields in composite]
+    if spatial:
+        policy['spatialIndexes'] = []
+        for entry in spatial:
+            field, types = entry if isinstance(entry, (list, tuple)) else (entry, SPATIAL_TYPES)
+            policy['spatialIndexes'].append({'path': indexPath(field), 'types': list(types)})
+    return policy
+
+def normalizePolicy(policy):
+    """Comparable form of an indexing policy, as given or as the service returns it"""
+    policy = policy or {}
+    excluded = set(path['path'] for path in policy.get('excludedPaths') or [])
+    excluded.add(_ETAG_PATH)
+    return {
+        'indexingMode': (policy.get('indexingMode') or 'consistent').lower(),
+        'automatic': policy.get('automatic', True),
+        'includedPaths': sorted(set(path['path'] for path in policy.get('includedPaths') or [{'path': '/*'}])),
+        'excludedPaths': sorted(excluded),
+        'compositeIndexes': sorted(tuple((path['path'], (path.get('order') or 'ascending').lower()) for path in composite)
+                                   for composite in policy.get('compositeIndexes') or []),
+        'spatialIndexes': sorted((index['path'], tuple(sorted(index.get('types') or []))) for index in policy.get('spatialIndexes') or [])
+    }
+
+def diffPolicy(current, desired):
+    """What changes from the current indexing policy to the desired one, {} when they match.
+    Lists give {'added', 'removed'}, settings {'from', 'to'}.
+    """
+    current, desired = normalizePolicy(current), normalizePolicy(desired)
+    diff = {}
+    for name in desired:
+        if current[name] == desired[name]:
+            continue
+        if isinstance(desired[name], list):
+            diff[name] = {'added': [entry for entry in desired[name] if entry not in current[name]],
+                          'removed': [entry for entry in current[name] if entry not in desired[name]]}
+        else:
+            diff[name] = {'from': current[name], 'to': desired[name]}
+    return diff
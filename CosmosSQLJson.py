@@ -0,0 +1,142 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Pluggable JSON codec, orjson when installed, for output, export/import and request bodies
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    setCodec('orjson')                   # or 'json', 'auto' (the default) or a JsonCodec
+##    setCodec('orjson', sdk = True)       # the SDK request bodies and responses as well
+##    cosmos.listItemsJson(sys.stdout.buffer, lines = True)
+##    with open('products.jsonl', 'wb') as f:
+##        writeJson(cosmos.queryItems(), f, lines = True)
+##
+## orjson ($pip install orjson) encodes and decodes several times faster than the json module.
+## Both write compact UTF-8 JSON; orjson only indents by 2 spaces and can't encode integers beyond
+## 64 bits, such documents fall back to the json module. It reads them as floats, as the service does.
+## With sdk = True the SDK's request module uses the codec too, installed when the first client
+## connects; that patches the azure-cosmos 3.x synchronized_request module for the whole process.
+##############################################################################################
+import io
+import json
+import sys
+
+try:
+    import orjson
+except ImportError:
+    # Optional, the json module is used without it
+    orjson = None
+
+class JsonCodec:
+    """JSON codec on the json module.
+
+    Methods:
+        dumps(obj, indent = False)
+        dumpb(obj, indent = False)
+        loads(data)
+    """
+    name = 'json'
+
+    def dumps(self, obj, indent = False):
+        """JSON text of obj, compact unless indent"""
+        if indent:
+            return json.dumps(obj, ensure_ascii = False, indent = 2)
+        return json.dumps(obj, ensure_ascii = False, separators = (',', ':'))
+
+    def dumpb(self, obj, indent = False):
+        """UTF-8 JSON of obj"""
+        return self.dumps(obj, indent).encode('utf-8')
+
+    def loads(self, data):
+        """Object of JSON text or bytes"""
+        return json.loads(data)
+
+class OrjsonCodec(JsonCodec):
+    """JSON codec on orjson"""
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('The orjson codec needs the orjson package')
+
+    def dumpb(self, obj, indent = False):
+        try:
+            return orjson.dumps(obj, option = orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            # e.g. integers beyond 64 bits, orjson.JSONEncodeError is a TypeError
+            return JsonCodec.dumps(self, obj, indent).encode('utf-8')
+
+    def dumps(self, obj, indent = False):
+        return self.dumpb(obj, indent).decode('utf-8')
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+CODECS = {'json': JsonCodec, 'orjson': OrjsonCodec}
+
+_codec = None
+_sdk_codec = None
+
+def setCodec(codec = 'auto', sdk = False):
+    """Use a codec: 'json', 'orjson', 'auto' (orjson when installed) or a JsonCodec instance.
+    sdk = True routes the SDK's request bodies and responses through it too. Returns the codec.
+    """
+    global _codec, _sdk_codec
+    if codec == 'auto':
+        codec = 'orjson' if orjson is not None else 'json'
+    if not isinstance(codec, JsonCodec):
+        if codec not in CODECS:
+            raise ValueError('Unknown JSON codec {0}, one of {1}'.format(codec, ', '.join(sorted(CODECS))))
+        codec = CODECS[codec]()
+    _codec = codec
+    if sdk:
+        _sdk_codec = codec
+        installSdkCodec()
+    return codec
+
+def getCodec():
+    """The codec in use, 'auto' until set"""
+    return _codec or setCodec()
+
+class _SdkJson:
+    """Stand-in for the json module in the SDK's request module"""
+    def __init__(self, codec):
+        self.__codec = codec
+
+    def dumps(self, obj, **kwargs):
+        return self.__codec.dumps(obj)
+
+    def loads(self, data, **kwargs):
+        return self.__codec.loads(data)
+
+def installSdkCodec():
+    """Hand the SDK codec to the SDK once it is imported, CosmosSQLClient calls this as it connects"""
+    module = sys.modules.get('azure.cosmos.synchronized_request')
+    if _sdk_codec is not None and module is not None:
+        module.json = _SdkJson(_sdk_codec)
+
+def _isBinary(fp):
+    return isinstance(fp, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(fp, 'mode', '')
+
+def writeJson(items, fp, lines = False, indent = True, codec = None, batch_size = 1000):
+    """Stream documents to a text or binary file object, one JSON line each with lines, else indented
+    one after the other. Documents are encoded and written batch_size at a time. Returns the count.
+    """
+    codec = codec or getCodec()
+    binary = _isBinary(fp)
+    separator = b'\n' if binary else '\n'
+    encode = codec.dumpb if binary else codec.dumps
+    indent = indent and not lines
+    count = 0
+    batch = []
+    for item in items:
+        batch.append(encode(item, indent))
+        if len(batch) >= batch_size:
+            fp.write(separator.join(batch) + separator)
+            count += len(batch)
+            batch = []
+    if batch:
+        fp.write(separator.join(batch) + separator)
+        count += len(batch)
+    return count
@@ -0,0 +1,547 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: In-process stand-in for the CosmosClient surface CosmosSQL uses, for offline benchmarks
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    from CosmosSQLLocal import LocalCosmosClient
+##    client = LocalCosmosClient(latency = 0.002, jitter = 0.001, throttle_ru_per_second = 5000)
+##    cosmos = CosmosSQL('benchDatabase', client = client)
+##
+## Documents live in memory per container and physical partition. Every call sleeps for the
+## configured latency, is charged RU roughly the way the service charges them and may be
+## throttled with a 429 carrying x-ms-retry-after-ms.
+## Queries support the Cosmos SQL subset of CosmosSQLQuery.
+##############################################################################################
+import copy
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+import azure.cosmos.errors as errors
+import azure.cosmos.http_constants as http_constants
+
+from CosmosSQLMetrics import requestTracker
+from CosmosSQLQuery import Query, QueryPlanCache
+from CosmosSQLQueryLog import QUERY_METRICS_HEADER
+
+###################################################################################
+# Client stand-in
+class _QueryResults:
+    """Query iterable with the paging surface of the SDK's QueryIterable"""
+    def __init__(self, client, results, options, charge_per_page, scanned = 0, execution_time = 0.0):
+        self.__client = client
+        self.__results = results
+        self.__options = options
+        self.__charge = charge_per_page
+        self.__scanned = scanned
+        self.__execution_time = execution_time
+        self.__next = int(options.get('continuation') or 0)
+        self.__first = True
+
+    def __iter__(self):
+        while True:
+            page = self.fetch_next_block()
+            if not page:
+                return
+            for item in page:
+                yield item
+
+    def fetch_next_block(self):
+        if self.__next is None:
+            return []
+        size = self.__options.get('maxItemCount') or 100
+        if size < 0:
+            size = len(self.__results) or 1
+        page = self.__results[self.__next:self.__next + size]
+        self.__next = self.__next + size if self.__next + size < len(self.__results) else None
+        headers = {}
+        if self.__next is not None:
+            headers[http_constants.HttpHeaders.Continuation] = str(self.__next)
+        if self.__options.get('populateQueryMetrics'):
+            # No index here: every document is retrieved, the matching ones count as index hits
+            first = self.__first
+            headers[QUERY_METRICS_HEADER] = 'retrievedDocumentCount={0};outputDocumentCount={1};indexHitDocumentCount={2};totalExecutionTimeInMs={3:.2f}'.format(
+                self.__scanned if first else 0, len(page), len(self.__results) if first else 0, self.__execution_time * 1000 if first else 0)
+        # The query itself is charged with the first page, later pages only pay for their documents
+        self.__client._respond((self.__charge if self.__first else 0) + len(page) * 0.1, payload = page, headers = headers)
+        self.__first = False
+        return copy.deepcopy(page)
+
+class _ChangeFeedResults:
+    """One change feed page, the etag (the LSN of its last change) is the next continuation"""
+    def __init__(self, client, changes, etag):
+        self.__client = client
+        self.__changes = changes
+        self.__etag = etag
+        self.__fetched = False
+
+    def __iter__(self):
+        return iter(self.fetch_next_block())
+
+    def fetch_next_block(self):
+        if self.__fetched:
+            return []
+        self.__fetched = True
+        status = 200 if self.__changes else http_constants.StatusCodes.NOT_MODIFIED
+        self.__client._respond(1.0 + len(self.__changes) * 0.1, payload = self.__changes,
+                               headers = {http_constants.HttpHeaders.ETag: self.__etag}, status = status)
+        return copy.deepcopy(self.__changes)
+
+class LocalCosmosClient:
+    """In-memory stand-in for azure.cosmos.cosmos_client.CosmosClient.
+
+    Attributes:
+        latency                - seconds every call takes
+        jitter                 - extra uniform random seconds per call
+        throttle_ru_per_second - RU budget per second, calls beyond it get a 429 (None = unlimited);
+                                 follows the offers replaced, as a container's provisioned throughput
+        throttle_rate          - probability of a random 429 on any call
+        max_throttle_retries   - 429s retried internally per call, as the SDK's RetryOptions do (9)
+        partition_count        - physical partitions per container
+        max_sproc_operations   - operations a stored procedure gets through before running out of
+                                 its time budget (None = unlimited)
+        last_response_headers  - headers of the latest call, as on the real client
+        url_connection         - a unique local:// URI
+    """
+    def __init__(self, latency = 0.0, jitter = 0.0, throttle_ru_per_second = None, throttle_rate = 0.0, partition_count = 4, max_throttle_retries = 9,
+                 max_sproc_operations = None):
+        self.latency = latency
+        self.max_sproc_operations = max_sproc_operations
+        self.max_throttle_retries = max_throttle_retries
+        self.jitter = jitter
+        self.throttle_ru_per_second = throttle_ru_per_second
+        self.throttle_rate = throttle_rate
+        self.partition_count = partition_count
+        self.url_connection = 'local://' + str(uuid.uuid4())
+        self.last_response_headers = {}
+        self.__databases = {}
+        self.__containers = {}
+        self.__documents = {}      # collection link -> {(partition key json, id): document}
+        self.__offers = {}
+        self.__reindexing = {}     # collection link -> (start, end) of the latest indexing policy change
+        self.__lsn = 0             # sequence number of the latest write, for the change feed
+        self.__sprocs = {}
+        self.__procedures = {'patchItem': LocalCosmosClient._patchItemProcedure,
+                             'deleteWhere': LocalCosmosClient._deleteWhereProcedure,
+                             'executeBatch': LocalCosmosClient._executeBatchProcedure}
+        self.__plans = QueryPlanCache()    # like the service, parse a query shape once
+        self.__lock = threading.RLock()
+        self.__ru_available = float(throttle_ru_per_second or 0)
+        self.__ru_refilled = time.monotonic()
+
+    # Simulation
+    def registerProcedure(self, sproc_id, procedure):
+        """Python body for a stored procedure: procedure(client, collection_link, partition_key, *params)"""
+        self.__procedures[sproc_id] = procedure
+
+    @contextmanager
+    def _transaction(self, collection_link):
+        """Run a stored procedure body alone on the container, undoing its writes if it raises"""
+        link, _ = self._container(collection_link)
+        with self.__lock:
+            snapshot = dict(self.__documents[link])
+            try:
+                yield
+            except Exception:
+                self.__documents[link] = snapshot
+                raise
+
+    def _admit(self, charge):
+        """Sleep for the call latency and throttle it (429) beyond the RU budget, before it has any effect.
+        Like the SDK, throttled calls are retried max_throttle_retries times before the 429 is raised.
+        """
+        for attempt in range(self.max_throttle_retries + 1):
+            try:
+                return self.__admitOnce(charge)
+            except errors.HTTPFailure as e:
+                if attempt == self.max_throttle_retries:
+                    raise
+                time.sleep(float(e.headers[http_constants.HttpHeaders.RetryAfterInMilliseconds]) / 1000)
+
+    def __admitOnce(self, charge):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        throttled = self.throttle_rate and random.random() < self.throttle_rate
+        wait_ms = 10
+        if self.throttle_ru_per_second:
+            with self.__lock:
+                now = time.monotonic()
+                self.__ru_available = min(float(self.throttle_ru_per_second),
+                                          self.__ru_available + (now - self.__ru_refilled) * self.throttle_ru_per_second)
+                self.__ru_refilled = now
+                if self.__ru_available < charge:
+                    throttled = True
+                    wait_ms = int(1000 * (charge - self.__ru_available) / self.throttle_ru_per_second) + 1
+                else:
+                    self.__ru_available -= charge
+        if throttled:
+            throttle_headers = {http_constants.HttpHeaders.RequestCharge: '0',
+                                http_constants.HttpHeaders.RetryAfterInMilliseconds: str(wait_ms)}
+            self.last_response_headers = throttle_headers
+            requestTracker.observe(0.0, http_constants.StatusCodes.TOO_MANY_REQUESTS, headers = throttle_headers)
+            raise errors.HTTPFailure(http_constants.StatusCodes.TOO_MANY_REQUESTS, 'Request rate is large', throttle_headers)
+
+    def _respond(self, charge, payload = None, headers = None, status = 200, admitted = False):
+        """Charge for a call, admitting it first unless that was done before a write"""
+        if not admitted:
+            self._admit(charge)
+        response_headers = {
+            http_constants.HttpHeaders.RequestCharge: str(round(charge, 2)),
+            http_constants.HttpHeaders.ActivityId: str(uuid.uuid4())
+        }
+        response_headers.update(headers or {})
+        self.last_response_headers = response_headers
+        requestTracker.observe(charge, status, len(json.dumps(payload)) if payload is not None else 0, response_headers)
+        return response_headers
+
+    def _fail(self, status, message):
+        self.last_response_headers = {http_constants.HttpHeaders.RequestCharge: '1'}
+        requestTracker.observe(1.0, status, headers = self.last_response_headers)
+        raise errors.HTTPFailure(status, message, self.last_response_headers)
+
+    @staticmethod
+    def _charge(document, write):
+        """About 1 RU per KB read and 5 RU per KB written"""
+        kb = max(1.0, len(json.dumps(document)) / 1024.0)
+        return kb * (5.0 if write else 1.0)
+
+    @staticmethod
+    def _trim(link):
+        return link.strip('/')
+
+    def _container(self, collection_link):
+        link = self._trim(collection_link)
+        if link not in self.__containers:
+            self._fail(http_constants.StatusCodes.NOT_FOUND, 'Container {0} does not exist'.format(link))
+        return link, self.__containers[link]
+
+    def _partitionKey(self, container, document):
+        value = document
+        for part in container['partitionKey']['paths'][0].strip('/').split('/'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def _plan(self, query):
+        _, plan = self.__plans.get(query)
+        return plan or Query(query)
+
+    def partitionOf(self, partition_key):
+        """Physical partition holding a partition key value"""
+        return zlib.crc32(json.dumps(partition_key).encode('utf-8')) % self.partition_count
+
+    def _split(self, document_link):
+        link = self._trim(document_link)
+        collection_link, _, item_id = link.rpartition('/docs/')
+        return collection_link, item_id
+
+    def _stamp(self, document):
+        document['_etag'] = '"' + str(uuid.uuid4()) + '"'
+        document['_ts'] = int(time.time())
+        document['_rid'] = document.get('_rid') or str(uuid.uuid4())[:8]
+        self.__lsn += 1
+        document['_lsn'] = self.__lsn
+        return document
+
+    def _sessionToken(self, partition_key, lsn):
+        """x-ms-session-token header of a write, range:version#lsn as the service sends it"""
+        return {http_constants.HttpHeaders.SessionToken: '{0}:-1#{1}'.format(self.partitionOf(partition_key), lsn)}
+
+    # Databases
+    def CreateDatabase(self, database, options = None):
+        with self.__lock:
+            if database['id'] in self.__databases:
+                self._fail(http_constants.StatusCodes.CONFLICT, 'Database {0} already exists'.format(database['id']))
+            self.__databases[database['id']] = dict(database, _self = 'dbs/' + database['id'] + '/', _rid = database['id'])
+        self._respond(1.0)
+        return dict(self.__databases[database['id']])
+
+    def ReadDatabase(self, database_link, options = None):
+        database_id = self._trim(database_link).split('/')[1]
+        if database_id not in self.__databases:
+            self._fail(http_constants.StatusCodes.NOT_FOUND, 'Database {0} does not exist'.format(database_id))
+        self._respond(1.0)
+        return dict(self.__databases[database_id])
+
+    def ReadDatabases(self, options = None):
+        self._respond(1.0)
+        return [dict(d) for d in self.__databases.values()]
+
+    def QueryDatabases(self, query, options = None):
+        results, _ = Query(query).run(self.__databases.values())
+        self._respond(2.0)
+        return results
+
+    # Containers
+    def CreateContainer(self, database_link, collection, options = None):
+        link = self._trim(database_link) + '/colls/' + collection['id']
+        with self.__lock:
+            if link.split('/')[1] not in self.__databases:
+                self._fail(http_constants.StatusCodes.NOT_FOUND, 'Database {0} does not exist'.format(link.split('/')[1]))
+            if link in self.__containers:
+                self._fail(http_constants.StatusCodes.CONFLICT, 'Container {0} already exists'.format(link))
+            container = copy.deepcopy(collection)
+            container.update({'_self': link + '/', '_rid': str(uuid.uuid4())[:8], '_etag': '"' + str(uuid.uuid4()) + '"'})
+            container.setdefault('indexingPolicy', {'indexingMode': 'consistent', 'automatic': True,
+                                                    'includedPaths': [{'path': '/*'}], 'excludedPaths': [{'path': '/"_etag"/?'}]})
+            self.__containers[link] = container
+            self.__documents[link] = {}
+            throughput = (options or {}).get('offerThroughput', 400)
+            offer_id = str(uuid.uuid4())[:8]
+            self.__offers[container['_rid']] = {'id': offer_id, '_self': 'offers/' + offer_id + '/', 'offerResourceId': container['_rid'],
+                                                'offerVersion': 'V2', 'content': {'offerThroughput': throughput}}
+        self._respond(1.0)
+        return copy.deepcopy(container)
+
+    def ReadContainer(self, collection_link, options = None):
+        link, container = self._container(collection_link)
+        headers = {}
+        if (options or {}).get('populateQuotaInfo'):
+            start, end = self.__reindexing.get(link, (0.0, 0.0))
+            now = time.monotonic()
+            percent = 100 if now >= end else int(100 * (now - start) / (end - start))
+            headers[http_constants.HttpHeaders.IndexTransformationProgress] = str(percent)
+        self._respond(1.0, headers = headers)
+        return copy.deepcopy(container)
+
+    def ReplaceContainer(self, collection_link, collection, options = None):
+        link, container = self._container(collection_link)
+        with self.__lock:
+            replaced = copy.deepcopy(collection)
+            replaced.update({'_self': container['_self'], '_rid': container['_rid'], '_etag': '"' + str(uuid.uuid4()) + '"'})
+            if replaced.get('indexingPolicy') != container.get('indexingPolicy'):
+                # Reindexing in the background takes about 0.5 ms per document
+                now = time.monotonic()
+                self.__reindexing[link] = (now, now + len(self.__documents[link]) * 0.0005)
+            self.__containers[link] = replaced
+        self._respond(1.0)
+        return copy.deepcopy(replaced)
+
+    def DeleteContainer(self, collection_link, options = None):
+        link, container = self._container(collection_link)
+        with self.__lock:
+            del self.__containers[link]
+            del self.__documents[link]
+            self.__reindexing.pop(link, None)
+            self.__offers.pop(container['_rid'], None)
+        self._respond(1.0)
+
+    # Offers
+    def QueryOffers(self, query, options = None):
+        results, _ = Query(query).run(self.__offers.values())
+        self._respond(2.0)
+        return copy.deepcopy(results)
+
+    def ReplaceOffer(self, offer_link, offer):
+        with self.__lock:
+            for rid, current in self.__offers.items():
+                if current['_self'].strip('/') == offer_link.strip('/'):
+                    self.__offers[rid] = copy.deepcopy(offer)
+                    if self.throttle_ru_per_second is not None:
+                        self.throttle_ru_per_second = offer['content']['offerThroughput']
+                    break
+            else:
+                self._fail(http_constants.StatusCodes.NOT_FOUND, 'Offer {0} does not exist'.format(offer_link))
+        self._respond(1.0)
+        return copy.deepcopy(offer)
+
+    # Items
+    def _write(self, collection_link, document, options, mode):
+        link, container = self._container(collection_link)
+        options = options or {}
+        partition_key = self._partitionKey(container, document)
+        key = (json.dumps(partition_key), document['id'])
+        charge = self._charge(document, True)
+        self._admit(charge)
+        with self.__lock:
+            documents = self.__documents[link]
+            current = documents.get(key)
+            if mode == 'create' and current is not None:
+                self._fail(http_constants.StatusCodes.CONFLICT, 'Item {0} already exists'.format(document['id']))
+            if mode == 'replace':
+                if current is None:
+                    self._fail(http_constants.StatusCodes.NOT_FOUND, 'Item {0} does not exist'.format(document['id']))
+                condition = options.get('accessCondition')
+                if condition and condition['type'] == 'IfMatch' and condition['condition'] != current['_etag']:
+                    self._fail(http_constants.StatusCodes.PRECONDITION_FAILED, 'Item {0} was modified'.format(document['id']))
+            stored = self._stamp(copy.deepcopy(document))
+            stored['_self'] = link + '/docs/' + document['id'] + '/'
+            documents[key] = stored
+        self._respond(charge, payload = stored, headers = self._sessionToken(partition_key, stored['_lsn']), admitted = True)
+        return copy.deepcopy(stored)
+
+    def CreateItem(self, database_or_Container_link, document, options = None):
+        return self._write(database_or_Container_link, document, options, 'create')
+
+    def UpsertItem(self, database_or_Container_link, document, options = None):
+        return self._write(database_or_Container_link, document, options, 'upsert')
+
+    def ReplaceItem(self, document_link, new_document, options = None):
+        collection_link, item_id = self._split(document_link)
+        return self._write(collection_link, dict(new_document, id = item_id), options, 'replace')
+
+    def ReadItem(self, document_link, options = None):
+        collection_link, item_id = self._split(document_link)
+        link, container = self._container(collection_link)
+        options = options or {}
+        document = self.__documents[link].get((json.dumps(options.get('partitionKey')), item_id))
+        if document is None:
+            self._fail(http_constants.StatusCodes.NOT_FOUND, 'Item {0} does not exist'.format(item_id))
+        condition = options.get('accessCondition')
+        if condition and condition['type'] == 'IfNoneMatch' and condition['condition'] == document['_etag']:
+            # Not modified, no body
+            self._respond(1.0, status = http_constants.StatusCodes.NOT_MODIFIED)
+            return None
+        self._respond(self._charge(document, False), payload = document)
+        return copy.deepcopy(document)
+
+    def DeleteItem(self, document_link, options = None):
+        collection_link, item_id = self._split(document_link)
+        link, container = self._container(collection_link)
+        key = (json.dumps((options or {}).get('partitionKey')), item_id)
+        document = self.__documents[link].get(key)
+        if document is not None:
+            self._admit(self._charge(document, True))
+            with self.__lock:
+                document = self.__documents[link].pop(key, None)
+                self.__lsn += 1
+                lsn = self.__lsn
+        if document is None:
+            self._fail(http_constants.StatusCodes.NOT_FOUND, 'Item {0} does not exist'.format(item_id))
+        self._respond(self._charge(document, True), headers = self._sessionToken(self._partitionKey(container, document), lsn), admitted = True)
+
+    def QueryItems(self, database_or_Container_link, query, options = None, partition_key = None):
+        link, container = self._container(database_or_Container_link)
+        options = dict(options or {})
+        if partition_key is None:
+            partition_key = options.get('partitionKey')
+        documents = list(self.__documents[link].values())
+        partitions = self.partition_count
+        if partition_key is not None:
+            documents = [d for d in documents if self._partitionKey(container, d) == partition_key]
+            partitions = 1
+        elif not options.get('enableCrossPartitionQuery') and self.partition_count > 1:
+            self._fail(http_constants.StatusCodes.BAD_REQUEST, 'Cross partition query is required but disabled')
+        start = time.perf_counter()
+        results, scanned = self._plan(query).run(documents)
+        # About 2.3 RU per partition visited plus a share of the documents scanned
+        charge = 2.3 * partitions + scanned * 0.05
+        return _QueryResults(self, results, options, charge, scanned, time.perf_counter() - start)
+
+    def _ReadPartitionKeyRanges(self, collection_link, feed_options = None):
+        """One range per physical partition, documents are placed by partitionOf"""
+        self._container(collection_link)
+        self._respond(1.0)
+        step = 0x100000000 // self.partition_count
+        return [{'id': str(i), 'minInclusive': '{0:08X}'.format(i * step),
+                 'maxExclusive': 'FF' if i == self.partition_count - 1 else '{0:08X}'.format((i + 1) * step)}
+                for i in range(self.partition_count)]
+
+    def QueryFeed(self, path, collection_id, query, options, partition_key_range_id = None):
+        """One page of a query on one partition key range, returns (documents, headers)"""
+        link, container = self._container(collection_id)
+        documents = list(self.__documents[link].values())
+        if partition_key_range_id is not None:
+            documents = [d for d in documents if self.partitionOf(self._partitionKey(container, d)) == int(partition_key_range_id)]
+        start = time.perf_counter()
+        results, scanned = self._plan(query).run(documents)
+        page = _QueryResults(self, results, options or {}, 2.3 + scanned * 0.05, scanned, time.perf_counter() - start).fetch_next_block()
+        return page, self.last_response_headers
+
+    def QueryItemsChangeFeed(self, collection_link, options = None):
+        """Latest version of the documents written since the continuation, oldest first, optionally of one range"""
+        link, container = self._container(collection_link)
+        options = options or {}
+        range_id = options.get('partitionKeyRangeId')
+        with self.__lock:
+            current = self.__lsn
+            documents = list(self.__documents[link].values())
+        if options.get('continuation') == '*':
+            # If-None-Match: *, from now
+            since = current
+        elif options.get('continuation'):
+            since = int(options['continuation'].strip('"'))
+        elif options.get('isStartFromBeginning') is False:
+            since = current
+        else:
+            since = 0
+        changes = sorted((d for d in documents if d['_lsn'] > since and
+                          (range_id is None or self.partitionOf(self._partitionKey(container, d)) == int(range_id))),
+                         key = lambda d: d['_lsn'])[:options.get('maxItemCount') or 100]
+        return _ChangeFeedResults(self, changes, '"{0}"'.format(changes[-1]['_lsn'] if changes else since))
+
+    # Stored procedures
+    def UpsertStoredProcedure(self, collection_link, sproc, options = None):
+        link, _ = self._container(collection_link)
+        self.__sprocs[link + '/sprocs/' + sproc['id']] = dict(sproc)
+        self._respond(1.0)
+        return dict(sproc)
+
+    def ExecuteStoredProcedure(self, sproc_link, params, options = None):
+        link = self._trim(sproc_link)
+        collection_link, _, sproc_id = link.rpartition('/sprocs/')
+        if link not in self.__sprocs or sproc_id not in self.__procedures:
+            self._fail(http_constants.StatusCodes.NOT_FOUND, 'Stored procedure {0} does not exist'.format(sproc_id))
+        if params is not None and not isinstance(params, list):
+            params = [params]
+        return self.__procedures[sproc_id](self, collection_link, (options or {}).get('partitionKey'), *(params or []))
+
+    @staticmethod
+    def _patchItemProcedure(client, collection_link, partition_key, item_id, partial_document):
+        """Python twin of CosmosSQLService.PATCH_ITEM_SPROC"""
+        try:
+            document = client.ReadItem(collection_link + '/docs/' + item_id, {'partitionKey': partition_key})
+        except errors.HTTPFailure as e:
+            if e.status_code == http_constants.StatusCodes.NOT_FOUND:
+                return None
+            raise
+        document.update({key: value for key, value in partial_document.items() if key != 'id'})
+        return client.ReplaceItem(collection_link + '/docs/' + item_id, document, {'partitionKey': partition_key})
+
+    @staticmethod
+    def _deleteWhereProcedure(client, collection_link, partition_key, query, batch_size = 100):
+        """Python twin of CosmosSQLService.DELETE_WHERE_SPROC, deleting at most batch_size documents per call"""
+        matches = list(client.QueryItems(collection_link, query, {'partitionKey': partition_key}))
+        for match in matches[:batch_size]:
+            client.DeleteItem(match['_self'].rstrip('/'), {'partitionKey': partition_key})
+        return {'deleted': min(len(matches), batch_size), 'continuation': len(matches) > batch_size}
+
+    @staticmethod
+    def _executeBatchProcedure(client, collection_link, partition_key, operations):
+        """Python twin of CosmosSQLService.EXECUTE_BATCH_SPROC"""
+        options = {'partitionKey': partition_key}
+        results = []
+        with client._transaction(collection_link):
+            for i, operation in enumerate(operations):
+                if client.max_sproc_operations is not None and i >= client.max_sproc_operations:
+                    client._fail(http_constants.StatusCodes.BAD_REQUEST, 'executeBatch: out of time at operation {0}'.format(i))
+                document_link = collection_link + '/docs/' + operation['id']
+                try:
+                    if operation['op'] == 'create':
+                        results.append(client.CreateItem(collection_link, operation['document'], options))
+                    elif operation['op'] == 'upsert':
+                        results.append(client.UpsertItem(collection_link, operation['document'], options))
+                    elif operation['op'] == 'replace':
+                        results.append(client.ReplaceItem(document_link, operation['document'], options))
+                    elif operation['op'] == 'delete':
+                        client.DeleteItem(document_link, options)
+                        results.append(None)
+                    elif operation['op'] == 'patch':
+                        document = client.ReadItem(document_link, options)
+                        document.update(operation['document'])
+                        results.append(client.ReplaceItem(document_link, document, options))
+                    else:
+                        raise ValueError('unknown operation')
+                except Exception as e:
+                    if isinstance(e, errors.HTTPFailure) and e.status_code == http_constants.StatusCodes.TOO_MANY_REQUESTS:
+                        raise
+                    client._fail(http_constants.StatusCodes.BAD_REQUEST, 'executeBatch: operation {0} ({1} {2}) failed: {3}'.format(
+                        i, operation['op'], operation['id'], e))
+        return results
@@ -0,0 +1,210 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Per operation RU, latency and throttling telemetry for CosmosSQL
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    from CosmosSQLMetrics import MetricsRegistry
+##    metrics = MetricsRegistry()
+##    cosmos = CosmosSQL('myDatabase', metrics = metrics)
+##    ...
+##    for row in metrics.stats():
+##        print(row['operation'], row['container'], row['requestCharge'], row['latencyP99'])
+##
+##    metrics.addExporter(lambda sample: statsd.timing(sample.operation, sample.latency))
+##############################################################################################
+import threading
+from collections import namedtuple
+
+import azure.cosmos.http_constants as http_constants
+
+# One recorded operation: latency in seconds, request charge in RU, payload size in bytes
+OperationSample = namedtuple('OperationSample', ['operation', 'container', 'request_charge', 'latency',
+                                                 'payload_size', 'requests', 'throttles', 'failed'])
+
+class LatencyHistogram:
+    """HDR style log-linear histogram of latencies with microsecond resolution.
+    Each power of two range is split in 2 ** sub_bucket_bits buckets, i.e. about 3% precision with 5 bits,
+    so memory stays constant whatever the number of samples.
+    """
+    def __init__(self, sub_bucket_bits = 5):
+        self.__bits = sub_bucket_bits
+        self.__counts = {}
+        self.count = 0
+        self.max = 0.0
+
+    def __index(self, micros):
+        if micros < (1 << self.__bits):
+            return micros
+        shift = micros.bit_length() - self.__bits
+        return (shift << self.__bits) + (micros >> shift)
+
+    def __value(self, index):
+        """Middle of a bucket, in microseconds"""
+        shift, mantissa = index >> self.__bits, index & ((1 << self.__bits) - 1)
+        if shift == 0:
+            return mantissa
+        return (mantissa << shift) + (1 << shift) / 2
+
+    def record(self, seconds):
+        index = self.__index(int(seconds * 1000000))
+        self.__counts[index] = self.__counts.get(index, 0) + 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """Latency in seconds at the percentile p (0-100)"""
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.__counts):
+            seen += self.__counts[index]
+            if seen >= rank:
+                return min(self.__value(index) / 1000000, self.max)
+        return self.max
+
+class _Operation:
+    """Aggregates of one (operation, container)"""
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.request_charge = 0.0
+        self.payload_size = 0
+        self.requests = 0
+        self.throttles = 0
+        self.latency = LatencyHistogram()
+
+class MetricsRegistry:
+    """Thread-safe registry of operation samples.
+
+    Methods:
+        record(operation, container, request_charge, latency, payload_size = 0, requests = 1, throttles = 0, failed = False)
+        stats()
+        addExporter(exporter)
+        removeExporter(exporter)
+        reset()
+    """
+    def __init__(self):
+        self.__operations = {}
+        self.__exporters = []
+        self.__lock = threading.Lock()
+
+    def record(self, operation, container, request_charge, latency, payload_size = 0, requests = 1, throttles = 0, failed = False):
+        """Record one operation and hand it to the exporters"""
+        sample = OperationSample(operation, container, request_charge, latency, payload_size, requests, throttles, failed)
+        with self.__lock:
+            entry = self.__operations.get((operation, container))
+            if entry is None:
+                entry = self.__operations[(operation, container)] = _Operation()
+            entry.count += 1
+            entry.failures += 1 if failed else 0
+            entry.request_charge += request_charge
+            entry.payload_size += payload_size
+            entry.requests += requests
+            entry.throttles += throttles
+            entry.latency.record(latency)
+            exporters = list(self.__exporters)
+        for exporter in exporters:
+            exporter(sample)
+        return sample
+
+    def stats(self):
+        """Snapshot, one row per (operation, container)"""
+        with self.__lock:
+            rows = []
+            for (operation, container), entry in sorted(self.__operations.items(), key = lambda item: (item[0][0], str(item[0][1]))):
+                rows.append({
+                    'operation': operation,
+                    'container': container,
+                    'count': entry.count,
+                    'failures': entry.failures,
+                    'requestCharge': entry.request_charge,
+                    'requestChargePerOp': entry.request_charge / entry.count,
+                    'payloadSize': entry.payload_size,
+                    'requests': entry.requests,
+                    'throttles': entry.throttles,
+                    'latencyP50': entry.latency.percentile(50),
+                    'latencyP90': entry.latency.percentile(90),
+                    'latencyP99': entry.latency.percentile(99),
+                    'latencyMax': entry.latency.max
+                })
+            return rows
+
+    def addExporter(self, exporter):
+        """Call exporter(sample) with every OperationSample recorded from now on"""
+        with self.__lock:
+            self.__exporters.append(exporter)
+
+    def removeExporter(self, exporter):
+        with self.__lock:
+            self.__exporters.remove(exporter)
+
+    def reset(self):
+        """Drop the aggregates, exporters stay"""
+        with self.__lock:
+            self.__operations.clear()
+
+class RequestTracker:
+    """Per thread tally of the HTTP responses a CosmosClient receives (payload counts bytes both ways).
+    Hooked into the client's requests session, so the SDK's own 429 retries are counted too and
+    concurrent operations on a shared client each see their own request charges.
+    """
+    Tally = namedtuple('Tally', ['requests', 'request_charge', 'throttles', 'payload_size'])
+
+    def __init__(self):
+        self.__local = threading.local()
+
+    def attach(self, client):
+        """Hook into a CosmosClient, False if the client has no requests session"""
+        session = getattr(client, '_requests_session', None)
+        if session is None:
+            return False
+        session.hooks['response'].append(self.__hook)
+        return True
+
+    def __hook(self, response, *args, **kwargs):
+        headers = response.headers
+        body = response.request.body if response.request is not None else None
+        self.observe(float(headers.get(http_constants.HttpHeaders.RequestCharge, 0)), response.status_code,
+                     int(headers.get('Content-Length', 0) or 0) + (len(body) if body else 0), headers)
+
+    def observe(self, request_charge, status_code, payload_size = 0, headers = None):
+        """Count one response on the current thread"""
+        self.__local.headers = headers
+        for captured in getattr(self.__local, 'captures', ()):
+            captured.append(headers or {})
+        tally = self.tally()
+        self.__local.tally = RequestTracker.Tally(
+            tally.requests + 1,
+            tally.request_charge + request_charge,
+            tally.throttles + (1 if status_code == http_constants.StatusCodes.TOO_MANY_REQUESTS else 0),
+            tally.payload_size + payload_size)
+
+    def capture(self):
+        """Start collecting the headers of every response on the current thread into the list returned"""
+        captured = []
+        if getattr(self.__local, 'captures', None) is None:
+            self.__local.captures = []
+        self.__local.captures.append(captured)
+        return captured
+
+    def release(self, captured):
+        """Stop collecting into a list from capture()"""
+        captures = self.__local.captures
+        for i in range(len(captures)):
+            if captures[i] is captured:
+                del captures[i]
+                return
+
+    def lastHeaders(self):
+        """Headers of the latest response on the current thread, unlike the client's shared last_response_headers"""
+        return getattr(self.__local, 'headers', None)
+
+    def tally(self):
+        """Running totals of the current thread"""
+        return getattr(self.__local, 'tally', None) or RequestTracker.Tally(0, 0.0, 0, 0)
+
+requestTracker = RequestTracker()
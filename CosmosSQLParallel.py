@@ -0,0 +1,313 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Cross partition queries fanned out over the partition key ranges of a container
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    for item in cosmos.queryItemsParallel('SELECT * FROM c WHERE c.price > 10 ORDER BY c.price DESC',
+##                                          max_degree_of_parallelism = 8, prefetch = 2):
+##        print(item)
+##
+## Every partition key range is read page by page on a thread pool, at most prefetch pages ahead
+## of the consumer. The results are merged client side:
+##    ORDER BY                    - k-way merge of the per range orders
+##    TOP n                       - stops the fan-out once n results are out
+##    COUNT/SUM/MIN/MAX/AVG       - partial aggregates per range, combined (AVG as SUM and COUNT)
+##    GROUP BY                    - partial aggregates per range and group, combined per group
+##    DISTINCT                    - distinct per range, duplicates across ranges dropped
+##    anything else               - pages are yielded as they arrive, in no particular order
+## OFFSET LIMIT, VALUE or DISTINCT with ORDER BY, and GROUP BY with ORDER BY or TOP can't be merged
+## this way, supports() tells them apart so the caller can run them as a plain cross partition query.
+##############################################################################################
+import heapq
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from CosmosSQLQuery import Query, UNDEFINED, sortKey
+
+class _OrderKey:
+    """Sort key of a result under ORDER BY, descending items compare reversed"""
+    __slots__ = ('keys', 'descending')
+
+    def __init__(self, keys, descending):
+        self.keys = keys
+        self.descending = descending
+
+    def __eq__(self, other):
+        return self.keys == other.keys
+
+    def __lt__(self, other):
+        for mine, theirs, descending in zip(self.keys, other.keys, self.descending):
+            if mine != theirs:
+                return (mine > theirs) if descending else (mine < theirs)
+        return False
+
+class _RangeReader:
+    """Pages of one partition key range, fetched in the background at most prefetch pages ahead.
+    All readers of a query share one condition, so the consumer can wait for whichever is ready first.
+    """
+    def __init__(self, fetch, range_id, executor, prefetch, condition):
+        self.range_id = range_id
+        self.__fetch = fetch
+        self.__executor = executor
+        self.__prefetch = max(1, prefetch)
+        self.__condition = condition
+        self.__pages = []
+        self.__continuation = None
+        self.__inflight = False
+        self.__error = None
+        self.done = False      # no more pages to fetch
+        self.closed = False
+
+    def start(self):
+        with self.__condition:
+            self.__schedule()
+
+    def __schedule(self):
+        """Fetch the next page if there is room for it, called with the condition held"""
+        if self.__inflight or self.done or self.closed or len(self.__pages) >= self.__prefetch:
+            return
+        self.__inflight = True
+        self.__executor.submit(self.__run)
+
+    def __run(self):
+        try:
+            items, continuation = self.__fetch(self.range_id, self.__continuation)
+            error = None
+        except Exception as e:
+            items, continuation, error = [], None, e
+        with self.__condition:
+            self.__inflight = False
+            if error is not None:
+                self.__error = error
+                self.done = True
+            else:
+                if items:
+                    self.__pages.append(items)
+                self.__continuation = continuation
+                self.done = not continuation
+                self.__schedule()
+            self.__condition.notify_all()
+
+    @property
+    def ready(self):
+        """A page or an error is waiting, or the range is exhausted"""
+        return bool(self.__pages) or self.__error is not None or (self.done and not self.__inflight)
+
+    def take(self):
+        """Next buffered page, called with the condition held once ready; None when exhausted"""
+        if self.__error is not None:
+            raise self.__error
+        if not self.__pages:
+            return None
+        page = self.__pages.pop(0)
+        self.__schedule()
+        return page
+
+    def items(self):
+        """Blocking iterator over the documents of the range, in the range's order"""
+        while True:
+            with self.__condition:
+                while not self.ready:
+                    self.__condition.wait()
+                page = self.take()
+            if page is None:
+                return
+            for item in page:
+                yield item
+
+class ParallelQuery:
+    """Cross partition query run as one query per partition key range and merged client side.
+
+    Attributes:
+        query - parsed Query
+    Methods:
+        supports(query)
+        __iter__()
+    """
+    def __init__(self, query, fetch, range_ids, max_degree_of_parallelism = 8, prefetch = 2):
+        """fetch(range_id, query, continuation) returns (items, continuation) for one page of a range"""
+        self.query = query if isinstance(query, Query) else Query(query)
+        self.__fetch = fetch
+        self.__range_ids = list(range_ids)
+        self.__dop = max(1, max_degree_of_parallelism)
+        self.__prefetch = prefetch
+
+    @staticmethod
+    def supports(query):
+        """True if the results of the per range queries can be merged into the results of the query"""
+        query = query if isinstance(query, Query) else Query(query)
+        if query.offset or query.limit is not None:
+            return False
+        if query.group_by or query.hasAggregates():
+            # Every column an aggregate or a GROUP BY expression, e.g. SELECT c.city, COUNT(1) AS n ... GROUP BY c.city
+            if query.order_by or query.distinct or query.projection is None or (query.group_by and query.top is not None):
+                return False
+            return all((expr[0] == 'call' and expr[1] in _PARTIALS) or expr in query.group_by for expr, _ in query.projection)
+        return not (query.order_by and (query.value or query.distinct))
+
+    def __rangeQuery(self, text):
+        return {'query': text, 'parameters': [{'name': name, 'value': value} for name, value in self.query.parameters.items()]}
+
+    def __iter__(self):
+        if not self.supports(self.query):
+            raise ValueError('Query can not be merged across partitions: ' + self.query.text)
+        if self.query.group_by or self.query.hasAggregates():
+            return self.__aggregate()
+        if self.query.order_by:
+            return self.__ordered()
+        return self.__unordered()
+
+    def __readers(self, text):
+        """Start one reader per range, returns (readers, condition, executor)"""
+        query = self.__rangeQuery(text)
+        fetch = lambda range_id, continuation: self.__fetch(range_id, query, continuation)
+        executor = ThreadPoolExecutor(max_workers = self.__dop)
+        condition = threading.Condition()
+        readers = [_RangeReader(fetch, range_id, executor, self.__prefetch, condition) for range_id in self.__range_ids]
+        for reader in readers:
+            reader.start()
+        return readers, condition, executor
+
+    @staticmethod
+    def __close(readers, condition, executor):
+        with condition:
+            for reader in readers:
+                reader.closed = True
+        executor.shutdown(wait = False)
+
+    def __unordered(self):
+        readers, condition, executor = self.__readers(self.query.text)
+        remaining = self.query.top
+        seen = set() if self.query.distinct else None
+        try:
+            pending = list(readers)
+            while pending and remaining != 0:
+                with condition:
+                    while not any(reader.ready for reader in pending):
+                        condition.wait()
+                    reader = next(reader for reader in pending if reader.ready)
+                    page = reader.take()
+                if page is None:
+                    pending.remove(reader)
+                    continue
+                if seen is not None:
+                    page = [item for item in page if _firstSeen(seen, item)]
+                if remaining is not None:
+                    page = page[:remaining]
+                    remaining -= len(page)
+                for item in page:
+                    yield item
+        finally:
+            self.__close(readers, condition, executor)
+
+    def __ordered(self):
+        query = self.query
+        descending = [desc for _, desc in query.order_by]
+        if query.projection is None:
+            # SELECT *: the order by values are read off the documents
+            text = query.text
+            key = lambda item: _OrderKey([sortKey(query.evaluate(expr, item)) for expr, _ in query.order_by], descending)
+            strip = lambda item: item
+        else:
+            # Projections carry the order by values along as extra columns
+            columns = []
+            for position, ((expr, name), expr_text) in enumerate(zip(query.projection, query.projection_text)):
+                columns.append(expr_text if name == Query.defaultName(expr, position + 1) else expr_text + ' AS ' + name)
+            names = ['__orderBy{0}'.format(i) for i in range(len(query.order_by))]
+            columns += [expr_text + ' AS ' + name for expr_text, name in zip(query.order_by_text, names)]
+            text = query.select_text + ' ' + ', '.join(columns) + ' ' + query.from_text
+            key = lambda item: _OrderKey([sortKey(item.get(name, UNDEFINED)) for name in names], descending)
+            strip = lambda item: {k: v for k, v in item.items() if k not in names}
+        readers, condition, executor = self.__readers(text)
+        try:
+            def keyed(i, reader):
+                for n, item in enumerate(reader.items()):
+                    yield (key(item), i, n), item
+            merged = heapq.merge(*[keyed(i, reader) for i, reader in enumerate(readers)])
+            for count, (_, item) in enumerate(merged):
+                if query.top is not None and count >= query.top:
+                    return
+                yield strip(item)
+        finally:
+            self.__close(readers, condition, executor)
+
+    def __aggregate(self):
+        query = self.query
+        columns = []
+        groups = []      # the GROUP BY columns, g<i>
+        for i, ((expr, _), expr_text) in enumerate(zip(query.projection, query.projection_text)):
+            if expr in query.group_by:
+                columns.append('{0} AS g{1}'.format(expr_text, i))
+                groups.append('g{0}'.format(i))
+                continue
+            argument = expr_text[expr_text.index('(') + 1:expr_text.rindex(')')]
+            if expr[1] == 'AVG':
+                columns += ['SUM({0}) AS s{1}'.format(argument, i), 'COUNT({0}) AS n{1}'.format(argument, i)]
+            else:
+                columns.append('{0}({1}) AS a{2}'.format(expr[1], argument, i))
+        # from_text keeps the WHERE and GROUP BY clauses
+        text = 'SELECT ' + ', '.join(columns) + ' ' + query.from_text
+        readers, condition, executor = self.__readers(text)
+        try:
+            partials = [row for reader in readers for row in reader.items()]
+        finally:
+            self.__close(readers, condition, executor)
+        grouped = {}
+        for row in partials:
+            key = json.dumps([row.get(name) for name in groups] + [name in row for name in groups], sort_keys = True)
+            grouped.setdefault(key, []).append(row)
+        if not query.group_by:
+            grouped = {'': partials}
+        rows = []
+        for group in grouped.values():
+            row = {}
+            for i, (expr, name) in enumerate(query.projection):
+                value = group[0].get('g{0}'.format(i), UNDEFINED) if expr in query.group_by else _PARTIALS[expr[1]](group, i)
+                if value is not UNDEFINED:
+                    row[name] = value
+            rows.append(row)
+        if query.top is not None:
+            rows = rows[:query.top]
+        if query.value:
+            name = query.projection[0][1]
+            return iter([row[name] for row in rows if name in row])
+        return iter(rows)
+
+def _firstSeen(seen, item):
+    """True the first time a (JSON equal) item is seen"""
+    key = json.dumps(item, sort_keys = True)
+    if key in seen:
+        return False
+    seen.add(key)
+    return True
+
+def _defined(partials, column):
+    return [row[column] for row in partials if column in row]
+
+def _extreme(pick):
+    def combine(partials, i):
+        values = _defined(partials, 'a{0}'.format(i))
+        return pick(values, key = sortKey) if values else UNDEFINED
+    return combine
+
+def _sum(partials, i):
+    # No range with a defined sum (e.g. no matching documents) leaves it undefined, as on one partition
+    values = _defined(partials, 'a{0}'.format(i))
+    return sum(values) if values else UNDEFINED
+
+def _average(partials, i):
+    count = sum(_defined(partials, 'n{0}'.format(i)))
+    return sum(_defined(partials, 's{0}'.format(i))) / count if count else UNDEFINED
+
+# How each aggregate's per range partials combine
+_PARTIALS = {
+    'COUNT': lambda partials, i: sum(_defined(partials, 'a{0}'.format(i))),
+    'SUM': _sum,
+    'MIN': _extreme(min),
+    'MAX': _extreme(max),
+    'AVG': _average
+}
@@ -0,0 +1,661 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Parser and evaluator for the Cosmos SQL subset used by CosmosSQL and its local stand-in
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Supported:
+##    SELECT [DISTINCT] [TOP n] [VALUE] * | expr [AS name], ... FROM container [AS] alias
+##    [WHERE expr] [GROUP BY expr, ...] [ORDER BY expr [ASC|DESC], ...] [OFFSET n LIMIT m]
+## with = != <> < > <= >= AND OR NOT IN + - * / %, @parameters and the functions
+## COUNT SUM AVG MIN MAX IS_DEFINED ARRAY_CONTAINS STARTSWITH CONTAINS LOWER UPPER, and -- or /* */ comments.
+##
+## QueryBuilder emits parameterized queries, QueryPlanCache keeps normalized text and parsed
+## plans per query shape:
+##    query = QueryBuilder().select('id', 'title').where('done', '=', False).orderBy('title').build()
+##    query, plan = QueryPlanCache().get(query)
+##############################################################################################
+import copy
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import azure.cosmos.errors as errors
+import azure.cosmos.http_constants as http_constants
+
+class _Undefined:
+    """A path missing from the document"""
+    def __repr__(self):
+        return 'undefined'
+
+UNDEFINED = _Undefined()
+
+# Whitespace and comments between tokens: -- to the end of the line, /* ... */
+_IGNORED = re.compile(r'(?:\s+|--[^\n]*|/\*.*?\*/)*', re.DOTALL)
+
+_TOKEN = re.compile(r"""(?:
+    (?P<number>\d+(?:\.\d+)?) |
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*") |
+    (?P<param>@\w+) |
+    (?P<name>[A-Za-z_]\w*) |
+    (?P<op><=|>=|!=|<>|[=<>(),.*\[\]+\-/%])
+)""", re.VERBOSE)
+
+_KEYWORDS = {'SELECT', 'DISTINCT', 'TOP', 'VALUE', 'FROM', 'AS', 'WHERE', 'GROUP', 'ORDER', 'BY', 'ASC', 'DESC',
+             'AND', 'OR', 'NOT', 'IN', 'OFFSET', 'LIMIT', 'JOIN'}
+
+# Literals are never case folded, the service only knows them in lower case
+_LITERALS = {'true': True, 'false': False, 'null': None, 'undefined': UNDEFINED}
+
+_AGGREGATES = {'COUNT', 'SUM', 'AVG', 'MIN', 'MAX'}
+
+def _tokenize(text):
+    """(kind, value) tokens and their (start, end) offsets in the text"""
+    tokens, spans, end = [], [], len(text)
+    position = _IGNORED.match(text).end()
+    while position < end:
+        match = _TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Syntax error near: ' + text[position:position + 20])
+        position = _IGNORED.match(text, match.end()).end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        elif kind == 'name' and value.lower() in _LITERALS:
+            kind = 'literal'
+        tokens.append((kind, value))
+        spans.append((match.start(match.lastgroup), match.end(match.lastgroup)))
+    return tokens, spans
+
+def _typeRank(value):
+    # Cosmos orders undefined < null < booleans < numbers < strings
+    if value is UNDEFINED:
+        return 0
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, (int, float)):
+        return 3
+    if isinstance(value, str):
+        return 4
+    return 5
+
+def sortKey(value):
+    """Key ordering values of mixed types the way ORDER BY does"""
+    rank = _typeRank(value)
+    return (rank, value if rank in (2, 3, 4) else 0)
+
+def _compare(op, left, right):
+    if left is UNDEFINED or right is UNDEFINED:
+        return UNDEFINED
+    if op in ('=', '!=', '<>'):
+        equal = _typeRank(left) == _typeRank(right) and left == right
+        return equal if op == '=' else not equal
+    if _typeRank(left) != _typeRank(right) or _typeRank(left) not in (3, 4):
+        return UNDEFINED
+    return {'<': left < right, '>': left > right, '<=': left <= right, '>=': left >= right}[op]
+
+def _arithmetic(op, left, right):
+    if _typeRank(left) != 3 or _typeRank(right) != 3:
+        return UNDEFINED
+    if op in ('/', '%') and right == 0:
+        return UNDEFINED
+    return {'+': lambda: left + right, '-': lambda: left - right, '*': lambda: left * right,
+            '/': lambda: left / right, '%': lambda: left % right}[op]()
+
+class Query:
+    """Parsed Cosmos SQL query, evaluated over an iterable of documents"""
+    def __init__(self, query):
+        if isinstance(query, dict):
+            text, parameters = query['query'], query.get('parameters', [])
+        else:
+            text, parameters = query, []
+        self.text = text
+        self.parameters = {p['name']: p['value'] for p in parameters}
+        self.__numbers = {}           # TOP, OFFSET and LIMIT given as @parameters
+        self.__tokens, self.__spans = _tokenize(text)
+        self.__position = 0
+        self.distinct = False
+        self.top = None
+        self.value = False
+        self.projection = None      # None for *, else [(expr, name)]
+        self.alias = None
+        self.where = None
+        self.group_by = []
+        self.order_by = []
+        self.offset = 0
+        self.limit = None
+        # Source text of the parts, for rewriting the query
+        self.select_text = ''          # SELECT [DISTINCT] [TOP n] [VALUE]
+        self.projection_text = None    # None for *, else the text of every projected expression
+        self.from_text = ''            # FROM ... to the end
+        self.order_by_text = []
+        self.__parse()
+        self.__resolveNumbers()
+
+    def bind(self, parameters):
+        """Copy of the parsed query for other parameter values, [{'name': ..., 'value': ...}]"""
+        query = copy.copy(self)
+        query.parameters = {p['name']: p['value'] for p in parameters}
+        query.__resolveNumbers()
+        return query
+
+    def __resolveNumbers(self):
+        for attribute, name in self.__numbers.items():
+            if name not in self.parameters:
+                raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Missing parameter ' + name)
+            setattr(self, attribute, int(self.parameters[name]))
+
+    # Parsing
+    def __peek(self, offset = 0):
+        index = self.__position + offset
+        return self.__tokens[index] if index < len(self.__tokens) else (None, None)
+
+    def __next(self):
+        token = self.__peek()
+        self.__position += 1
+        return token
+
+    def __accept(self, value):
+        if self.__peek()[1] == value and self.__peek()[0] in ('keyword', 'op'):
+            self.__position += 1
+            return True
+        return False
+
+    def __expect(self, value):
+        if not self.__accept(value):
+            raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Expected {0} in: {1}'.format(value, self.text))
+
+    def __number(self, attribute):
+        kind, value = self.__next()
+        if kind == 'param':
+            self.__numbers[attribute] = value
+            return None
+        if kind != 'number':
+            raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Expected a number in: ' + self.text)
+        return int(value)
+
+    def __text(self, start, end):
+        """Source text of the tokens [start, end)"""
+        return self.text[self.__spans[start][0]:self.__spans[end - 1][1]]
+
+    def __parse(self):
+        self.__expect('SELECT')
+        self.distinct = self.__accept('DISTINCT')
+        if self.__accept('TOP'):
+            self.top = self.__number('top')
+        self.value = self.__accept('VALUE')
+        self.select_text = self.__text(0, self.__position)
+        if self.__accept('*'):
+            self.projection = None
+        else:
+            self.projection = []
+            self.projection_text = []
+            while True:
+                start = self.__position
+                expr = self.__expr()
+                self.projection_text.append(self.__text(start, self.__position))
+                name = None
+                if self.__accept('AS'):
+                    name = self.__next()[1]
+                elif self.__peek()[0] == 'name':
+                    name = self.__next()[1]
+                self.projection.append((expr, name or self.defaultName(expr, len(self.projection) + 1)))
+                if not self.__accept(','):
+                    break
+        self.from_text = self.text[self.__spans[self.__position][0]:].strip() if self.__position < len(self.__spans) else ''
+        self.__expect('FROM')
+        self.alias = self.__next()[1]
+        if self.__accept('AS') or self.__peek()[0] == 'name':
+            self.alias = self.__next()[1]
+        if self.__accept('WHERE'):
+            self.where = self.__expr()
+        if self.__accept('GROUP'):
+            self.__expect('BY')
+            self.group_by = [self.__expr()]
+            while self.__accept(','):
+                self.group_by.append(self.__expr())
+        if self.__accept('ORDER'):
+            self.__expect('BY')
+            while True:
+                start = self.__position
+                expr = self.__expr()
+                self.order_by_text.append(self.__text(start, self.__position))
+                descending = self.__accept('DESC')
+                if not descending:
+                    self.__accept('ASC')
+                self.order_by.append((expr, descending))
+                if not self.__accept(','):
+                    break
+        if self.__accept('OFFSET'):
+            self.offset = self.__number('offset')
+            self.__expect('LIMIT')
+            self.limit = self.__number('limit')
+        if self.__peek()[0] is not None:
+            raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Unexpected {0} in: {1}'.format(self.__peek()[1], self.text))
+
+    @staticmethod
+    def defaultName(expr, position):
+        """Property name of an unaliased projection: the last path segment, else $position"""
+        if expr[0] == 'path' and len(expr[1]) > 1:
+            return expr[1][-1]
+        return '$' + str(position)
+
+    def __expr(self):
+        left = self.__and()
+        while self.__accept('OR'):
+            left = ('or', left, self.__and())
+        return left
+
+    def __and(self):
+        left = self.__not()
+        while self.__accept('AND'):
+            left = ('and', left, self.__not())
+        return left
+
+    def __not(self):
+        if self.__accept('NOT'):
+            return ('not', self.__not())
+        return self.__comparison()
+
+    def __comparison(self):
+        left = self.__additive()
+        kind, value = self.__peek()
+        if kind == 'op' and value in ('=', '!=', '<>', '<', '>', '<=', '>='):
+            self.__next()
+            return ('cmp', value, left, self.__additive())
+        negate = False
+        if kind == 'keyword' and value == 'NOT' and self.__peek(1)[1] == 'IN':
+            self.__next()
+            negate = True
+        if self.__accept('IN'):
+            self.__expect('(')
+            values = [self.__additive()]
+            while self.__accept(','):
+                values.append(self.__additive())
+            self.__expect(')')
+            node = ('in', left, values)
+            return ('not', node) if negate else node
+        return left
+
+    def __additive(self):
+        left = self.__multiplicative()
+        while self.__peek() in (('op', '+'), ('op', '-')):
+            left = ('arith', self.__next()[1], left, self.__multiplicative())
+        return left
+
+    def __multiplicative(self):
+        left = self.__primary()
+        while self.__peek() in (('op', '*'), ('op', '/'), ('op', '%')):
+            left = ('arith', self.__next()[1], left, self.__primary())
+        return left
+
+    def __primary(self):
+        kind, value = self.__next()
+        if kind == 'number':
+            return ('const', float(value) if '.' in value else int(value))
+        if kind == 'string':
+            return ('const', json.loads('"' + value[1:-1].replace('\\\'', '\'').replace('"', '\\"') + '"') if value[0] == "'" else json.loads(value))
+        if kind == 'param':
+            # Looked up on evaluation, so a parsed query can be bound to other values
+            return ('param', value)
+        if kind == 'literal':
+            return ('const', _LITERALS[value.lower()])
+        if kind == 'op' and value == '(':
+            expr = self.__expr()
+            self.__expect(')')
+            return expr
+        if kind == 'op' and value == '-':
+            return ('arith', '-', ('const', 0), self.__primary())
+        if kind == 'name':
+            if self.__accept('('):
+                args = []
+                if not self.__accept(')'):
+                    args.append(self.__expr())
+                    while self.__accept(','):
+                        args.append(self.__expr())
+                    self.__expect(')')
+                return ('call', value.upper(), args)
+            path = [value]
+            while True:
+                if self.__accept('.'):
+                    # Property names keep their case even when they read like keywords, e.g. c.value
+                    self.__next()
+                    path.append(self.__text(self.__position - 1, self.__position))
+                elif self.__accept('['):
+                    index = self.evaluate(self.__primary(), None)
+                    self.__expect(']')
+                    path.append(index)
+                else:
+                    return ('path', path)
+        raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Unexpected {0} in: {1}'.format(value, self.text))
+
+    # Evaluation
+    def evaluate(self, expr, document, group = None):
+        """Value of an expression for a document (or a group of documents for aggregates)"""
+        kind = expr[0]
+        if kind == 'const':
+            return expr[1]
+        if kind == 'param':
+            if expr[1] not in self.parameters:
+                raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Missing parameter ' + expr[1])
+            return self.parameters[expr[1]]
+        if kind == 'path':
+            path = expr[1]
+            value = document if path[0] == self.alias else UNDEFINED
+            for part in path[1:]:
+                if isinstance(value, dict) and isinstance(part, str):
+                    value = value.get(part, UNDEFINED)
+                elif isinstance(value, list) and isinstance(part, int) and part < len(value):
+                    value = value[part]
+                else:
+                    return UNDEFINED
+            return value
+        if kind == 'cmp':
+            return _compare(expr[1], self.evaluate(expr[2], document, group), self.evaluate(expr[3], document, group))
+        if kind == 'arith':
+            return _arithmetic(expr[1], self.evaluate(expr[2], document, group), self.evaluate(expr[3], document, group))
+        if kind == 'and':
+            return self.evaluate(expr[1], document, group) is True and self.evaluate(expr[2], document, group) is True
+        if kind == 'or':
+            return self.evaluate(expr[1], document, group) is True or self.evaluate(expr[2], document, group) is True
+        if kind == 'not':
+            value = self.evaluate(expr[1], document, group)
+            return (not value) if isinstance(value, bool) else UNDEFINED
+        if kind == 'in':
+            left = self.evaluate(expr[1], document, group)
+            return any(_compare('=', left, self.evaluate(v, document, group)) is True for v in expr[2])
+        if kind == 'call':
+            return self.__call(expr[1], expr[2], document, group)
+        raise ValueError(kind)
+
+    def __call(self, name, args, document, group):
+        if name in _AGGREGATES:
+            rows = group if group is not None else [document]
+            if name == 'COUNT':
+                return sum(1 for row in rows if self.evaluate(args[0], row) is not UNDEFINED)
+            values = [self.evaluate(args[0], row) for row in rows]
+            if name in ('SUM', 'AVG'):
+                values = [v for v in values if _typeRank(v) == 3]
+                if not values:
+                    return UNDEFINED
+                return sum(values) if name == 'SUM' else sum(values) / len(values)
+            values = [v for v in values if v is not UNDEFINED]
+            if not values:
+                return UNDEFINED
+            return (min if name == 'MIN' else max)(values, key = sortKey)
+        values = [self.evaluate(arg, document, group) for arg in args]
+        if name == 'IS_DEFINED':
+            return values[0] is not UNDEFINED
+        if name == 'ARRAY_CONTAINS':
+            return isinstance(values[0], list) and values[1] in values[0]
+        if name in ('STARTSWITH', 'CONTAINS'):
+            if not all(isinstance(v, str) for v in values[:2]):
+                return UNDEFINED
+            return values[0].startswith(values[1]) if name == 'STARTSWITH' else values[1] in values[0]
+        if name in ('LOWER', 'UPPER'):
+            if not isinstance(values[0], str):
+                return UNDEFINED
+            return values[0].lower() if name == 'LOWER' else values[0].upper()
+        raise errors.HTTPFailure(http_constants.StatusCodes.BAD_REQUEST, 'Unsupported function ' + name)
+
+    def hasAggregates(self):
+        """True if the projection uses COUNT, SUM, AVG, MIN or MAX"""
+        def walk(expr):
+            if expr[0] == 'call' and expr[1] in _AGGREGATES:
+                return True
+            children = [e for e in expr[1:] if isinstance(e, tuple)]
+            children += [e for e in expr[1:] if isinstance(e, list) for e in e]
+            return any(walk(e) for e in children)
+        return bool(self.projection) and any(walk(expr) for expr, _ in self.projection)
+
+    def __project(self, document, group = None):
+        if self.projection is None:
+            return document
+        if self.value:
+            return self.evaluate(self.projection[0][0], document, group)
+        row = {}
+        for expr, name in self.projection:
+            value = self.evaluate(expr, document, group)
+            if value is not UNDEFINED:
+                row[name] = value
+        return row
+
+    def run(self, documents):
+        """Matching documents, ordered and projected; returns (results, number of documents scanned)"""
+        documents = list(documents)
+        matches = [d for d in documents if self.where is None or self.evaluate(self.where, d) is True]
+        if self.group_by or self.hasAggregates():
+            groups = {}
+            for document in matches:
+                key = json.dumps([self.evaluate(e, document) if self.evaluate(e, document) is not UNDEFINED else None for e in self.group_by])
+                groups.setdefault(key, []).append(document)
+            if not self.group_by and not groups:
+                groups[''] = []
+            results = [self.__project(rows[0] if rows else {}, rows) for rows in groups.values()]
+            results = [r for r in results if r is not UNDEFINED]
+        else:
+            for expr, descending in reversed(self.order_by):
+                matches.sort(key = lambda d: sortKey(self.evaluate(expr, d)), reverse = descending)
+            results = [self.__project(d) for d in matches]
+            results = [r for r in results if r is not UNDEFINED]
+        if self.distinct:
+            seen, unique = set(), []
+            for r in results:
+                key = json.dumps(r, sort_keys = True)
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(r)
+            results = unique
+        results = results[self.offset:]
+        if self.limit is not None:
+            results = results[:self.limit]
+        if self.top is not None:
+            results = results[:self.top]
+        return results, len(documents)
+
+def normalizeQuery(text):
+    """Canonical text of a query: keywords upper case, comments dropped and whitespace collapsed outside string literals.
+    Literals (true, false, null, undefined), names and strings keep their text.
+    """
+    try:
+        tokens, spans = _tokenize(text)
+    except errors.HTTPFailure:
+        return text.strip()
+    parts = []
+    for i, ((kind, value), (start, end)) in enumerate(zip(tokens, spans)):
+        if i and start > spans[i - 1][1]:
+            parts.append(' ')
+        property_name = i and tokens[i - 1] == ('op', '.')
+        parts.append(value if kind == 'keyword' and not property_name else text[start:end])
+    return ''.join(parts)
+
+class QueryPlanCache:
+    """Bounded LRU of query shapes: the normalized text and the parsed Query of every query text seen.
+    The same shape with other parameter values reuses the entry (the plan is bound to the new values),
+    and sending the normalized text lets the service reuse its own plans too.
+
+    Attributes:
+        max_size     - maximum number of shapes kept
+        hits, misses - counters
+    Methods:
+        get(query, params = None)
+        clear()
+        stats()
+    """
+    def __init__(self, max_size = 1000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()   # text -> (normalized text, Query or None)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, query, params = None):
+        """({'query', 'parameters'}, plan) of a str or dict query plus optional extra parameters.
+        The plan is None for queries beyond the parsed SQL subset, they still run on the service.
+        """
+        if isinstance(query, dict):
+            text, parameters = query['query'], list(query.get('parameters', []))
+        else:
+            text, parameters = query, []
+        if isinstance(params, dict):
+            parameters += [{'name': name, 'value': value} for name, value in params.items()]
+        elif params:
+            parameters += list(params)
+        with self.__lock:
+            entry = self.__entries.get(text)
+            if entry is not None:
+                self.__entries.move_to_end(text)
+                self.hits += 1
+        if entry is None:
+            normalized = normalizeQuery(text)
+            try:
+                plan = Query({'query': normalized, 'parameters': parameters})
+            except errors.HTTPFailure:
+                plan = None
+            entry = (normalized, plan)
+            with self.__lock:
+                self.misses += 1
+                self.__entries[text] = entry
+                while len(self.__entries) > self.max_size:
+                    self.__entries.popitem(last = False)
+        normalized, plan = entry
+        if plan is not None and plan.parameters != {p['name']: p['value'] for p in parameters}:
+            try:
+                plan = plan.bind(parameters)
+            except errors.HTTPFailure:
+                plan = None
+        return {'query': normalized, 'parameters': parameters}, plan
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        """Snapshot of the counters"""
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.__entries), 'hits': self.hits, 'misses': self.misses,
+                    'hitRatio': self.hits / lookups if lookups else 0.0}
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_]\w*$')
+
+def pathExpression(path, alias = 'c'):
+    """SQL expression of a field, 'address.city' or '/address/city' gives c.address.city,
+    names that are not plain identifiers (or are keywords) are quoted, e.g. c["value"]
+    """
+    parts = path.strip('/').split('/') if path.startswith('/') else path.split('.')
+    expression = alias
+    for part in parts:
+        if _IDENTIFIER.match(part) and part.upper() not in _KEYWORDS:
+            expression += '.' + part
+        else:
+            expression += '[' + json.dumps(part) + ']'
+    return expression
+
+class QueryBuilder:
+    """Builds parameterized queries, values never end up in the SQL text so equal shapes share one text.
+    Fields are paths relative to the alias, e.g. 'address.city'.
+
+    Methods:
+        select(*fields)
+        selectValue(field)
+        top(n)
+        where(field, op, value)
+        whereIn(field, values)
+        orderBy(field, descending = False)
+        offset(offset, limit)
+        build()
+    """
+    OPERATORS = {'=', '!=', '<>', '<', '<=', '>', '>='}
+    FUNCTIONS = {'STARTSWITH', 'CONTAINS', 'ARRAY_CONTAINS'}
+
+    def __init__(self, alias = 'c'):
+        self.alias = alias
+        self.__fields = None
+        self.__value = False
+        self.__top = None
+        self.__filters = []
+        self.__order = []
+        self.__offset = None
+        self.__parameters = []
+
+    def __parameter(self, value, name = None):
+        name = name or '@p' + str(len(self.__parameters))
+        self.__parameters.append({'name': name, 'value': value})
+        return name
+
+    def select(self, *fields):
+        """Project fields, all of the document without any"""
+        self.__fields = list(fields) or None
+        self.__value = False
+        return self
+
+    def selectValue(self, field):
+        """Project the bare value of one field (SELECT VALUE)"""
+        self.__fields = [field]
+        self.__value = True
+        return self
+
+    def top(self, n):
+        self.__top = int(n)
+        return self
+
+    def where(self, field, op, value):
+        """AND a condition, op is a comparison or STARTSWITH, CONTAINS, ARRAY_CONTAINS"""
+        op = op.upper()
+        if op in self.FUNCTIONS:
+            self.__filters.append(('function', op, field, value))
+        elif op in self.OPERATORS:
+            self.__filters.append(('compare', op, field, value))
+        else:
+            raise ValueError('Unsupported operator ' + op)
+        return self
+
+    def whereIn(self, field, values):
+        """AND field IN (values), sent as ARRAY_CONTAINS(@values, field)"""
+        self.__filters.append(('in', 'IN', field, list(values)))
+        return self
+
+    def orderBy(self, field, descending = False):
+        self.__order.append((field, descending))
+        return self
+
+    def offset(self, offset, limit):
+        self.__offset = (int(offset), int(limit))
+        return self
+
+    def build(self):
+        """{'query': text, 'parameters': [...]} for queryItems"""
+        self.__parameters = []
+        parts = ['SELECT']
+        if self.__top is not None:
+            parts.append('TOP ' + self.__parameter(self.__top, '@top'))
+        if self.__value:
+            parts.append('VALUE')
+        parts.append(', '.join(pathExpression(f, self.alias) for f in self.__fields) if self.__fields else '*')
+        parts.append('FROM ' + self.alias)
+        conditions = []
+        for kind, op, field, value in self.__filters:
+            expression = pathExpression(field, self.alias)
+            if kind == 'function':
+                conditions.append('{0}({1}, {2})'.format(op, expression, self.__parameter(value)))
+            elif kind == 'in':
+                # One array parameter, so the text doesn't change with the number of values
+                conditions.append('ARRAY_CONTAINS({0}, {1})'.format(self.__parameter(value), expression))
+            else:
+                conditions.append('{0} {1} {2}'.format(expression, op, self.__parameter(value)))
+        if conditions:
+            parts.append('WHERE ' + ' AND '.join(conditions))
+        if self.__order:
+            parts.append('ORDER BY ' + ', '.join(pathExpression(f, self.alias) + (' DESC' if d else '') for f, d in self.__order))
+        if self.__offset is not None:
+            parts.append('OFFSET {0} LIMIT {1}'.format(self.__parameter(self.__offset[0], '@offset'), self.__parameter(self.__offset[1], '@limit')))
+        return {'query': ' '.join(parts), 'parameters': list(self.__parameters)}
@@ -0,0 +1,204 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Slow query log fed by the query metrics the service returns, with a top N report
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    log = SlowQueryLog(latency_threshold = 0.5, ru_threshold = 50, path = '/var/log/cosmos/slow-queries.jsonl')
+##    log.addListener(lambda entry: print(entry.request_charge, entry.query))
+##    cosmos = CosmosSQL('myDatabase', query_log = log)
+##    ...
+##    for row in log.top(10, by = 'requestCharge'):
+##        print(row['requestCharge'], row['retrievalRatio'], row['indexHitRatio'], row['query'])
+##
+## With a query log every query asks the service for its query metrics (populateQueryMetrics):
+## documents retrieved vs. output, index hits, execution times. A query slower than latency_threshold
+## seconds or dearer than ru_threshold RU is a SlowQuery entry; every query counts in the report.
+## Many documents retrieved per document output, or a low index hit ratio, points at a missing index
+## or a full scan. Latency is the time spent fetching pages, not the time the caller spends on them.
+##############################################################################################
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+import azure.cosmos.http_constants as http_constants
+
+QUERY_METRICS_HEADER = 'x-ms-documentdb-query-metrics'
+INDEX_UTILIZATION_HEADER = 'x-ms-cosmos-index-utilization'
+
+SlowQuery = namedtuple('SlowQuery', ['time', 'operation', 'container', 'query', 'parameters', 'latency', 'request_charge',
+                                     'partitions', 'retrieved_document_count', 'output_document_count', 'index_hit_ratio',
+                                     'index_utilization', 'metrics', 'failed'])
+
+def parseQueryMetrics(value):
+    """Query metrics header ('retrievedDocumentCount=10;outputDocumentCount=2;...') as a dict of numbers"""
+    metrics = {}
+    for part in (value or '').split(';'):
+        name, _, number = part.partition('=')
+        try:
+            metrics[name.strip()] = float(number)
+        except ValueError:
+            continue
+    return metrics
+
+def parseIndexUtilization(value):
+    """Index utilization header (base64 JSON of the utilized and potential indexes), None if absent or unreadable"""
+    if not value:
+        return None
+    try:
+        return json.loads(base64.b64decode(value).decode('utf-8'))
+    except ValueError:
+        return None
+
+class QueryObservation:
+    """Responses of one query execution, reported to its SlowQueryLog by finish()"""
+    def __init__(self, log, operation, container, query, partitions):
+        self.__log = log
+        self.operation = operation
+        self.container = container
+        self.query = query
+        self.partitions = partitions
+        self.latency = 0.0
+        self.request_charge = 0.0
+        self.metrics = {}
+        self.index_utilization = None
+        self.__finished = False
+
+    def add(self, headers, latency):
+        """Account for the response headers received in latency seconds"""
+        self.latency += latency
+        for response_headers in headers:
+            self.request_charge += float(response_headers.get(http_constants.HttpHeaders.RequestCharge, 0) or 0)
+            for name, number in parseQueryMetrics(response_headers.get(QUERY_METRICS_HEADER)).items():
+                # The ratio is recomputed from the counts, everything else adds up across pages and partitions
+                if name != 'indexHitRatio':
+                    self.metrics[name] = self.metrics.get(name, 0.0) + number
+            self.index_utilization = parseIndexUtilization(response_headers.get(INDEX_UTILIZATION_HEADER)) or self.index_utilization
+
+    def finish(self, failed = False):
+        if not self.__finished:
+            self.__finished = True
+            self.__log.record(self, failed)
+
+class _QueryShape:
+    """Aggregates of one normalized query text on one container"""
+    def __init__(self):
+        self.count = 0
+        self.slow = 0
+        self.failures = 0
+        self.request_charge = 0.0
+        self.latency = 0.0
+        self.latency_max = 0.0
+        self.retrieved = 0.0
+        self.output = 0.0
+        self.index_hits = 0.0
+
+class SlowQueryLog:
+    """Thread-safe slow query log and per query shape report.
+
+    Attributes:
+        latency_threshold - seconds beyond which a query is slow
+        ru_threshold      - request charge beyond which a query is slow
+        entries           - the latest SlowQuery, most recent last
+        path              - optional JSONL file every SlowQuery is appended to
+    Methods:
+        observe(operation, container, query, partitions)
+        record(observation, failed = False)
+        top(n = 10, by = 'requestCharge')
+        addListener(listener)
+        removeListener(listener)
+        clear()
+    """
+    def __init__(self, latency_threshold = 1.0, ru_threshold = 100.0, path = None, history = 1000, max_shapes = 1000):
+        self.latency_threshold = latency_threshold
+        self.ru_threshold = ru_threshold
+        self.path = path
+        self.max_shapes = max_shapes
+        self.entries = deque(maxlen = history)
+        self.__shapes = OrderedDict()     # (container, query text) -> _QueryShape, least recently seen first
+        self.__listeners = []
+        self.__lock = threading.Lock()
+
+    def observe(self, operation, container, query, partitions):
+        """QueryObservation for one execution of query ({'query', 'parameters'}) over partitions ranges"""
+        return QueryObservation(self, operation, container, query, partitions)
+
+    def record(self, observation, failed = False):
+        """Aggregate a finished query, logging it when beyond a threshold; returns the SlowQuery or None"""
+        metrics = observation.metrics
+        retrieved = metrics.get('retrievedDocumentCount', 0.0)
+        output = metrics.get('outputDocumentCount', 0.0)
+        index_hits = metrics.get('indexHitDocumentCount', 0.0)
+        slow = observation.latency > self.latency_threshold or observation.request_charge > self.ru_threshold
+        key = (observation.container, observation.query['query'])
+        with self.__lock:
+            shape = self.__shapes.pop(key, None) or _QueryShape()
+            self.__shapes[key] = shape
+            if len(self.__shapes) > self.max_shapes:
+                self.__shapes.popitem(last = False)
+            shape.count += 1
+            shape.slow += 1 if slow else 0
+            shape.failures += 1 if failed else 0
+            shape.request_charge += observation.request_charge
+            shape.latency += observation.latency
+            shape.latency_max = max(shape.latency_max, observation.latency)
+            shape.retrieved += retrieved
+            shape.output += output
+            shape.index_hits += index_hits
+            if not slow:
+                return None
+            entry = SlowQuery(time.time(), observation.operation, observation.container, observation.query['query'],
+                              observation.query.get('parameters', []), observation.latency, observation.request_charge,
+                              observation.partitions, int(retrieved), int(output), index_hits / retrieved if retrieved else None,
+                              observation.index_utilization, dict(metrics), failed)
+            self.entries.append(entry)
+            listeners = list(self.__listeners)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(entry._asdict(), default = str) + '\n')
+        for listener in listeners:
+            listener(entry)
+        return entry
+
+    def top(self, n = 10, by = 'requestCharge'):
+        """The n query shapes with the highest by: requestCharge, requestChargePerQuery, latencyMax,
+        latencyMean, count, slow or retrievalRatio (documents retrieved per document output)
+        """
+        with self.__lock:
+            rows = []
+            for (container, query), shape in self.__shapes.items():
+                rows.append({
+                    'query': query,
+                    'container': container,
+                    'count': shape.count,
+                    'slow': shape.slow,
+                    'failures': shape.failures,
+                    'requestCharge': shape.request_charge,
+                    'requestChargePerQuery': shape.request_charge / shape.count,
+                    'latencyMean': shape.latency / shape.count,
+                    'latencyMax': shape.latency_max,
+                    'retrievedDocumentCount': int(shape.retrieved),
+                    'outputDocumentCount': int(shape.output),
+                    'retrievalRatio': shape.retrieved / shape.output if shape.output else shape.retrieved,
+                    'indexHitRatio': shape.index_hits / shape.retrieved if shape.retrieved else None
+                })
+        return sorted(rows, key = lambda row: row[by], reverse = True)[:n]
+
+    def addListener(self, listener):
+        """Call listener(entry) with every SlowQuery from now on"""
+        with self.__lock:
+            self.__listeners.append(listener)
+
+    def removeListener(self, listener):
+        with self.__lock:
+            self.__listeners.remove(listener)
+
+    def clear(self):
+        """Drop the entries and the report, listeners stay"""
+        with self.__lock:
+            self.entries.clear()
+            self.__shapes.clear()
@@ -0,0 +1,165 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Client-side RU/s token bucket gating CosmosSQL operations, across threads and processes
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    limiter = RateLimiter(4000)                                        # shared by the threads
+##    limiter = RateLimiter(4000, shared_path = '/dev/shm/products.ru')  # and by local worker processes
+##    cosmos = CosmosSQL('myDatabase', rate_limiter = limiter)
+##
+## Each operation first takes its estimated request charge from the bucket, waiting while the bucket
+## is empty, and settles the difference with the actual charge once done. Estimates are a moving
+## average of the recent charges per operation type (readItem, upsertItem, queryPage, ...).
+## Budget the limiter a little under the provisioned throughput so the service rarely has to throttle.
+## The shared bucket is a small memory mapped file locked with flock: POSIX only, elsewhere a shared_path
+## raises RuntimeError.
+##############################################################################################
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, only in-process limiters
+    fcntl = None
+
+class _Bucket:
+    """In-process token bucket state"""
+    def __init__(self, rate, capacity):
+        self.__lock = threading.Lock()
+        self.__state = [float(capacity), time.time(), float(rate), float(capacity)]
+
+    @contextmanager
+    def state(self):
+        """[tokens, last refill, rate, capacity], updated in place while held"""
+        with self.__lock:
+            yield self.__state
+
+class _SharedBucket:
+    """Token bucket state in a memory mapped file, shared by the processes that map the same path"""
+    FORMAT = 'dddd'
+
+    def __init__(self, path, rate, capacity):
+        if fcntl is None:
+            raise RuntimeError('Shared rate limiters need fcntl (POSIX), use RateLimiter without shared_path')
+        size = struct.calcsize(self.FORMAT)
+        self.__lock = threading.Lock()
+        self.__fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.__fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.__fd).st_size < size:
+                os.write(self.__fd, struct.pack(self.FORMAT, float(capacity), time.time(), float(rate), float(capacity)))
+            self.__map = mmap.mmap(self.__fd, size)
+            tokens, refilled, _, _ = struct.unpack(self.FORMAT, self.__map[:size])
+            # The latest process to start sets the budget
+            self.__map[:size] = struct.pack(self.FORMAT, min(tokens, capacity), refilled, float(rate), float(capacity))
+        finally:
+            fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def state(self):
+        size = struct.calcsize(self.FORMAT)
+        # flock excludes other processes, the threads of this one share the descriptor and need their own lock
+        with self.__lock:
+            fcntl.flock(self.__fd, fcntl.LOCK_EX)
+            try:
+                state = list(struct.unpack(self.FORMAT, self.__map[:size]))
+                yield state
+                self.__map[:size] = struct.pack(self.FORMAT, *state)
+            finally:
+                fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self.__map.close()
+        os.close(self.__fd)
+
+class RateLimiter:
+    """RU/s token bucket with per operation request charge estimates.
+
+    Attributes:
+        ru_per_second - budget refilled every second
+        burst         - most RU the bucket holds, one second of budget by default
+        waits, waited - number of acquisitions that had to wait and the seconds spent waiting
+    Methods:
+        estimate(operation)
+        acquire(operation, cost = None)
+        settle(operation, estimate, request_charge)
+        refund(cost)
+        stats()
+        close()
+    """
+    def __init__(self, ru_per_second, burst = None, shared_path = None, initial_estimate = 1.0, smoothing = 0.2):
+        self.ru_per_second = float(ru_per_second)
+        self.burst = float(burst or ru_per_second)
+        self.initial_estimate = initial_estimate
+        self.smoothing = smoothing
+        self.waits = 0
+        self.waited = 0.0
+        self.__estimates = {}
+        self.__lock = threading.Lock()
+        if shared_path:
+            self.__bucket = _SharedBucket(shared_path, self.ru_per_second, self.burst)
+        else:
+            self.__bucket = _Bucket(self.ru_per_second, self.burst)
+
+    def estimate(self, operation):
+        """Expected request charge of an operation, a moving average of its recent charges"""
+        with self.__lock:
+            return self.__estimates.get(operation, self.initial_estimate)
+
+    def acquire(self, operation, cost = None):
+        """Take the cost (the operation's estimate by default) from the bucket, waiting for the refill if needed.
+        Returns the cost taken, to settle once the actual charge is known.
+        """
+        cost = self.estimate(operation) if cost is None else cost
+        waited = 0.0
+        while True:
+            with self.__bucket.state() as state:
+                now = time.time()
+                tokens, refilled, rate, capacity = state
+                tokens = min(capacity, tokens + max(0.0, now - refilled) * rate)
+                # A request dearer than the whole bucket goes once the bucket is full, instead of never
+                if tokens >= min(cost, capacity):
+                    state[0], state[1] = tokens - cost, now
+                    break
+                state[0], state[1] = tokens, now
+                delay = (min(cost, capacity) - tokens) / rate
+            time.sleep(delay)
+            waited += delay
+        if waited:
+            with self.__lock:
+                self.waits += 1
+                self.waited += waited
+        return cost
+
+    def settle(self, operation, estimate, request_charge):
+        """Account for the actual request charge of an operation acquired with estimate"""
+        with self.__lock:
+            previous = self.__estimates.get(operation)
+            self.__estimates[operation] = request_charge if previous is None else \
+                previous + self.smoothing * (request_charge - previous)
+        if request_charge != estimate:
+            with self.__bucket.state() as state:
+                state[0] = min(state[3], state[0] - (request_charge - estimate))
+
+    def refund(self, cost):
+        """Give back a cost acquired for a call that sent no request"""
+        with self.__bucket.state() as state:
+            state[0] = min(state[3], state[0] + cost)
+
+    def stats(self):
+        """Snapshot of the estimates and waits"""
+        with self.__lock:
+            return {'estimates': dict(self.__estimates), 'waits': self.waits, 'waited': self.waited}
+
+    def close(self):
+        """Unmap a shared bucket"""
+        if isinstance(self.__bucket, _SharedBucket):
+            self.__bucket.close()
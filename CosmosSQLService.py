@@ -15,23 +15,265 @@
 ## 
 ## 3. Create a container/collection if it doesn't exist
 ##    cosmos.createContainer('collection_name', '/fieldname')
+##
+## 4. Optionally cache point reads and record per operation telemetry
+##    cosmos = CosmosSQL('myDatabase', cache = ItemCache(max_size = 10000, ttl = 30), metrics = MetricsRegistry())
+##
+## Importing this module leaves out the SDK client (and requests), config.py and numpy; they are
+## imported, and the account connected, on the first operation that needs them.
 ##############################################################################################
-import azure.cosmos.cosmos_client as cosmos_client
 import azure.cosmos.errors as errors
 import azure.cosmos.http_constants as http_constants
 import azure.cosmos.documents as documents
 
+import copy
 import uuid
 import json
+import time
+import os
+import random
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from CosmosSQLBatch import Batch, chunkOperations
+from CosmosSQLCache import ItemCache, MetadataCache
+from CosmosSQLIndexing import diffPolicy, indexingPolicy
+from CosmosSQLHedging import HedgePolicy, deadlineExceeded, hedgedCall
+from CosmosSQLJson import getCodec, installSdkCodec, setCodec, writeJson
+from CosmosSQLChangeFeed import ChangeFeedReader, MemoryCheckpointStore
+from CosmosSQLMetrics import MetricsRegistry, requestTracker
+from CosmosSQLParallel import ParallelQuery
+from CosmosSQLQuery import QueryBuilder, QueryPlanCache, pathExpression
+from CosmosSQLQueryLog import SlowQueryLog
+from CosmosSQLSession import SessionContext, SessionRegistry
+from CosmosSQLTransfer import EXTENSIONS, ImportCheckpoint, compressionOf, encodeDocument, importPaths, openJsonl, shardPaths
+from CosmosSQLWriteBehind import WriteBehindBuffer
+
+# Outcome of one item in a bulk operation: the input item, the response and the error if it failed
+ItemResult = namedtuple('ItemResult', ['item', 'result', 'error'])
+
+# One page of a query: the documents, the token to resume after it and its RU charge
+QueryPage = namedtuple('QueryPage', ['items', 'continuation', 'request_charge'])
+
+# Server side partial update: merges the changed fields inside the partition transaction
+PATCH_ITEM_SPROC = {
+    'id': 'patchItem',
+    'serverScript': """
+function patchItem(id, partialDoc) {
+    var collection = getContext().getCollection();
+    var accepted = collection.readDocument(collection.getAltLink() + '/docs/' + id, {}, function (err, doc) {
+        if (err) {
+            if (err.number == 404) { getContext().getResponse().setBody(null); return; }
+            throw err;
+        }
+        for (var key in partialDoc) {
+            if (key != 'id') doc[key] = partialDoc[key];
+        }
+        if (!collection.replaceDocument(doc._self, doc, function (err, result) {
+            if (err) throw err;
+            getContext().getResponse().setBody(result);
+        })) throw new Error('patchItem: replace not accepted');
+    });
+    if (!accepted) throw new Error('patchItem: read not accepted');
+}
+"""
+}
+
+# Server side purge of one partition: deletes what a query matches until the time budget runs out,
+# the caller runs it again while the result says continuation
+DELETE_WHERE_SPROC = {
+    'id': 'deleteWhere',
+    'serverScript': """
+function deleteWhere(query) {
+    var collection = getContext().getCollection();
+    var response = getContext().getResponse();
+    var result = {deleted: 0, continuation: true};
+    queryAndDelete();
 
-import config as cfg
+    function queryAndDelete(continuation) {
+        var accepted = collection.queryDocuments(collection.getSelfLink(), query, {continuation: continuation}, function (err, documents, options) {
+            if (err) throw err;
+            if (documents.length > 0) {
+                deleteNext(documents);
+            } else if (options.continuation) {
+                queryAndDelete(options.continuation);
+            } else {
+                result.continuation = false;
+                response.setBody(result);
+            }
+        });
+        if (!accepted) response.setBody(result);
+    }
+
+    function deleteNext(documents) {
+        if (documents.length == 0) {
+            // The deleted documents are gone, so query again from the start
+            queryAndDelete();
+            return;
+        }
+        var accepted = collection.deleteDocument(documents[0]._self, {}, function (err) {
+            if (err) throw err;
+            result.deleted++;
+            documents.shift();
+            deleteNext(documents);
+        });
+        if (!accepted) response.setBody(result);
+    }
+}
+"""
+}
+
+# Transactional batch of one partition: runs the operations in order and rolls all of them back
+# when one fails (the thrown error names it) or when the procedure runs out of its time budget
+# (BATCH_OUT_OF_TIME), executeBatch then runs the operations again as two smaller chunks
+BATCH_OUT_OF_TIME = 'executeBatch: out of time'
+
+EXECUTE_BATCH_SPROC = {
+    'id': 'executeBatch',
+    'serverScript': """
+function executeBatch(operations) {
+    var collection = getContext().getCollection();
+    var results = [];
+    next(0);
+
+    function fail(i, err) {
+        var operation = operations[i];
+        throw new Error('executeBatch: operation ' + i + ' (' + operation.op + ' ' + operation.id + ') failed: ' +
+                        (err.number ? err.number + ' ' : '') + err.message);
+    }
+
+    function done(i) {
+        return function (err, result) {
+            if (err) fail(i, err);
+            results.push(operations[i].op == 'delete' ? null : result);
+            next(i + 1);
+        };
+    }
+
+    function next(i) {
+        if (i == operations.length) {
+            getContext().getResponse().setBody(results);
+            return;
+        }
+        var operation = operations[i];
+        var link = collection.getAltLink() + '/docs/' + operation.id;
+        var accepted;
+        switch (operation.op) {
+            case 'create': accepted = collection.createDocument(collection.getSelfLink(), operation.document, done(i)); break;
+            case 'upsert': accepted = collection.upsertDocument(collection.getSelfLink(), operation.document, done(i)); break;
+            case 'replace': accepted = collection.replaceDocument(link, operation.document, done(i)); break;
+            case 'delete': accepted = collection.deleteDocument(link, {}, done(i)); break;
+            case 'patch':
+                accepted = collection.readDocument(link, {}, function (err, doc) {
+                    if (err) fail(i, err);
+                    for (var key in operation.document) {
+                        if (key != 'id') doc[key] = operation.document[key];
+                    }
+                    if (!collection.replaceDocument(doc._self, doc, done(i))) outOfTime(i);
+                });
+                break;
+            default: fail(i, {message: 'unknown operation'});
+        }
+        if (!accepted) outOfTime(i);
+    }
+
+    function outOfTime(i) {
+        // Throwing rolls the chunk back, executeBatch splits it and runs the halves
+        throw new Error('executeBatch: out of time at operation ' + i);
+    }
+}
+"""
+}
+
+def partitionKeyValue(document, path):
+    """Value at a partition key path such as '/address/city', None if missing"""
+    value = document
+    for part in path.strip('/').split('/'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def partitionKeyExpression(path, alias = 'c'):
+    """SQL expression of a partition key path, e.g. c["address"]["city"] for '/address/city'"""
+    return alias + ''.join('[' + json.dumps(part) + ']' for part in path.strip('/').split('/'))
+
+def queryParameters(params):
+    """Query parameters from a {'@name': value} dict or a [{'name': ..., 'value': ...}] list"""
+    if isinstance(params, dict):
+        return [{'name': name, 'value': value} for name, value in params.items()]
+    return list(params or [])
+
+CONSISTENCY_LEVELS = (documents.ConsistencyLevel.Strong, documents.ConsistencyLevel.BoundedStaleness,
+                      documents.ConsistencyLevel.Session, documents.ConsistencyLevel.ConsistentPrefix,
+                      documents.ConsistencyLevel.Eventual)
+
+def _consistencyLevel(consistency):
+    """Validated consistency level, None stays None"""
+    if consistency is not None and consistency not in CONSISTENCY_LEVELS:
+        raise ValueError('Unknown consistency level {0}, one of {1}'.format(consistency, ', '.join(CONSISTENCY_LEVELS)))
+    return consistency
+
+def _throttleDelay(e, attempt, base = 0.05, cap = 5.0):
+    """Seconds to wait after a 429: the server hint plus a full-jitter exponential backoff"""
+    hint = float(e.headers.get(http_constants.HttpHeaders.RetryAfterInMilliseconds, 0)) / 1000
+    return hint + random.uniform(0, min(cap, base * 2 ** attempt))
+
+def _retryThrottled(fn, *args, max_retries = 9, **kwargs):
+    """Call fn, retrying on 429 (too many requests) honoring x-ms-retry-after-ms"""
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except errors.HTTPFailure as e:
+            if e.status_code != http_constants.StatusCodes.TOO_MANY_REQUESTS or attempt >= max_retries:
+                raise
+            time.sleep(_throttleDelay(e, attempt))
+            attempt += 1
+
+def _outcome(future):
+    """ItemResult of a finished future"""
+    try:
+        return ItemResult(future.item, future.result(), None)
+    except Exception as e:
+        return ItemResult(future.item, None, e)
+
+def _boundedMap(fn, iterable, max_concurrency = 16):
+    """Stream an iterable through fn on a thread pool with at most max_concurrency items in flight.
+    Yields ItemResult in completion order, the input is consumed lazily.
+    """
+    with ThreadPoolExecutor(max_workers = max_concurrency) as executor:
+        pending = set()
+        for item in iterable:
+            if len(pending) >= max_concurrency:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    yield _outcome(future)
+            future = executor.submit(fn, item)
+            future.item = item
+            pending.add(future)
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                yield _outcome(future)
 
 #https://docs.microsoft.com/en-us/python/api/azure-cosmos/azure.cosmos.cosmos_client.cosmosclient?view=azure-python
+def _settings():
+    """settings of config.py, imported on first use; without it pass uri and key (or a client) explicitly"""
+    import config as cfg
+    return cfg.settings
+
 # Class CosmosSQLClient is served for client and database
 class CosmosSQLClient: 
     """Azure Cosmos SQL Client.
+    Connections are pooled per process: instances for the same URI and key share one CosmosClient,
+    created when first used since it reads the account on creation.
+    A ready made client (e.g. CosmosSQLLocal.LocalCosmosClient) can be passed in instead.
+
     Attributes:
         __client - A cosmos connection client
+        metadata - process wide MetadataCache of databases and containers
+        plans    - process wide QueryPlanCache of normalized query texts and parsed plans
         errors   - cosmos client error
         json     - json library
         uuid     - uuid library
@@ -41,22 +283,57 @@ class CosmosSQLClient:
         readDatabase(database_id)
         listDatabases()
     """
-    def __init__(self):
-        self.__client = cosmos_client.CosmosClient(cfg.settings['URI'], {'masterKey': cfg.settings['PRIMARY_KEY']})
+    __clients = {}
+    __clients_lock = threading.Lock()
+    metadata = MetadataCache()
+    plans = QueryPlanCache()
+
+    def __init__(self, uri = None, key = None, client = None):
+        self.__key = key
+        self.__client = client
+        if client is not None:
+            uri = uri or getattr(client, 'url_connection', None) or str(id(client))
+        self.__uri = uri
+
+    def __connect(self):
+        key = self.__key or _settings()['PRIMARY_KEY']
+        with CosmosSQLClient.__clients_lock:
+            client = CosmosSQLClient.__clients.get((self.uri, key))
+            if client is None:
+                import azure.cosmos.cosmos_client as cosmos_client
+                client = cosmos_client.CosmosClient(self.uri, {'masterKey': key})
+                requestTracker.attach(client)
+                installSdkCodec()
+                CosmosSQLClient.__clients[(self.uri, key)] = client
+        self.__client = client
+        return client
 
     def __enter__(self):
-        return self.__client # bound to target
+        return self.getClient() # bound to target
 
     def __exit__(self, exception_type, exception_val, trace):
         # extra cleanup in here
         self.client = None
 
     def getClient(self):
-        return self.__client 
+        return self.__client or self.__connect()
 
     @property
     def client(self):
-        return self.__client 
+        return self.getClient()
+
+    @property
+    def uri(self):
+        """Account URI"""
+        if self.__uri is None:
+            self.__uri = _settings()['URI']
+        return self.__uri
+
+    @staticmethod
+    def resetClients():
+        """Drop the pooled clients, new instances connect afresh"""
+        with CosmosSQLClient.__clients_lock:
+            CosmosSQLClient.__clients.clear()
 
     def createDatabaseIfNotExists(self, database_id):
         """Create a database if it does not exist""" 
@@ -134,29 +411,70 @@ class CosmosSQL(CosmosSQLClient):
         __database_id  - A cosmos database id
         __container    - A cosmos database container/collection object
         __container_id - A cosmos database container/collection id
+        __cache        - An optional ItemCache for point reads
+        __metadata     - MetadataCache resolving the database and containers lazily
+        __metrics      - An optional MetricsRegistry recording RU, latency and throttles per operation
+        __rate_limiter - An optional RateLimiter every operation acquires its estimated RU from
+        __query_log    - An optional SlowQueryLog fed with the query metrics of queryItems and queryPages
+        __consistency  - Default consistency level of reads, the client's (Session) when None
+        __session      - SessionContext of a session() view, None otherwise
         id             - uuid   
     Methods:    
-        createContainer(container_id, container_path) 
+        createContainer(container_id, container_path = '/id', indexing_policy = None, throughput = 400) 
         readContainer(container_id)
-        replaceContainer(container)
+        replaceContainer(container, indexing_policy = None)
+        replaceIndexingPolicy(indexing_policy, container_id = None)
+        indexTransformationProgress(container_id = None)
+        waitForIndexing(container_id = None, poll_interval = 5.0, timeout = None, progress = None)
         deleteContainer(container_id)
-        recreateContainer(container_id, container_path) 
-        replaceThroughputOfContainer(value = 1000)            
+        recreateContainer(container_id, container_path = '/id', indexing_policy = None, throughput = 400) 
+        readThroughputOfContainer(container_id = None, refresh = False)
+        replaceThroughputOfContainer(value = 1000, container_id = None)
         getContainer(container_id)
         upsertItem(document)
-        patchItem(id, partialDoc)
-        readItem(itemId) 
+        upsertItems(documents, max_concurrency = 16)
+        patchItem(id, partialDoc, partitionKey = None, serverSide = False)
+        patchItems(patches, max_concurrency = 16, serverSide = False)
+        batch(partitionKey, max_operations = 100, max_bytes = 1500000)
+        executeBatch(partitionKey, operations, max_operations = 100, max_bytes = 1500000)
+        writeBehind(max_pending = 1000, max_age = 1.0, max_concurrency = 16, on_write = None, on_flush = None)
+        session(context = None)
+        registerStoredProcedure(sproc)
+        readItem(itemId, partitionKey = None, consistency = None, deadline = None, hedge = None) 
+        readItems(keys, max_concurrency = 16, deadline = None, hedge = None)
         deleteItem(itemId, partitionKey = None)
-        queryItems(sql = "") 
+        deleteWhere(filter_sql, params = None, max_concurrency = 16, partitionKey = None, serverSide = False)
+        queryItems(sql = "", params = None, partitionKey = None, consistency = None) 
+        queryPages(sql = "", page_size = 100, continuation = None, max_ru_per_page = None, params = None, partitionKey = None, consistency = None)
+        queryItemsParallel(sql = "", max_degree_of_parallelism = 8, prefetch = 2, page_size = 100, params = None, partitionKey = None, consistency = None)
+        queryColumns(sql = "", columns = None, dtypes = None, params = None, partitionKey = None, chunk_size = 10000, page_size = 1000, output = 'numpy')
+        count(filter_sql = None, params = None, partitionKey = None)
+        aggregate(field, op, filter_sql = None, params = None, group_by = None, partitionKey = None)
+        distinct(field, filter_sql = None, params = None, partitionKey = None)
+        partitionKeyRanges()
+        changeFeed(store = None, name = 'default', batch_size = 100, start_from_beginning = True)
         listItems()
-        listItemsJson()
+        listItemsJson(out = None, lines = False)
+        exportContainer(path, query = None, compress = 'gzip', shards = 1, page_size = 1000, params = None)
+        importContainer(path, max_concurrency = 16, checkpoint_path = None)
     """
-    def __init__(self, database_id = 'testDatabase'):
-        # Create client
-        super().__init__()
+    def __init__(self, database_id = 'testDatabase', cache = None, metadata_cache = None, uri = None, key = None, metrics = None, client = None, rate_limiter = None, query_log = None, consistency = None):
+        # No connection, nor round trip, until the database or a container is needed
+        super().__init__(uri, key, client)
         
         self.__database_id = database_id
-        self.__database = self.createDatabaseIfNotExists(database_id)
+        self.__database = None
+        self.__container = None
+        self.__container_id = None
+        self.__metadata = metadata_cache if metadata_cache is not None else CosmosSQLClient.metadata
+        self.__sprocs = set()
+        self.__cache = cache
+        self.__metrics = metrics
+        self.__rate_limiter = rate_limiter
+        self.__query_log = query_log
+        self.__consistency = _consistencyLevel(consistency)
+        self.__sessions = SessionRegistry()
+        self.__session = None
 
     def __enter__(self):
         return (self.client, self.__database) # bound to target
@@ -173,14 +491,19 @@ class CosmosSQL(CosmosSQLClient):
 
     @property
     def database(self):
-        """Current database"""
+        """Current database, created if not existing on first use"""
+        if self.__database is None:
+            link = "dbs/" + self.database_id
+            self.__database = self.__metadata.get(self.uri, link) or \
+                self.__metadata.put(self.uri, link, self.createDatabaseIfNotExists(self.database_id))
         return self.__database 
 
     @database.setter
     def database(self, database_id):
         """Set a new database """
         self.__database_id = database_id
-        self.createDatabaseIfNotExists(database_id)
+        self.__database = None
+        self.database
 
     @property
     def database_id(self):
@@ -202,61 +525,349 @@ class CosmosSQL(CosmosSQLClient):
         """Current container name"""
         return self.__container_id 
 
+    @property
+    def cache(self):
+        """Item cache, None when caching is off"""
+        return self.__cache
+
+    @property
+    def metrics(self):
+        """Metrics registry, None when telemetry is off"""
+        return self.__metrics
+
+    @property
+    def rate_limiter(self):
+        """RU rate limiter, None when operations are not gated"""
+        return self.__rate_limiter
+
+    @property
+    def consistency(self):
+        """Default consistency level of reads, None for the client's"""
+        return self.__consistency
+
+    @property
+    def session_context(self):
+        """SessionContext of a session() view, None otherwise"""
+        return self.__session
+
+    def session(self, context = None):
+        """View of this CosmosSQL recording the session tokens of its writes and sending them with its reads,
+        so reads at Session consistency see those writes even in other processes. context is a SessionContext,
+        a logical user name (one SessionContext kept per name) or None for a new SessionContext.
+        The view shares the client, caches and metrics; selecting another container on it leaves this one be.
+        """
+        if not isinstance(context, SessionContext):
+            context = self.__sessions.get(context) if context is not None else SessionContext()
+        view = copy.copy(self)
+        view.__session = context
+        return view
+
+    def _readOptions(self, options, consistency = None):
+        """Add the consistency level (per call, else the default one) and the session token to read options"""
+        consistency = _consistencyLevel(consistency) or self.__consistency
+        if consistency is not None:
+            options['consistencyLevel'] = consistency
+        if self.__session is not None and consistency in (None, documents.ConsistencyLevel.Session):
+            token = self.__session.token("dbs/" + self.database_id + "/colls/" + self.container_id)
+            if token:
+                options['sessionToken'] = token
+        return options
+
+    def _captureSession(self):
+        """Record the session token of the latest write on this thread in the session context"""
+        if self.__session is None:
+            return
+        headers = requestTracker.lastHeaders() or self.client.last_response_headers or {}
+        self.__session.capture("dbs/" + self.database_id + "/colls/" + self.container_id,
+                               headers.get(http_constants.HttpHeaders.SessionToken))
+
+    @property
+    def query_log(self):
+        """Slow query log, None unless given"""
+        return self.__query_log
+
+    def _measure(self, operation, fn, *args):
+        """Call fn(*args) once the rate limiter admits it, recording the operation in the metrics registry"""
+        if self.__metrics is None and self.__rate_limiter is None:
+            return fn(*args)
+        estimate = self.__rate_limiter.acquire(operation) if self.__rate_limiter is not None else None
+        before = requestTracker.tally()
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = fn(*args)
+            failed = False
+            return result
+        finally:
+            self._record(operation, before, start, failed, estimate)
+
+    def _measureItems(self, operation, items, observation = None):
+        """Iterate query results page by page (fetch_next_block), gating and recording every page fetched
+        as one operation; items already fetched are yielded without touching the rate limiter.
+        With an observation the pages are added to it, finished once the results are done or dropped.
+        """
+        fetch = items.fetch_next_block
+        if observation is not None:
+            fetch = lambda: self._observed(observation, items.fetch_next_block)
+        try:
+            while True:
+                estimate = self.__rate_limiter.acquire(operation) if self.__rate_limiter is not None else None
+                before = requestTracker.tally()
+                start = time.perf_counter()
+                try:
+                    page = fetch()
+                except Exception:
+                    self._record(operation, before, start, True, estimate)
+                    raise
+                if requestTracker.tally().requests != before.requests:
+                    self._record(operation, before, start, False, estimate)
+                elif estimate is not None:
+                    # The end of the results, nothing was fetched
+                    self.__rate_limiter.refund(estimate)
+                if not page:
+                    return
+                for item in page:
+                    yield item
+        except Exception:
+            if observation is not None:
+                observation.finish(failed = True)
+            raise
+        finally:
+            if observation is not None:
+                observation.finish()
+
+    def _responseHeaders(self, requests_before):
+        """Headers of the latest response on this thread when requests were tracked since requests_before,
+        else of the client's latest one (a client without a hooked requests session)
+        """
+        if requestTracker.tally().requests != requests_before:
+            # The client's last_response_headers are shared by all the threads, ours are not
+            return requestTracker.lastHeaders() or {}
+        return self.client.last_response_headers or {}
+
+    def _record(self, operation, before, start, failed, estimate = None):
+        latency = time.perf_counter() - start
+        after = requestTracker.tally()
+        requests = after.requests - before.requests
+        if requests:
+            request_charge = after.request_charge - before.request_charge
+        else:
+            # Client without a hooked requests session, fall back to the latest response headers
+            headers = self.client.last_response_headers or {}
+            request_charge = float(headers.get(http_constants.HttpHeaders.RequestCharge, 0))
+        if estimate is not None:
+            self.__rate_limiter.settle(operation, estimate, request_charge)
+        if self.__metrics is None:
+            return
+        if requests:
+            self.__metrics.record(operation, self.container_id, request_charge, latency,
+                                  after.payload_size - before.payload_size, requests, after.throttles - before.throttles, failed)
+        else:
+            self.__metrics.record(operation, self.container_id, request_charge, latency, failed = failed)
+
+    def _observeQuery(self, operation, query, partitionKey = None):
+        """QueryObservation of a query for the slow query log, None without one"""
+        if self.__query_log is None:
+            return None
+        partitions = 1 if partitionKey is not None else len(self.partitionKeyRanges())
+        return self.__query_log.observe(operation, self.container_id, query, partitions)
+
+    def _observed(self, observation, fn, *args):
+        """Call fn(*args), adding the responses it received and the time it took to the observation"""
+        captured = requestTracker.capture()
+        last = self.client.last_response_headers
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            latency = time.perf_counter() - start
+            requestTracker.release(captured)
+            if not captured and self.client.last_response_headers is not last:
+                # Client without a hooked requests session
+                captured.append(self.client.last_response_headers or {})
+            observation.add(captured, latency)
+
+    def _cacheKey(self, partitionKey, itemId):
+        return (self.database_id, self.container_id, partitionKey, itemId)
+
+    def _cacheUpdate(self, document, itemId = None, partitionKey = None):
+        """Refresh the cache with a written document, or drop the entry when there is none"""
+        if self.__cache is None:
+            return
+        if document:
+            self.__cache.put(self._cacheKey(self.partitionKeyOf(document), document['id']), document)
+        else:
+            self.__cache.invalidate(self._cacheKey(itemId if partitionKey is None else partitionKey, itemId))
+
     # Create a container    
-    def createContainer(self, container_id, container_path = '/id'): 
-        """Create a container if it does not exist"""
+    def createContainer(self, container_id, container_path = '/id', indexing_policy = None, throughput = 400): 
+        """Create a container if it does not exist, known containers come from the metadata cache.
+        With an indexing_policy (see CosmosSQLIndexing.indexingPolicy) an existing container gets it too if it differs.
+        """
         self.__container_id = container_id   
-        container_definition = {'id': container_id}
-        container_definition['partitionKey'] = {
-                                                    'paths': [container_path],
-                                                    'kind': documents.PartitionKind.Hash
-                                               }                                
-        try:
-            self.__container = self.client.CreateContainer("dbs/" + self.database['id'], container_definition, {'offerThroughput': 400})
-        except errors.HTTPFailure as e:
-            if e.status_code == http_constants.StatusCodes.CONFLICT:
-                self.__container = self.client.ReadContainer("dbs/" + self.database['id'] + "/colls/" + container_definition['id'])
-            else:
-                raise e
+        link = "dbs/" + self.database_id + "/colls/" + container_id
+        self.__container = self.__metadata.get(self.uri, link)
+        if self.__container is None:
+            container_definition = {'id': container_id}
+            container_definition['partitionKey'] = {
+                                                        'paths': [container_path],
+                                                        'kind': documents.PartitionKind.Hash
+                                                   }                                
+            if indexing_policy is not None:
+                container_definition['indexingPolicy'] = indexing_policy
+            for attempt in range(2):
+                try:
+                    self.__container = self.client.CreateContainer("dbs/" + self.database['id'], container_definition, {'offerThroughput': throughput})
+                except errors.HTTPFailure as e:
+                    if e.status_code == http_constants.StatusCodes.CONFLICT:
+                        self.__container = self.client.ReadContainer(link)
+                    elif e.status_code == http_constants.StatusCodes.NOT_FOUND and not attempt:
+                        # A cached database deleted since, resolved (created) again
+                        self.__metadata.invalidate(self.uri, "dbs/" + self.database_id)
+                        self.__database = None
+                        continue
+                    else:
+                        raise e
+                break
+            self.__metadata.put(self.uri, link, self.__container)
+        if indexing_policy is not None and diffPolicy(self.__container.get('indexingPolicy'), indexing_policy):
+            self.replaceIndexingPolicy(indexing_policy)
     
     def readContainer(self, container_id):
         """Set a new contain and read it"""
         self.__container_id = container_id
-        self.__container = self.client.ReadContainer("dbs/" + self.database_id + "/colls/" + container_id)
+        link = "dbs/" + self.database_id + "/colls/" + container_id
+        self.__container = self.__metadata.put(self.uri, link, self.client.ReadContainer(link))
         return self.__container
 
-    def replaceContainer(self, container):
-        self.__container = self.client.ReplaceContainer("dbs/" + self.database_id + "/colls/" + self.container_id, container)
+    def replaceContainer(self, container, indexing_policy = None):
+        """Replace the definition of the current container, with indexing_policy as its indexing policy if given"""
+        link = "dbs/" + self.database_id + "/colls/" + self.container_id
+        if indexing_policy is not None:
+            container = dict(container, indexingPolicy = indexing_policy)
+        self.__container = self.__metadata.put(self.uri, link, self.client.ReplaceContainer(link, container))
         return self.__container
 
+    def replaceIndexingPolicy(self, indexing_policy, container_id = None):
+        """Give a container (the current one by default) an indexing policy, only replacing it when it differs.
+        Returns the diff from CosmosSQLIndexing.diffPolicy, {} when it already had that policy.
+        The service then reindexes in the background, see indexTransformationProgress().
+        """
+        link = "dbs/" + self.database_id + "/colls/" + (container_id or self.container_id)
+        container = self.client.ReadContainer(link)
+        diff = diffPolicy(container.get('indexingPolicy'), indexing_policy)
+        if diff:
+            container = self.client.ReplaceContainer(link, dict(container, indexingPolicy = indexing_policy))
+        self.__metadata.put(self.uri, link, container)
+        if link == "dbs/" + self.database_id + "/colls/" + str(self.__container_id):
+            self.__container = container
+        return diff
+
+    def indexTransformationProgress(self, container_id = None):
+        """Percent of a container (the current one by default) indexed per its latest indexing policy"""
+        link = "dbs/" + self.database_id + "/colls/" + (container_id or self.container_id)
+        self.client.ReadContainer(link, {'populateQuotaInfo': True})
+        headers = requestTracker.lastHeaders() or self.client.last_response_headers or {}
+        return int(headers.get(http_constants.HttpHeaders.IndexTransformationProgress, 100))
+
+    def waitForIndexing(self, container_id = None, poll_interval = 5.0, timeout = None, progress = None):
+        """Poll indexTransformationProgress until 100, calling progress(percent) each time.
+        Returns the last percent, under 100 if the timeout (seconds) ran out first.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            percent = self.indexTransformationProgress(container_id)
+            if progress is not None:
+                progress(percent)
+            if percent >= 100 or (deadline is not None and time.monotonic() + poll_interval > deadline):
+                return percent
+            time.sleep(poll_interval)
+
     def deleteContainer(self, container_id):
         """Delete a container"""
         if not container_id:
             container_id = self.container_id
+        link = "dbs/" + self.database_id + "/colls/" + container_id
+        self.__metadata.invalidate(self.uri, link)
         try:
-            self.__container = self.client.DeleteContainer("dbs/" + self.database_id + "/colls/" + container_id)
+            self.__container = self.client.DeleteContainer(link)
         except errors.HTTPFailure: # as e:
             print("container_id {0} does not exist".format(container_id))
 
-    def recreateContainer(self, container_id, container_path = '/id'):
+    def recreateContainer(self, container_id, container_path = '/id', indexing_policy = None, throughput = 400):
         """Drop a container and re-create it""" 
         self.deleteContainer(container_id)
-        self.createContainer(container_id, container_path)
+        self.createContainer(container_id, container_path, indexing_policy, throughput)
+
+    def _refreshContainer(self):
+        """Drop the cached metadata of the current container (its offer and partition key ranges too) and read it again"""
+        link = "dbs/" + self.database_id + "/colls/" + self.container_id
+        self.__metadata.invalidate(self.uri, link)
+        self.__container = self.__metadata.put(self.uri, link, self.client.ReadContainer(link))
+        return self.__container
+
+    def _containerScoped(self, fn, *args):
+        """fn(*args) for an operation whose 404 can only mean the container is gone, e.g. an upsert:
+        the cached container may be stale (deleted or recreated by another process), so it is read again
+        and the operation retried once. A container that no longer exists raises that 404.
+        """
+        try:
+            return fn(*args)
+        except errors.HTTPFailure as e:
+            if e.status_code != http_constants.StatusCodes.NOT_FOUND:
+                raise
+        self._refreshContainer()
+        return fn(*args)
+
+    def _containerOffer(self, container_id = None, refresh = False):
+        """Offer of a container (the current one by default), from the metadata cache unless refreshed"""
+        link = "dbs/" + self.database_id + "/colls/" + (container_id or self.container_id)
+        offer = None if refresh else self.__metadata.get(self.uri, link + "/offer")
+        if offer is None:
+            # Refreshed, the container is read again too: a cached one may have been recreated since
+            container = None if refresh else self.__metadata.get(self.uri, link)
+            if container is None:
+                try:
+                    container = self.__metadata.put(self.uri, link, self.client.ReadContainer(link))
+                except errors.HTTPFailure as e:
+                    if e.status_code == http_constants.StatusCodes.NOT_FOUND:
+                        self.__metadata.invalidate(self.uri, link)
+                    raise
+            offers = self._measure('queryOffers', lambda: list(self.client.QueryOffers({
+                'query': 'SELECT * FROM root r WHERE r.offerResourceId = @rid',
+                'parameters': [{'name': '@rid', 'value': container['_rid']}]
+            })))
+            if not offers:
+                self.__metadata.invalidate(self.uri, link)
+                raise errors.HTTPFailure(http_constants.StatusCodes.NOT_FOUND, 'No offer for ' + link)
+            offer = self.__metadata.put(self.uri, link + "/offer", offers[0])
+        return offer
+
+    def readThroughputOfContainer(self, container_id = None, refresh = False):
+        """Provisioned throughput (RU/s) of a container, the current one by default.
+        From the cached offer unless refresh = True, which reads it again in case another process replaced it.
+        """
+        return self._containerOffer(container_id, refresh)['content']['offerThroughput']
 
     # Replace throughput for a container
-    def replaceThroughputOfContainer(self, value = 1000): 
-        """Change the throughput value of the curret container"""           
-        # Get the offer for the container
-        container = self.container
-        offers = list(self.client.QueryOffers("Select * from root r where r.offerResourceId='" + container['_rid'] + "'"))
-        offer = offers[0]
-        print("current throughput for " + container['id'] + ": " + str(offer['content']['offerThroughput']))
-
-        # Replace the offer with a new throughput
-        if value != offer['content']['offerThroughput']: 
-            offer['content']['offerThroughput'] = value
-            self.client.ReplaceOffer(offer['_self'], offer)
-            print("new throughput for " + container['id'] + ": " + str(offer['content']['offerThroughput']))
+    def replaceThroughputOfContainer(self, value = 1000, container_id = None): 
+        """Change the throughput value of the curret container (or container_id), returns the offer.
+        The offer is cached; a stale one (changed elsewhere) is read again and the replace retried once.
+        """
+        for attempt in range(2):
+            offer = self._containerOffer(container_id, refresh = attempt > 0)
+            if value == offer['content']['offerThroughput']:
+                return offer
+            offer = dict(offer, content = dict(offer['content'], offerThroughput = value))
+            try:
+                offer = self._measure('replaceOffer', self.client.ReplaceOffer, offer['_self'], offer)
+            except errors.HTTPFailure as e:
+                if attempt or e.status_code not in (http_constants.StatusCodes.PRECONDITION_FAILED, http_constants.StatusCodes.NOT_FOUND,
+                                                    http_constants.StatusCodes.CONFLICT):
+                    raise
+                continue
+            link = "dbs/" + self.database_id + "/colls/" + (container_id or self.container_id)
+            return self.__metadata.put(self.uri, link + "/offer", offer)
 
     # Get an existing container
     def getContainer(self, container_id):
@@ -265,63 +876,537 @@ class CosmosSQL(CosmosSQLClient):
     # Collection operations
     def upsertItem(self, document):
         """Insert or update a document"""
-        return self.client.UpsertItem("dbs/" + self.database_id + "/colls/" + self.container_id, document)
-
-    def patchItem(self, id, partialDoc):
-        """Patch a document"""
-        if 'id' in partialDoc: 
-            del partialDoc['id']
-        sql = 'SELECT * FROM ' + self.container_id + " t WHERE t.id = '{0}'".format(id)
-        for item in self.queryItems(sql):
-            document = {}
-            for key in item.keys():
-                if key[0] != '_':
-                    document[key] = item[key]
-            document.update(partialDoc) 
-            return self.upsertItem(document)
-
-    def queryItems(self, sql = ""):
-        """Query documents with the sql"""
+        result = self._containerScoped(self._measure, 'upsertItem', self.client.UpsertItem, "dbs/" + self.database_id + "/colls/" + self.container_id, document)
+        self._captureSession()
+        self._cacheUpdate(result)
+        return result
+
+    def upsertItems(self, documents, max_concurrency = 16, max_retries = 9):
+        """Upsert documents concurrently, yielding an ItemResult(item, result, error) per document.
+        Throttled (429) upserts are retried with jittered backoff honoring x-ms-retry-after-ms.
+        """
+        upsert = lambda document: _retryThrottled(self.upsertItem, document, max_retries = max_retries)
+        return _boundedMap(upsert, documents, max_concurrency)
+
+    def patchItem(self, id, partialDoc, partitionKey = None, serverSide = False, max_retries = 10):
+        """Patch a document.
+        By default a point read followed by a replace guarded by If-Match on _etag, retried on 412.
+        With serverSide = True only the changed fields are sent to the patchItem stored procedure; without a
+        partitionKey, on a container not keyed by /id, the document is read first to find it.
+        Returns None if the document does not exist.
+        """
+        partialDoc = {key: value for key, value in partialDoc.items() if key != 'id'}
+        if serverSide:
+            if partitionKey is None:
+                partitionKey = id
+                if self.partitionKeyPath != '/id':
+                    # Unknown partition key, look the document up first
+                    item = self.readItem(id)
+                    if item is None:
+                        return None
+                    partitionKey = self.partitionKeyOf(item)
+            sproc_link = self.registerStoredProcedure(PATCH_ITEM_SPROC)
+            result = self._measure('patchItem', self.client.ExecuteStoredProcedure, sproc_link, [id, partialDoc], {'partitionKey': partitionKey})
+            self._captureSession()
+            self._cacheUpdate(result, id, partitionKey)
+            return result
+
+        for attempt in range(max_retries):
+            item = self.readItem(id, partitionKey)
+            if item is None:
+                return None
+            document = {key: value for key, value in item.items() if key[0] != '_'}
+            document.update(partialDoc)
+            options = {
+                'partitionKey': self.partitionKeyOf(item),
+                'accessCondition': {'type': 'IfMatch', 'condition': item['_etag']}
+            }
+            try:
+                result = self._measure('replaceItem', self.client.ReplaceItem, "dbs/" + self.database_id + "/colls/" + self.container_id + "/docs/" + id, document, options)
+                self._captureSession()
+                self._cacheUpdate(result)
+                return result
+            except errors.HTTPFailure as e:
+                # The cached copy (if any) is stale too
+                self._cacheUpdate(None, id, options['partitionKey'])
+                if e.status_code != http_constants.StatusCodes.PRECONDITION_FAILED or attempt == max_retries - 1:
+                    raise
+
+    def patchItems(self, patches, max_concurrency = 16, serverSide = False):
+        """Patch many documents concurrently.
+        patches yields (id, partialDoc) or (id, partialDoc, partitionKey), results are ItemResult per patch.
+        """
+        patch = lambda entry: _retryThrottled(self.patchItem, *entry, serverSide = serverSide)
+        return _boundedMap(patch, patches, max_concurrency)
+
+    def batch(self, partitionKey, max_operations = 100, max_bytes = 1500000):
+        """Batch of create, upsert, replace, delete and patch operations on one partition, run transactionally"""
+        return Batch(self, partitionKey, max_operations, max_bytes)
+
+    def executeBatch(self, partitionKey, operations, max_operations = 100, max_bytes = 1500000):
+        """Run batch operations ({'op', 'id', 'document'}) of one partition with the executeBatch stored procedure.
+        Every chunk of max_operations within max_bytes is one transaction, the chunks run in order.
+        A chunk that runs out of the stored procedure's time budget is rolled back and run again as two
+        halves, each its own transaction, down to single operations.
+        Returns ItemResult(operation, result, error) per operation: the operations of a failed chunk,
+        rolled back, and of the chunks after it, not run, carry the error of that chunk.
+        """
+        sproc_link = self.registerStoredProcedure(EXECUTE_BATCH_SPROC)
+        results = []
+        error = None
+        chunks = list(chunkOperations(operations, max_operations, max_bytes))[::-1]
+        while chunks:
+            chunk = chunks.pop()
+            if error is None:
+                try:
+                    responses = _retryThrottled(self._measure, 'executeBatch', self.client.ExecuteStoredProcedure,
+                                                sproc_link, [chunk], {'partitionKey': partitionKey})
+                    self._captureSession()
+                except errors.HTTPFailure as e:
+                    if BATCH_OUT_OF_TIME in str(e) and len(chunk) > 1:
+                        half = len(chunk) // 2
+                        chunks += [chunk[half:], chunk[:half]]
+                        continue
+                    error = e
+            if error is not None:
+                results += [ItemResult(operation, None, error) for operation in chunk]
+                continue
+            for operation, response in zip(chunk, responses):
+                self._cacheUpdate(response, operation['id'], partitionKey)
+                results.append(ItemResult(operation, response, None))
+        return results
+
+    def writeBehind(self, max_pending = 1000, max_age = 1.0, max_concurrency = 16, on_write = None, on_flush = None):
+        """WriteBehindBuffer of the current container, coalescing upserts and patches until flushed"""
+        return WriteBehindBuffer(self, max_pending, max_age, max_concurrency, on_write, on_flush)
+
+    def registerStoredProcedure(self, sproc):
+        """Upsert a stored procedure into the current container once, return its link"""
+        collection_link = "dbs/" + self.database_id + "/colls/" + self.container_id
+        sproc_link = collection_link + "/sprocs/" + sproc['id']
+        if sproc_link not in self.__sprocs:
+            _retryThrottled(self.client.UpsertStoredProcedure, collection_link, sproc)
+            self.__sprocs.add(sproc_link)
+        return sproc_link
+
+    def _queryOptions(self, partitionKey = None, consistency = None):
+        """Feed options routing a query to one partition when its key is known, across all of them otherwise"""
+        if partitionKey is not None:
+            return self._readOptions({'partitionKey': partitionKey}, consistency)
+        return self._readOptions({'enableCrossPartitionQuery': True}, consistency)
+
+    def queryItems(self, sql = "", params = None, partitionKey = None, consistency = None):
+        """Query documents with the sql, a str, a {'query', 'parameters'} dict or a QueryBuilder.
+        params adds parameters ({'@name': value} or a list), with a partitionKey only that partition is queried.
+        consistency overrides the consistency level, as for readItem.
+        """
         if sql == "":
             sql = 'SELECT * FROM ' + self.container_id   
-        return self.client.QueryItems("dbs/" + self.database_id + "/colls/" + self.container_id, sql, {'enableCrossPartitionQuery': True})
+        query, _ = self.plans.get(sql.build() if isinstance(sql, QueryBuilder) else sql, params)
+        options = self._queryOptions(partitionKey, consistency)
+        observation = self._observeQuery('queryItems', query, partitionKey)
+        if observation is not None:
+            options['populateQueryMetrics'] = True
+        items = self.client.QueryItems("dbs/" + self.database_id + "/colls/" + self.container_id, query, options)
+        if observation is not None or self.__metrics is not None or self.__rate_limiter is not None:
+            return self._measureItems('queryItems', items, observation)
+        return items
+
+    def queryPages(self, sql = "", page_size = 100, continuation = None, max_ru_per_page = None, params = None, partitionKey = None,
+                   consistency = None):
+        """Query documents page by page, yielding QueryPage(items, continuation, request_charge).
+        Pass a page's continuation back in to resume right after it, e.g. after a crash or on another worker.
+        With max_ru_per_page the page size shrinks (and regrows up to page_size) to keep each page under the RU cap.
+        """
+        if sql == "":
+            sql = 'SELECT * FROM ' + self.container_id
+        query, _ = self.plans.get(sql.build() if isinstance(sql, QueryBuilder) else sql, params)
+        observation = self._observeQuery('queryPages', query, partitionKey)
+        size = page_size
+        try:
+            while True:
+                options = self._queryOptions(partitionKey, consistency)
+                options['maxItemCount'] = size
+                if continuation:
+                    options['continuation'] = continuation
+                if observation is not None:
+                    options['populateQueryMetrics'] = True
+                fetch = self.client.QueryItems("dbs/" + self.database_id + "/colls/" + self.container_id, query, options).fetch_next_block
+                before = requestTracker.tally().requests
+                if observation is not None:
+                    items = self._measure('queryPage', self._observed, observation, fetch)
+                else:
+                    items = self._measure('queryPage', fetch)
+                headers = self._responseHeaders(before)
+                continuation = headers.get(http_constants.HttpHeaders.Continuation)
+                charge = float(headers.get(http_constants.HttpHeaders.RequestCharge, 0))
+                yield QueryPage(items, continuation, charge)
+                if not continuation:
+                    return
+                if max_ru_per_page and charge > 0:
+                    size = max(1, min(page_size, int(size * max_ru_per_page / charge)))
+        except Exception:
+            if observation is not None:
+                observation.finish(failed = True)
+            raise
+        finally:
+            if observation is not None:
+                observation.finish()
+
+    def queryItemsParallel(self, sql = "", max_degree_of_parallelism = 8, prefetch = 2, page_size = 100, params = None, partitionKey = None,
+                           consistency = None):
+        """Query documents with one query per partition key range, max_degree_of_parallelism ranges at a time.
+        Each range is read up to prefetch pages ahead; ORDER BY, TOP, aggregates, GROUP BY and DISTINCT are merged
+        client side. Single partition queries and those that can't be merged that way (OFFSET LIMIT, ORDER BY with
+        DISTINCT or VALUE, SQL beyond the parsed subset) run as queryItems.
+        """
+        if sql == "":
+            sql = 'SELECT * FROM ' + self.container_id
+        query, plan = self.plans.get(sql.build() if isinstance(sql, QueryBuilder) else sql, params)
+        if partitionKey is not None or plan is None or not ParallelQuery.supports(plan):
+            return self.queryItems(query, partitionKey = partitionKey, consistency = consistency)
+        ranges = [r['id'] for r in self.partitionKeyRanges()]
+        options = self._readOptions({}, consistency)
+        fetch = lambda range_id, query, continuation: self._queryRange(range_id, query, continuation, page_size, options)
+        return self.__invalidateRangesOnGone(iter(ParallelQuery(plan, fetch, ranges, max_degree_of_parallelism, prefetch)))
+
+    def __invalidateRangesOnGone(self, items):
+        try:
+            for item in items:
+                yield item
+        except errors.HTTPFailure as e:
+            if e.status_code == http_constants.StatusCodes.GONE:
+                # A partition split, the next query reads the new ranges
+                self.__metadata.invalidate(self.uri, "dbs/" + self.database_id + "/colls/" + self.container_id + "/pkranges")
+            raise
+
+    def _queryRange(self, range_id, query, continuation = None, page_size = 100, options = None):
+        """One page of a query on one partition key range, returns (items, continuation)"""
+        collection_link = "dbs/" + self.database_id + "/colls/" + self.container_id
+        options = dict(options or {}, maxItemCount = page_size)
+        if continuation:
+            options['continuation'] = continuation
+        before = requestTracker.tally().requests
+        import azure.cosmos.base as base
+        items, headers = self._measure('queryRange', self.client.QueryFeed, base.GetPathFromLink(collection_link, 'docs'),
+                                       base.GetResourceIdOrFullNameFromLink(collection_link), query, options, range_id)
+        if requestTracker.tally().requests != before:
+            headers = self._responseHeaders(before)
+        return items, (headers or {}).get(http_constants.HttpHeaders.Continuation)
+
+    def queryColumns(self, sql = "", columns = None, dtypes = None, params = None, partitionKey = None, chunk_size = 10000, page_size = 1000, output = 'numpy'):
+        """Query results as column chunks of at most chunk_size rows, {column: numpy array} or with output = 'arrow'
+        pyarrow Tables. columns are fields by path ('address.city'), the fields of the first result by default;
+        dtypes maps columns to numpy dtypes, inferred otherwise. One page of results is decoded at a time.
+        """
+        if sql == "":
+            sql = 'SELECT * FROM ' + self.container_id
+        query, plan = self.plans.get(sql.build() if isinstance(sql, QueryBuilder) else sql, params)
+        # numpy and pyarrow are imported on first use
+        from CosmosSQLColumns import ColumnDecoder, projectColumns
+        query, paths = projectColumns(query, plan, columns)
+        decoder = ColumnDecoder(columns, dtypes, chunk_size, output, paths)
+        def chunks():
+            for page in self.queryPages(query, page_size, partitionKey = partitionKey):
+                for chunk in decoder.add(page.items):
+                    yield chunk
+            chunk = decoder.finish()
+            if chunk is not None:
+                yield chunk
+        return chunks()
+
+    def count(self, filter_sql = None, params = None, partitionKey = None):
+        """Number of documents matching a filter on alias c (all of them without one), counted by the service"""
+        return self.aggregate(None, 'COUNT', filter_sql, params, partitionKey = partitionKey)
+
+    def aggregate(self, field, op, filter_sql = None, params = None, group_by = None, partitionKey = None):
+        """COUNT, SUM, AVG, MIN or MAX of a field ('price', 'address.zip'; None counts documents) over the
+        documents matching a filter on alias c, computed by the service per partition key range and merged here.
+        Returns the value (None when no document has the field), or with group_by (a field or a list of them)
+        a list of {group field: value, ..., 'value': aggregate}, one per group.
+        """
+        op = op.upper()
+        if op not in ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX'):
+            raise ValueError('Unsupported aggregate ' + op)
+        argument = '1' if field is None else pathExpression(field)
+        where = ' WHERE ' + filter_sql if filter_sql else ''
+        if group_by is None:
+            sql = 'SELECT VALUE {0}({1}) FROM c{2}'.format(op, argument, where)
+            return next(iter(self.queryItemsParallel(sql, params = params, partitionKey = partitionKey)), None)
+        fields = [group_by] if isinstance(group_by, str) else list(group_by)
+        expressions = [pathExpression(name) for name in fields]
+        sql = 'SELECT {0}, {1}({2}) AS v FROM c{3} GROUP BY {4}'.format(
+            ', '.join('{0} AS g{1}'.format(expression, i) for i, expression in enumerate(expressions)), op, argument, where, ', '.join(expressions))
+        groups = []
+        for row in self.queryItemsParallel(sql, params = params, partitionKey = partitionKey):
+            group = {name: row.get('g{0}'.format(i)) for i, name in enumerate(fields)}
+            group['value'] = row.get('v')
+            groups.append(group)
+        return groups
+
+    def distinct(self, field, filter_sql = None, params = None, partitionKey = None):
+        """Distinct values of a field over the documents matching a filter on alias c, deduplicated by the service
+        per partition key range and across ranges here
+        """
+        sql = 'SELECT DISTINCT VALUE {0} FROM c{1}'.format(pathExpression(field), ' WHERE ' + filter_sql if filter_sql else '')
+        return list(self.queryItemsParallel(sql, params = params, partitionKey = partitionKey))
+
+    def partitionKeyRanges(self):
+        """Partition key ranges of the current container, from the metadata cache once read"""
+        link = "dbs/" + self.database_id + "/colls/" + self.container_id + "/pkranges"
+        ranges = self.__metadata.get(self.uri, link)
+        if ranges is None:
+            collection_link = "dbs/" + self.database_id + "/colls/" + self.container_id
+            read = lambda: _retryThrottled(lambda: list(self.client._ReadPartitionKeyRanges(collection_link)))
+            ranges = [{'id': r['id'], 'minInclusive': r['minInclusive'], 'maxExclusive': r['maxExclusive'], 'parents': r.get('parents', [])}
+                      for r in self._containerScoped(read)]
+            self.__metadata.put(self.uri, link, ranges)
+        return ranges
+
+    def changeFeed(self, store = None, name = 'default', batch_size = 100, start_from_beginning = True):
+        """ChangeFeedReader of the current container resuming from the checkpoints of name in store
+        (in memory by default, e.g. FileCheckpointStore for a sync job), at most batch_size changes per batch.
+        Without checkpoints the feed starts from the beginning, or from now with start_from_beginning = False.
+        """
+        collection_link = "dbs/" + self.database_id + "/colls/" + self.container_id
+
+        def fetch(range_id, continuation, start_from_beginning):
+            options = {'partitionKeyRangeId': range_id, 'maxItemCount': batch_size}
+            if continuation:
+                options['continuation'] = continuation
+            elif not start_from_beginning:
+                # If-None-Match: * starts from now; the SDK's isStartFromBeginning = False never sends it
+                options['continuation'] = '*'
+            try:
+                items = _retryThrottled(self._measure, 'changeFeed', self.client.QueryItemsChangeFeed(collection_link, options).fetch_next_block)
+            except errors.HTTPFailure as e:
+                if e.status_code == http_constants.StatusCodes.GONE:
+                    # The range split, the next reader resumes its children from its checkpoint
+                    self.__metadata.invalidate(self.uri, collection_link + "/pkranges")
+                raise
+            headers = requestTracker.lastHeaders() or self.client.last_response_headers or {}
+            return items, headers.get(http_constants.HttpHeaders.ETag)
+
+        return ChangeFeedReader(fetch, self.partitionKeyRanges(), store or MemoryCheckpointStore(), name, start_from_beginning)
 
     def listItems(self):
         """List all the document"""
         for item in self.queryItems():
             print(item)
 
-    def listItemsJson(self):
-        """List all the documents in JSON format"""
-        for item in self.queryItems():
-            print(json.dumps(item, indent=True))
-
-    def readItem(self, itemId):
-        """Read a document per ID"""
-        items = self.queryItems({
-                                    'query': 'SELECT * FROM root r WHERE r.id=@id',
-                                    'parameters': [
-                                            {'name': '@id', 'value': itemId}
-                                    ]
-                                })
-        document = {}
-        for item in items:
-            for key in item.keys():
-                if key[0] != '_':
-                    document[key] = item[key]
-            document = item
-            break
-        
+    def listItemsJson(self, out = None, lines = False):
+        """Write all the documents in JSON format to out (a text or binary file, stdout by default),
+        one line each with lines. Returns the count.
+        """
+        return writeJson(self.queryItems(), out or sys.stdout, lines)
+
+    def exportContainer(self, path, query = None, compress = 'gzip', shards = 1, page_size = 1000, params = None):
+        """Stream the documents (or those of a query) page by page to a JSONL file, gzip or zstd compressed,
+        without their system properties. The compression extension is added to path if missing.
+        With shards > 1 the partition key ranges are split over as many files written in parallel,
+        e.g. products-0-of-4.jsonl.gz; the query should then only filter or project.
+        Returns {'documents', 'files'}.
+        """
+        extension = EXTENSIONS.get(compress, '')
+        if not path.endswith(extension):
+            path += extension
+        query, _ = self.plans.get(query or 'SELECT * FROM c', params)
+        if shards <= 1:
+            with openJsonl(path, 'w', compress) as f:
+                count = 0
+                for page in self.queryPages(query, page_size = page_size):
+                    f.writelines(encodeDocument(document) for document in page.items)
+                    count += len(page.items)
+            return {'documents': count, 'files': [path]}
+
+        ranges = [r['id'] for r in self.partitionKeyRanges()]
+        paths = shardPaths(path, shards)
+
+        def exportShard(shard):
+            count = 0
+            with openJsonl(paths[shard], 'w', compress) as f:
+                for range_id in ranges[shard::shards]:
+                    continuation = None
+                    while True:
+                        items, continuation = _retryThrottled(self._queryRange, range_id, query, continuation, page_size)
+                        f.writelines(encodeDocument(document) for document in items)
+                        count += len(items)
+                        if not continuation:
+                            break
+            return count
+
+        with ThreadPoolExecutor(max_workers = shards) as executor:
+            counts = list(executor.map(exportShard, range(shards)))
+        return {'documents': sum(counts), 'files': paths}
+
+    def importContainer(self, path, max_concurrency = 16, checkpoint_path = None):
+        """Upsert the documents of a JSONL file written by exportContainer (all its shards when path names a
+        sharded export) through a bounded concurrent pipeline, retrying 429s.
+        Progress is checkpointed to checkpoint_path (path + '.checkpoint' by default), so an interrupted
+        or partly failed import resumes where it stopped; the checkpoint is removed once everything succeeded.
+        Returns {'imported', 'skipped', 'failures'} where failures are ItemResult((file, line), None, error).
+        """
+        paths = importPaths(path)
+        if not paths:
+            raise IOError('No file to import for ' + str(path))
+        checkpoint_path = checkpoint_path or (path if isinstance(path, str) else paths[0]) + '.checkpoint'
+        checkpoint = ImportCheckpoint(checkpoint_path)
+        report = {'imported': 0, 'skipped': 0, 'failures': []}
+
+        def lines():
+            for file_path in paths:
+                mark, failed = checkpoint.resume(file_path)
+                with openJsonl(file_path, 'r', compressionOf(file_path)) as f:
+                    for number, line in enumerate(f, 1):
+                        if not line.strip():
+                            checkpoint.done(file_path, number)
+                        elif number <= mark and number not in failed:
+                            report['skipped'] += 1
+                        else:
+                            yield file_path, number, line
+
+        codec = getCodec()
+        upsert = lambda entry: _retryThrottled(self.upsertItem, codec.loads(entry[2]))
+        for result in _boundedMap(upsert, lines(), max_concurrency):
+            file_path, number, _ = result.item
+            checkpoint.done(file_path, number, result.error is not None)
+            if result.error is None:
+                report['imported'] += 1
+            else:
+                report['failures'].append(ItemResult((file_path, number), None, result.error))
+        checkpoint.save()
+        if not report['failures']:
+            os.remove(checkpoint_path)
+        return report
+
+    @property
+    def partitionKeyPath(self):
+        """Partition key path of the current container, e.g. '/lastName'"""
+        return self.container['partitionKey']['paths'][0]
+
+    def partitionKeyOf(self, document):
+        """Partition key value of a document per the container definition"""
+        return partitionKeyValue(document, self.partitionKeyPath)
+
+    def readItem(self, itemId, partitionKey = None, consistency = None, deadline = None, hedge = None):
+        """Point read a document per ID and partition key, None if not found.
+        consistency overrides the consistency level (Strong, BoundedStaleness, Session, ConsistentPrefix, Eventual).
+        With a cache, fresh entries are served locally and, in revalidate mode, expired ones
+        are checked with If-None-Match so an unchanged document costs a 304 instead of a full read.
+        A read taking over deadline seconds raises a 408 HTTPFailure; with a HedgePolicy a read slower than
+        its delay is sent again, the first response wins.
+        """
+        if deadline is not None or hedge is not None:
+            return hedgedCall('readItem', lambda: self.readItem(itemId, partitionKey, consistency), deadline, hedge)
+        if partitionKey is None:
+            if self.partitionKeyPath != '/id':
+                # Unknown partition key, fall back to a cross partition lookup
+                for item in self.queryItems('SELECT * FROM root r WHERE r.id=@id', {'@id': itemId}, consistency = consistency):
+                    return item
+                return None
+            partitionKey = itemId
+        options = self._readOptions({'partitionKey': partitionKey}, consistency)
+        stale = None
+        if self.__cache is not None:
+            key = self._cacheKey(partitionKey, itemId)
+            document = self.__cache.get(key)
+            # A strong read goes to the service, a revalidation at most
+            if document is not None and consistency != documents.ConsistencyLevel.Strong:
+                return document
+            if self.__cache.revalidate:
+                stale = self.__cache.stale(key)
+                if stale is not None:
+                    options['accessCondition'] = {'type': 'IfNoneMatch', 'condition': stale['_etag']}
+        try:
+            document = self._measure('readItem', self.client.ReadItem, "dbs/" + self.database_id + "/colls/" + self.container_id + "/docs/" + itemId, options)
+        except errors.HTTPFailure as e:
+            if e.status_code == http_constants.StatusCodes.NOT_FOUND:
+                self._cacheUpdate(None, itemId, partitionKey)
+                return None
+            raise
+        if self.__cache is not None:
+            if stale is not None and not document:
+                # 304 Not Modified comes back without a body
+                self.__cache.touch(key)
+                return stale
+            self.__cache.put(key, document)
         return document
 
+    def readItems(self, keys, max_concurrency = 16, deadline = None, hedge = None):
+        """Point read many (id, partitionKey) pairs concurrently, in input order, retrying 429s.
+        All the reads share the deadline in seconds, a HedgePolicy hedges each of them.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        expires = time.perf_counter() + deadline if deadline is not None else None
+        def read(key):
+            if expires is None:
+                return self.readItem(key[0], key[1], hedge = hedge)
+            remaining = expires - time.perf_counter()
+            if remaining <= 0:
+                raise deadlineExceeded('readItems', deadline)
+            return self.readItem(key[0], key[1], deadline = remaining, hedge = hedge)
+        with ThreadPoolExecutor(max_workers = min(max_concurrency, len(keys))) as executor:
+            return list(executor.map(lambda key: _retryThrottled(read, key), keys))
+
     def deleteItem(self, itemId, partitionKey = None):
-        """Delete a document per ID"""
-        if not partitionKey:
+        """Delete a document per ID and partition key.
+        Without a partition key the id is used on containers keyed by /id, otherwise the document is looked up first.
+        """
+        if partitionKey is None:
             partitionKey = itemId
+            if self.partitionKeyPath != '/id':
+                item = self.readItem(itemId)
+                if item is not None:
+                    partitionKey = self.partitionKeyOf(item)
         options = {'enableCrossPartitionQuery': True}
         options['maxItemCount'] = 5
         options['partitionKey'] = partitionKey
-        return self.client.DeleteItem("dbs/" + self.database_id + "/colls/" + self.container_id + "/docs/" + itemId , options)
+        self._cacheUpdate(None, itemId, partitionKey)
+        result = self._measure('deleteItem', self.client.DeleteItem, "dbs/" + self.database_id + "/colls/" + self.container_id + "/docs/" + itemId , options)
+        self._captureSession()
+        return result
+
+    def deleteWhere(self, filter_sql, params = None, max_concurrency = 16, partitionKey = None, serverSide = False):
+        """Delete the documents matching a filter on alias c, e.g. deleteWhere('c.status = @s', {'@s': 'DISCONTINUED'}).
+        Only id and the partition key are projected and streamed to concurrent deletes with 429 backoff.
+        With serverSide = True the deleteWhere stored procedure purges the given partition in batched calls.
+        Returns {'matched', 'deleted', 'notFound', 'failures'} where failures are ItemResult.
+        """
+        parameters = queryParameters(params)
+        if serverSide:
+            if partitionKey is None:
+                raise ValueError('deleteWhere serverSide needs a partitionKey')
+            sproc_link = self.registerStoredProcedure(DELETE_WHERE_SPROC)
+            query = {'query': 'SELECT c._self FROM c WHERE ' + filter_sql, 'parameters': parameters}
+            deleted = 0
+            while True:
+                result = _retryThrottled(self._measure, 'deleteWhere', self.client.ExecuteStoredProcedure,
+                                         sproc_link, [query], {'partitionKey': partitionKey})
+                deleted += result['deleted']
+                if not result['continuation']:
+                    break
+            if self.__cache is not None:
+                self.__cache.clear()
+            return {'matched': deleted, 'deleted': deleted, 'notFound': 0, 'failures': []}
+
+        query, _ = self.plans.get('SELECT c.id, {0} AS partitionKey FROM c WHERE {1}'.format(partitionKeyExpression(self.partitionKeyPath), filter_sql), parameters)
+        keys = self.client.QueryItems("dbs/" + self.database_id + "/colls/" + self.container_id, query, self._queryOptions(partitionKey))
+        if self.__metrics is not None or self.__rate_limiter is not None:
+            keys = self._measureItems('deleteWhereQuery', keys)
+
+        report = {'matched': 0, 'deleted': 0, 'notFound': 0, 'failures': []}
+        delete = lambda key: _retryThrottled(self.deleteItem, key['id'], key.get('partitionKey'))
+        for result in _boundedMap(delete, keys, max_concurrency):
+            report['matched'] += 1
+            if result.error is None:
+                report['deleted'] += 1
+            elif isinstance(result.error, errors.HTTPFailure) and result.error.status_code == http_constants.StatusCodes.NOT_FOUND:
+                report['notFound'] += 1
+            else:
+                report['failures'].append(result)
+        return report
 
     #Expose id function
     @property
@@ -339,38 +1424,29 @@ if __name__ == '__main__':
     cosmos.replaceThroughputOfContainer(1000) 
 
     # Insert data
-    for i in range(1, 10):
-        cosmos.upsertItem({
-            'id': cosmos.id,
-            'itemId': 'item{0}'.format(i),
-            'productName': 'Widget',
-            'productModel': 'Model {0}'.format(i)
-        }
-    )
+    products = ({
+                    'id': cosmos.id,
+                    'itemId': 'item{0}'.format(i),
+                    'productName': 'Widget',
+                    'productModel': 'Model {0}'.format(i)
+                } for i in range(1, 10))
+    for result in cosmos.upsertItems(products):
+        if result.error:
+            print('Failed to insert {0}: {1}'.format(result.item['itemId'], result.error))
 
     # Delete data
-    sql = 'SELECT * FROM ' + cosmos.container_id + ' p WHERE p.productModel = "DISCONTINUED"'
-    for item in cosmos.queryItems(sql):
-        cosmos.deleteItem(item['id'])
+    print(cosmos.deleteWhere('c.productModel = @model', {'@model': 'DISCONTINUED'}))
 
     # Query the database
     database = cosmos.database
     container = cosmos.container
 
-    # Enumerate the returned items
-    sql = 'SELECT * FROM ' + cosmos.container_id + ' r WHERE r.itemId="item3"'
-    for item in cosmos.queryItems(sql):
-        print(json.dumps(item, indent=True))
-
-    discontinued_items = cosmos.queryItems({
-                                            'query': 'SELECT * FROM root r WHERE r.itemId=@id',
-                                            'parameters': [
-                                                {'name': '@id', 'value': 'item4'}
-                                            ]
-                                           })
-                                       
-    for item in discontinued_items:
-        print(json.dumps(item, indent=True))
+    # Enumerate the returned items, all the widgets live in one partition
+    writeJson(cosmos.queryItems(QueryBuilder().where('itemId', '=', 'item3'), partitionKey = 'Widget'), sys.stdout)
+
+    discontinued_items = cosmos.queryItems('SELECT * FROM root r WHERE r.itemId=@id', {'@id': 'item4'}, partitionKey = 'Widget')
+
+    writeJson(discontinued_items, sys.stdout)
 
     # Modify container properties
     container = cosmos.container
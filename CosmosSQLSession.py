@@ -0,0 +1,96 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Session tokens per logical user, so relaxed consistency reads still see their own writes
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    user = cosmos.session('user-42')             # CosmosSQL view, its tokens kept under that name
+##    user.upsertItem(cart)                        # captures the session token of the write
+##    user.readItem(cart['id'], 'user-42', consistency = 'Session')   # sees the write
+##
+##    cookie = user.session_context.dumps()        # carry the session to another process or request
+##    other = cosmos.session(SessionContext.loads(cookie))
+##
+## A session token is a per partition key range log sequence number. A read sent with the token
+## is served by a replica that has caught up with it. Session reads cost the same RU as eventual
+## reads, half of strong or bounded staleness ones.
+## Tokens are merged per range (the highest LSN wins) and per container.
+##############################################################################################
+import json
+import threading
+from collections import OrderedDict
+
+def _lsn(token):
+    """Global LSN of one range's token, e.g. -1#125 (version#lsn[#region=lsn...]) or a plain 125"""
+    segments = token.split('#')
+    try:
+        return int(segments[1] if len(segments) > 1 else segments[0])
+    except ValueError:
+        return -1
+
+class SessionContext:
+    """Latest session token per partition key range of every container a logical user wrote to.
+
+    Methods:
+        capture(collection_link, session_token)
+        token(collection_link)
+        dumps()
+        loads(text)
+        clear()
+    """
+    def __init__(self, tokens = None):
+        self.__tokens = tokens or {}     # collection link -> {range id: token}
+        self.__lock = threading.Lock()
+
+    def capture(self, collection_link, session_token):
+        """Merge an x-ms-session-token response header ('0:-1#125,1:-1#98') into the container's tokens"""
+        if not session_token:
+            return
+        with self.__lock:
+            tokens = self.__tokens.setdefault(collection_link, {})
+            for part in session_token.split(','):
+                range_id, _, token = part.strip().partition(':')
+                if token and (range_id not in tokens or _lsn(token) >= _lsn(tokens[range_id])):
+                    tokens[range_id] = token
+
+    def token(self, collection_link):
+        """Session token to send with reads of a container, None before any write to it"""
+        with self.__lock:
+            tokens = self.__tokens.get(collection_link)
+            if not tokens:
+                return None
+            return ','.join(range_id + ':' + token for range_id, token in sorted(tokens.items()))
+
+    def dumps(self):
+        """JSON text of the tokens, e.g. for a cookie"""
+        with self.__lock:
+            return json.dumps(self.__tokens, sort_keys = True)
+
+    @staticmethod
+    def loads(text):
+        """SessionContext from dumps() text"""
+        return SessionContext(json.loads(text) if text else None)
+
+    def clear(self):
+        with self.__lock:
+            self.__tokens.clear()
+
+class SessionRegistry:
+    """SessionContext per logical user name, the least recently used dropped beyond max_users"""
+    def __init__(self, max_users = 10000):
+        self.max_users = max_users
+        self.__contexts = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, name):
+        with self.__lock:
+            context = self.__contexts.pop(name, None) or SessionContext()
+            self.__contexts[name] = context
+            if len(self.__contexts) > self.max_users:
+                self.__contexts.popitem(last = False)
+            return context
+
+    def __len__(self):
+        return len(self.__contexts)
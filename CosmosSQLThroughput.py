@@ -0,0 +1,183 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Background controller scaling a container's provisioned throughput to its load
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    cosmos = CosmosSQL('myDatabase', metrics = MetricsRegistry())
+##    cosmos.createContainer('products', '/category')
+##    controller = ThroughputController(cosmos, min_throughput = 400, max_throughput = 10000)
+##    controller.addListener(lambda event: print(event.action, event.throughput, event.target, event.reason))
+##    controller.start()
+##    ...
+##    controller.stop()
+##
+## The RU consumed and the 429s come from the CosmosSQL metrics registry. Every interval the
+## controller compares the RU/s consumed with the provisioned throughput:
+##    throttled or above scale_up_utilization - scale up (at least by scale_up_factor), after up_cooldown
+##    below scale_down_utilization            - scale down to target_utilization once it stayed low for
+##                                              down_evaluations intervals, after down_cooldown
+## The gap between the two thresholds is the hysteresis that keeps it from flapping.
+## Every evaluation is an event, the decision included (scaleUp, scaleDown, hold or error).
+##############################################################################################
+import math
+import threading
+import time
+from collections import deque, namedtuple
+
+ThroughputEvent = namedtuple('ThroughputEvent', ['time', 'action', 'throughput', 'target', 'ru_per_second',
+                                                 'utilization', 'throttle_rate', 'reason'])
+
+def _roundThroughput(value):
+    """Provisioned throughput goes by 100 RU/s"""
+    return int(math.ceil(value / 100.0)) * 100
+
+class ThroughputController:
+    """Scales the offer of a container between min_throughput and max_throughput per the observed load.
+
+    Attributes:
+        container_id - container scaled, the current one of cosmos when created
+        events       - the latest ThroughputEvent, most recent last
+    Methods:
+        start()
+        stop()
+        evaluate()
+        addListener(listener)
+        removeListener(listener)
+    """
+    def __init__(self, cosmos, min_throughput = 400, max_throughput = 10000, interval = 60.0,
+                 target_utilization = 0.7, scale_up_utilization = 0.9, scale_down_utilization = 0.4,
+                 max_throttle_rate = 0.01, scale_up_factor = 1.5, up_cooldown = 60.0, down_cooldown = 900.0,
+                 down_evaluations = 3, history = 100):
+        if cosmos.metrics is None:
+            raise ValueError('ThroughputController needs a CosmosSQL with a MetricsRegistry')
+        self.cosmos = cosmos
+        self.container_id = cosmos.container_id
+        self.min_throughput = min_throughput
+        self.max_throughput = max_throughput
+        self.interval = interval
+        self.target_utilization = target_utilization
+        self.scale_up_utilization = scale_up_utilization
+        self.scale_down_utilization = scale_down_utilization
+        self.max_throttle_rate = max_throttle_rate
+        self.scale_up_factor = scale_up_factor
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.down_evaluations = down_evaluations
+        self.events = deque(maxlen = history)
+        self.__listeners = []
+        self.__lock = threading.Lock()
+        self.__request_charge = 0.0
+        self.__requests = 0
+        self.__throttles = 0
+        self.__window_start = time.monotonic()
+        self.__last_change = None
+        self.__low = 0
+        self.__stop = threading.Event()
+        self.__thread = None
+        cosmos.metrics.addExporter(self.__observe)
+
+    def __observe(self, sample):
+        if sample.container != self.container_id:
+            return
+        with self.__lock:
+            self.__request_charge += sample.request_charge
+            self.__requests += sample.requests
+            self.__throttles += sample.throttles
+
+    def addListener(self, listener):
+        """Call listener(event) with every ThroughputEvent from now on"""
+        with self.__lock:
+            self.__listeners.append(listener)
+
+    def removeListener(self, listener):
+        with self.__lock:
+            self.__listeners.remove(listener)
+
+    def start(self):
+        """Evaluate every interval seconds on a daemon thread"""
+        if self.__thread is None:
+            self.__stop.clear()
+            self.__thread = threading.Thread(target = self.__run, name = 'ThroughputController', daemon = True)
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background evaluations and stop observing the metrics"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.cosmos.metrics.removeExporter(self.__observe)
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            self.evaluate()
+
+    def evaluate(self):
+        """Decide on the window observed since the previous evaluation, apply it and return the event"""
+        now = time.monotonic()
+        with self.__lock:
+            request_charge, requests, throttles = self.__request_charge, self.__requests, self.__throttles
+            elapsed = max(now - self.__window_start, 1e-6)
+            self.__request_charge, self.__requests, self.__throttles = 0.0, 0, 0
+            self.__window_start = now
+        ru_per_second = request_charge / elapsed
+        throttle_rate = float(throttles) / requests if requests else 0.0
+        try:
+            # The cached offer, replaceThroughputOfContainer reads it again if it went stale
+            throughput = self.cosmos.readThroughputOfContainer(self.container_id, refresh = False)
+        except Exception as e:
+            return self.__emit('error', None, None, ru_per_second, None, throttle_rate, str(e))
+        utilization = ru_per_second / throughput
+        action, target, reason = self.__decide(now, throughput, ru_per_second, utilization, throttle_rate)
+        if action != 'hold':
+            try:
+                self.cosmos.replaceThroughputOfContainer(target, self.container_id)
+                self.__last_change = now
+            except Exception as e:
+                action, reason = 'error', str(e)
+        return self.__emit(action, throughput, target, ru_per_second, utilization, throttle_rate, reason)
+
+    def __decide(self, now, throughput, ru_per_second, utilization, throttle_rate):
+        """(action, target, reason) for the window"""
+        needed = _roundThroughput(ru_per_second / self.target_utilization)
+        since_change = now - self.__last_change if self.__last_change is not None else float('inf')
+        if throughput < self.min_throughput or throughput > self.max_throughput:
+            self.__low = 0
+            target = min(max(throughput, self.min_throughput), self.max_throughput)
+            return ('scaleUp' if target > throughput else 'scaleDown'), target, 'outside the bounds'
+        if throttle_rate > self.max_throttle_rate or utilization > self.scale_up_utilization:
+            self.__low = 0
+            target = min(self.max_throughput, max(_roundThroughput(throughput * self.scale_up_factor), needed))
+            reason = 'throttle rate {0:.1%}, utilization {1:.0%}'.format(throttle_rate, utilization)
+            if target <= throughput:
+                return 'hold', throughput, 'at the maximum, ' + reason
+            if since_change < self.up_cooldown:
+                return 'hold', throughput, 'cooling down, ' + reason
+            return 'scaleUp', target, reason
+        if utilization < self.scale_down_utilization and throttle_rate == 0:
+            self.__low += 1
+            target = max(self.min_throughput, needed)
+            reason = 'utilization {0:.0%}'.format(utilization)
+            if target >= throughput:
+                return 'hold', throughput, 'at the minimum, ' + reason
+            if self.__low < self.down_evaluations:
+                return 'hold', throughput, 'low for {0}/{1} evaluations, {2}'.format(self.__low, self.down_evaluations, reason)
+            if since_change < self.down_cooldown:
+                return 'hold', throughput, 'cooling down, ' + reason
+            self.__low = 0
+            return 'scaleDown', target, reason
+        self.__low = 0
+        return 'hold', throughput, 'utilization {0:.0%} within bounds'.format(utilization)
+
+    def __emit(self, action, throughput, target, ru_per_second, utilization, throttle_rate, reason):
+        event = ThroughputEvent(time.time(), action, throughput, target, ru_per_second, utilization, throttle_rate, reason)
+        with self.__lock:
+            self.events.append(event)
+            listeners = list(self.__listeners)
+        for listener in listeners:
+            listener(event)
+        return event
@@ -0,0 +1,144 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Compressed JSONL files and import checkpoints for CosmosSQL export/import
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    cosmos.exportContainer('products.jsonl.gz')                          # gzip
+##    cosmos.exportContainer('products.jsonl.zst', compress = 'zstd', shards = 4)
+##    cosmos.importContainer('products.jsonl.zst')                         # all the shards, resumable
+##
+## One document per line, system properties (_rid, _etag, _ts, ...) stripped.
+## zstd needs the zstandard package (pip install zstandard).
+##############################################################################################
+import glob
+import gzip
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, only zstd files need it
+    zstandard = None
+
+from CosmosSQLJson import getCodec
+
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', None: ''}
+
+def compressionOf(path):
+    """Compression of a file per its extension: 'gzip', 'zstd' or None"""
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+def openJsonl(path, mode = 'r', compress = None):
+    """Text stream over a plain, gzip or zstd JSONL file"""
+    if compress == 'gzip':
+        return gzip.open(path, mode + 't', encoding = 'utf-8')
+    if compress == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression needs the zstandard package')
+        return zstandard.open(path, mode + 't', encoding = 'utf-8')
+    if compress is not None:
+        raise ValueError('Unknown compression ' + str(compress))
+    return open(path, mode, encoding = 'utf-8')
+
+def encodeDocument(document):
+    """JSON line of a document without its system properties.
+    The system properties are dropped from the (query result) document itself rather than copied around.
+    """
+    for key in [key for key in document if key[:1] == '_']:
+        del document[key]
+    return getCodec().dumps(document) + '\n'
+
+def shardPaths(path, shards):
+    """File names of an export, e.g. products.jsonl.gz -> products-0-of-4.jsonl.gz, ..."""
+    if shards <= 1:
+        return [path]
+    directory, name = os.path.split(path)
+    stem, _, extension = name.partition('.')
+    return [os.path.join(directory, '{0}-{1}-of-{2}.{3}'.format(stem, i, shards, extension)) for i in range(shards)]
+
+def importPaths(path):
+    """Files of an import: the file itself, else the shards exportContainer wrote for that name"""
+    if isinstance(path, (list, tuple)):
+        return list(path)
+    if os.path.exists(path):
+        return [path]
+    directory, name = os.path.split(path)
+    stem, _, extension = name.partition('.')
+    return sorted(glob.glob(os.path.join(directory, glob.escape(stem) + '-*-of-*.' + glob.escape(extension))))
+
+class ImportCheckpoint:
+    """Progress of an import per file, saved atomically to a JSON file.
+    Lines complete out of order, so the checkpoint keeps the low-water mark (every line up to it is done)
+    and the lines that failed; a resumed import skips the former and retries the latter.
+
+    Methods:
+        resume(path)
+        done(path, line, failed = False)
+        save()
+    """
+    def __init__(self, checkpoint_path, save_every = 1000):
+        self.checkpoint_path = checkpoint_path
+        self.save_every = save_every
+        self.__files = {}       # path -> {'line': low-water mark, 'failed': [line, ...]}
+        self.__pending = {}     # path -> lines done above the mark
+        self.__unsaved = 0
+        self.__lock = threading.Lock()
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self.__files = json.load(f)
+
+    def resume(self, path):
+        """(low-water mark, set of failed lines) to resume a file from"""
+        with self.__lock:
+            entry = self.__files.setdefault(path, {'line': 0, 'failed': []})
+            self.__pending[path] = set()
+            return entry['line'], set(entry['failed'])
+
+    def done(self, path, line, failed = False):
+        """Record a finished line (1-based)"""
+        with self.__lock:
+            entry = self.__files[path]
+            if failed and line not in entry['failed']:
+                entry['failed'].append(line)
+            elif not failed and line <= entry['line'] and line in entry['failed']:
+                # A line that failed before went through on the retry
+                entry['failed'].remove(line)
+            if line > entry['line']:
+                pending = self.__pending[path]
+                pending.add(line)
+                while entry['line'] + 1 in pending:
+                    entry['line'] += 1
+                    pending.discard(entry['line'])
+            self.__unsaved += 1
+            if self.__unsaved >= self.save_every:
+                self.__save()
+
+    def save(self):
+        with self.__lock:
+            self.__save()
+
+    def __save(self):
+        self.__unsaved = 0
+        if not self.checkpoint_path:
+            return
+        # A temp file of our own, so concurrent imports sharing the checkpoint never write into each other's
+        directory, file_name = os.path.split(os.path.abspath(self.checkpoint_path))
+        with tempfile.NamedTemporaryFile('w', dir = directory, prefix = file_name + '.', suffix = '.tmp', delete = False) as f:
+            temp_path = f.name
+            try:
+                json.dump(self.__files, f)
+            except Exception:
+                f.close()
+                os.unlink(temp_path)
+                raise
+        os.replace(temp_path, self.checkpoint_path)
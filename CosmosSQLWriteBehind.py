@@ -0,0 +1,149 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Write-behind buffer coalescing repeated writes to the same document
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    with cosmos.writeBehind(max_pending = 1000, max_age = 1.0) as writes:
+##        writes.upsertItem({'id': 'sensor1', 'deviceId': 'd1', 'reading': 1})
+##        writes.patchItem('sensor1', {'reading': 2}, 'd1')    # merged into the pending upsert
+##    # leaving the block flushes and closes the buffer
+##
+## Writes to the same (partition key, id) are merged while pending: an upsert replaces what is
+## pending, a patch is applied to the pending upsert or merged with the pending patch. The buffer
+## is flushed with concurrent upserts and patches when it holds max_pending documents, when its
+## oldest write is max_age seconds old, or on flush()/close().
+## Buffered writes are lost if the process dies before a flush; on_write sees every write as it is
+## buffered (e.g. to append it to a journal) and on_flush the ItemResult of every flushed document.
+##############################################################################################
+import threading
+import time
+
+class WriteBehindBuffer:
+    """Buffered upserts and patches of a CosmosSQL container, coalesced per (partition key, id).
+
+    Attributes:
+        max_pending     - pending documents that trigger a flush
+        max_age         - seconds a write may stay buffered
+        max_concurrency - writes in flight during a flush
+        on_write        - optional on_write(kind, key, payload) for every write buffered
+        on_flush        - optional on_flush(results) after every flush, results are ItemResult
+    Methods:
+        upsertItem(document)
+        patchItem(id, partialDoc, partitionKey = None)
+        flush()
+        close()
+        stats()
+    """
+    def __init__(self, cosmos, max_pending = 1000, max_age = 1.0, max_concurrency = 16, on_write = None, on_flush = None):
+        self.cosmos = cosmos
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.max_concurrency = max_concurrency
+        self.on_write = on_write
+        self.on_flush = on_flush
+        self.__pending = {}          # (partition key, id) -> ['upsert' | 'patch', document or partial document]
+        self.__oldest = None         # time of the oldest pending write
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__closed = False
+        self.__writes = 0
+        self.__coalesced = 0
+        self.__flushed = 0
+        self.__failures = 0
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target = self.__run, name = 'WriteBehindBuffer', daemon = True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def __buffer(self, kind, key, payload):
+        if self.__closed:
+            raise RuntimeError('WriteBehindBuffer is closed')
+        if self.on_write is not None:
+            self.on_write(kind, key, payload)
+        with self.__lock:
+            self.__writes += 1
+            entry = self.__pending.get(key)
+            if entry is not None:
+                self.__coalesced += 1
+            if entry is None or kind == 'upsert':
+                self.__pending[key] = [kind, dict(payload)]
+            else:
+                # A patch applies to whatever is pending, a pending upsert stays an upsert
+                entry[1].update(payload)
+            if self.__oldest is None:
+                self.__oldest = time.monotonic()
+            full = len(self.__pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def upsertItem(self, document):
+        """Buffer an upsert, replacing any pending write of the document"""
+        self.__buffer('upsert', (self.cosmos.partitionKeyOf(document), document['id']), document)
+
+    def patchItem(self, id, partialDoc, partitionKey = None):
+        """Buffer a patch, merged into any pending write of the document.
+        The partition key is needed unless the container is keyed by /id.
+        """
+        if partitionKey is None:
+            if self.cosmos.partitionKeyPath != '/id':
+                raise ValueError('patchItem needs the partitionKey of ' + str(id))
+            partitionKey = id
+        self.__buffer('patch', (partitionKey, id), {key: value for key, value in partialDoc.items() if key != 'id'})
+
+    def flush(self):
+        """Write the pending documents with concurrent upserts and patches, returns their ItemResult.
+        Flushes run one at a time so the writes to a document reach the container in order.
+        """
+        with self.__flush_lock:
+            with self.__lock:
+                pending, self.__pending, self.__oldest = self.__pending, {}, None
+            if not pending:
+                return []
+            upserts = [payload for kind, payload in pending.values() if kind == 'upsert']
+            patches = [(key[1], payload, key[0]) for key, (kind, payload) in pending.items() if kind == 'patch']
+            # Keys are distinct within a flush, so upserts and patches need no ordering between them
+            results = list(self.cosmos.upsertItems(upserts, self.max_concurrency)) if upserts else []
+            results += list(self.cosmos.patchItems(patches, self.max_concurrency)) if patches else []
+            with self.__lock:
+                self.__flushed += len(results)
+                self.__failures += sum(1 for result in results if result.error is not None)
+        if self.on_flush is not None:
+            self.on_flush(results)
+        return results
+
+    def __run(self):
+        while not self.__stop.wait(max(0.01, self.max_age / 4.0)):
+            oldest = self.__oldest
+            if oldest is not None and time.monotonic() - oldest >= self.max_age:
+                try:
+                    self.flush()
+                except Exception:
+                    # Failed writes are reported to on_flush, this only guards the timer
+                    pass
+
+    def close(self):
+        """Stop the timer and flush what is pending; later writes raise RuntimeError"""
+        self.__closed = True
+        self.__stop.set()
+        self.__thread.join()
+        results = []
+        while self.__pending:
+            results += self.flush()
+        return results
+
+    def stats(self):
+        """Snapshot of the counters: writes buffered, writes merged into a pending one, documents flushed"""
+        with self.__lock:
+            return {'writes': self.__writes, 'flushed': self.__flushed, 'pending': len(self.__pending),
+                    'coalesced': self.__coalesced, 'failures': self.__failures}
@@ -0,0 +1,168 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Offline benchmark of CosmosSQL against the in-process LocalCosmosClient
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    python benchCosmosSQL.py
+##    python benchCosmosSQL.py --documents 5000 --concurrency 32 --latency-ms 5 --throttle-ru 20000
+##    python benchCosmosSQL.py --throttle-ru 5000 --rate-limit-ru 4500    # smooth the load client side
+##    python benchCosmosSQL.py --startup --codec json                      # cold start, stdlib JSON
+##
+## Reports per scenario the throughput, p50/p99 latency per operation and RU per operation.
+## With --startup, first the import and first call times of a fresh interpreter.
+## No config.py and no network needed.
+##############################################################################################
+import argparse
+import io
+import os
+import random
+import subprocess
+import sys
+import time
+
+from CosmosSQLService import CosmosSQL, MetricsRegistry, _boundedMap, _retryThrottled, setCodec
+from CosmosSQLLocal import LocalCosmosClient
+from CosmosSQLRateLimiter import RateLimiter
+
+CATEGORIES = ['books', 'music', 'games', 'garden', 'tools', 'toys', 'food', 'sports']
+
+def document(i):
+    return {
+        'id': 'item{0}'.format(i),
+        'category': CATEGORIES[i % len(CATEGORIES)],
+        'name': 'Widget {0}'.format(i),
+        'price': round(random.uniform(1, 100), 2),
+        'stock': random.randint(0, 500),
+        'tags': ['tag{0}'.format(i % 13), 'tag{0}'.format(i % 7)]
+    }
+
+def bulkUpsert(cosmos, args):
+    results = cosmos.upsertItems((document(i) for i in range(args.documents)), max_concurrency = args.concurrency)
+    return args.documents, sum(1 for r in results if r.error)
+
+def pointRead(cosmos, args):
+    keys = [('item{0}'.format(i), CATEGORIES[i % len(CATEGORIES)]) for i in range(args.documents)]
+    random.shuffle(keys)
+    items = cosmos.readItems(keys, max_concurrency = args.concurrency)
+    return len(keys), sum(1 for item in items if item is None)
+
+def crossPartitionQuery(cosmos, args):
+    def query(i):
+        return list(cosmos.queryItems({
+                                        'query': 'SELECT * FROM c WHERE c.stock < @stock',
+                                        'parameters': [{'name': '@stock', 'value': 10 + i % 50}]
+                                      }))
+    results = list(_boundedMap(lambda i: _retryThrottled(query, i), range(args.queries), args.concurrency))
+    return args.queries, sum(1 for r in results if r.error)
+
+def parallelQuery(cosmos, args):
+    def query(i):
+        return list(cosmos.queryItemsParallel({
+                                                'query': 'SELECT * FROM c WHERE c.stock < @stock ORDER BY c.price',
+                                                'parameters': [{'name': '@stock', 'value': 10 + i % 50}]
+                                              }, max_degree_of_parallelism = args.partitions))
+    results = list(_boundedMap(lambda i: _retryThrottled(query, i), range(args.queries), args.concurrency))
+    return args.queries, sum(1 for r in results if r.error)
+
+def jsonOutput(cosmos, args):
+    out = io.BytesIO()
+    count = 0
+    for i in range(args.queries):
+        count += cosmos.listItemsJson(out, lines = True)
+        out.seek(0)
+        out.truncate()
+    return count, 0
+
+def patch(cosmos, args):
+    patches = (('item{0}'.format(i), {'stock': i % 17}, CATEGORIES[i % len(CATEGORIES)]) for i in range(args.documents))
+    return args.documents, sum(1 for r in cosmos.patchItems(patches, max_concurrency = args.concurrency) if r.error)
+
+def delete(cosmos, args):
+    keys = (('item{0}'.format(i), CATEGORIES[i % len(CATEGORIES)]) for i in range(args.documents))
+    results = _boundedMap(lambda key: _retryThrottled(cosmos.deleteItem, *key), keys, args.concurrency)
+    return args.documents, sum(1 for r in results if r.error)
+
+SCENARIOS = [
+    ('bulkUpsert', bulkUpsert),
+    ('pointRead', pointRead),
+    ('crossPartitionQuery', crossPartitionQuery),
+    ('parallelQuery', parallelQuery),
+    ('jsonOutput', jsonOutput),
+    ('patch', patch),
+    ('delete', delete)
+]
+
+# Timed in a fresh interpreter: the import, a CosmosSQL on an account (no connection yet) and a first read
+STARTUP = '''
+import sys, time
+start = time.perf_counter()
+from CosmosSQLService import CosmosSQL
+imported = time.perf_counter()
+CosmosSQL('benchDatabase', uri = 'https://localhost:8081/', key = 'a2V5')
+constructed = time.perf_counter()
+from CosmosSQLLocal import LocalCosmosClient
+cosmos = CosmosSQL('benchDatabase', client = LocalCosmosClient(latency = 0))
+cosmos.createContainer('products', '/category')
+cosmos.upsertItem({'id': 'item0', 'category': 'books'})
+first = time.perf_counter()
+cosmos.readItem('item0', 'books')
+done = time.perf_counter()
+print('{0:<20} {1:>9.2f}'.format('import', (imported - start) * 1000))
+print('{0:<20} {1:>9.2f}'.format('construct', (constructed - imported) * 1000))
+print('{0:<20} {1:>9.2f}'.format('first read', (done - first) * 1000))
+print('{0:<20} {1}'.format('SDK client imported', 'azure.cosmos.cosmos_client' in sys.modules))
+'''
+
+def startup(args):
+    print('{0:<20} {1:>9}'.format('startup', 'ms'))
+    sys.stdout.write(subprocess.check_output([sys.executable, '-c', STARTUP], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                             universal_newlines = True))
+    print('')
+
+def run(args):
+    setCodec(args.codec)
+    if args.startup:
+        startup(args)
+    client = LocalCosmosClient(latency = args.latency_ms / 1000.0, jitter = args.jitter_ms / 1000.0,
+                               throttle_ru_per_second = args.throttle_ru or None, throttle_rate = args.throttle_rate,
+                               partition_count = args.partitions, max_throttle_retries = args.sdk_retries)
+    metrics = MetricsRegistry()
+    limiter = RateLimiter(args.rate_limit_ru) if args.rate_limit_ru else None
+    cosmos = CosmosSQL('benchDatabase', client = client, metrics = metrics, rate_limiter = limiter)
+    cosmos.createContainer('products', '/category')
+
+    print('{0:<20} {1:>8} {2:>6} {3:>10} {4:<12} {5:>9} {6:>9} {7:>8} {8:>9}'.format(
+        'scenario', 'ops', 'failed', 'ops/s', 'operation', 'p50 ms', 'p99 ms', 'RU/op', 'throttles'))
+    for name, scenario in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        metrics.reset()
+        start = time.perf_counter()
+        ops, failed = scenario(cosmos, args)
+        elapsed = time.perf_counter() - start
+        rows = metrics.stats() or [{'operation': '-', 'latencyP50': 0, 'latencyP99': 0, 'requestChargePerOp': 0, 'throttles': 0}]
+        for i, row in enumerate(rows):
+            print('{0:<20} {1:>8} {2:>6} {3:>10} {4:<12} {5:>9.2f} {6:>9.2f} {7:>8.2f} {8:>9}'.format(
+                name if i == 0 else '', ops if i == 0 else '', failed if i == 0 else '',
+                '{0:.0f}'.format(ops / elapsed) if i == 0 else '', row['operation'],
+                row['latencyP50'] * 1000, row['latencyP99'] * 1000, row['requestChargePerOp'], row['throttles']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Offline CosmosSQL benchmark')
+    parser.add_argument('--documents', type = int, default = 2000)
+    parser.add_argument('--queries', type = int, default = 50)
+    parser.add_argument('--concurrency', type = int, default = 16)
+    parser.add_argument('--partitions', type = int, default = 4)
+    parser.add_argument('--latency-ms', type = float, default = 2.0)
+    parser.add_argument('--jitter-ms', type = float, default = 1.0)
+    parser.add_argument('--throttle-ru', type = float, default = 0, help = 'RU/s budget, 0 for unlimited')
+    parser.add_argument('--throttle-rate', type = float, default = 0.0, help = 'probability of a random 429')
+    parser.add_argument('--rate-limit-ru', type = float, default = 0, help = 'client side RU/s budget, 0 for none')
+    parser.add_argument('--sdk-retries', type = int, default = 9, help = '429s retried inside the client before CosmosSQL sees them')
+    parser.add_argument('--scenario', action = 'append', choices = [name for name, _ in SCENARIOS])
+    parser.add_argument('--codec', default = 'auto', choices = ['auto', 'json', 'orjson'], help = 'JSON codec of the outputs')
+    parser.add_argument('--startup', action = 'store_true', help = 'time the import and first calls first')
+    run(parser.parse_args())
@@ -0,0 +1,176 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Test AsyncCosmosSQL against a local stub server speaking the Cosmos REST shapes
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    python -m pytest testAsync.py    (or python testAsync.py)
+##
+## No account, config.py or network needed. The stub keeps the documents in memory, answers queries
+## with CosmosSQLQuery and throttles the first request of every document with a 429.
+##############################################################################################
+import asyncio
+import json
+
+from aiohttp import web
+
+from AsyncCosmosSQLService import AsyncCosmosSQL
+from CosmosSQLQuery import Query
+from CosmosSQLService import partitionKeyValue
+
+KEY = 'a2V5'
+
+class StubCosmos:
+    """In-memory Cosmos REST endpoint: databases, containers and documents"""
+    def __init__(self):
+        self.databases = set()
+        self.containers = {}     # (db, coll) -> container definition
+        self.documents = {}      # (db, coll) -> {(partition key json, id): document}
+        self.throttled = set()
+        self.requests = 0
+        self.etag = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/dbs', self.createDatabase)
+        app.router.add_post('/dbs/{db}/colls', self.createContainer)
+        app.router.add_get('/dbs/{db}/colls/{coll}', self.readContainer)
+        app.router.add_post('/dbs/{db}/colls/{coll}/docs', self.postDocuments)
+        app.router.add_route('*', '/dbs/{db}/colls/{coll}/docs/{id}', self.document)
+        return app
+
+    @staticmethod
+    def reply(status, body = None, headers = None):
+        return web.Response(status = status, text = json.dumps(body if body is not None else {}),
+                            headers = dict({'x-ms-request-charge': '1'}, **(headers or {})), content_type = 'application/json')
+
+    def check(self, request):
+        self.requests += 1
+        assert request.headers['authorization'].startswith('type%3Dmaster')
+        assert request.headers['x-ms-version'] and request.headers['x-ms-date']
+
+    async def createDatabase(self, request):
+        self.check(request)
+        database = (await request.json())['id']
+        if database in self.databases:
+            return self.reply(409)
+        self.databases.add(database)
+        return self.reply(201, {'id': database})
+
+    async def createContainer(self, request):
+        self.check(request)
+        container = await request.json()
+        key = (request.match_info['db'], container['id'])
+        if key in self.containers:
+            return self.reply(409)
+        self.containers[key] = container
+        self.documents[key] = {}
+        return self.reply(201, container)
+
+    async def readContainer(self, request):
+        self.check(request)
+        key = (request.match_info['db'], request.match_info['coll'])
+        if key not in self.containers:
+            return self.reply(404)
+        return self.reply(200, self.containers[key])
+
+    def partitionKeyOf(self, key, document):
+        return partitionKeyValue(document, self.containers[key]['partitionKey']['paths'][0])
+
+    async def postDocuments(self, request):
+        self.check(request)
+        key = (request.match_info['db'], request.match_info['coll'])
+        body = await request.json()
+        if request.headers.get('x-ms-documentdb-isquery') == 'True':
+            results, _ = Query(body).run(list(self.documents[key].values()))
+            start = int(request.headers.get('x-ms-continuation') or 0)
+            size = int(request.headers.get('x-ms-max-item-count') or 100)
+            page = results[start:start + size]
+            headers = {'x-ms-continuation': str(start + size)} if start + size < len(results) else {}
+            return self.reply(200, {'Documents': page, '_count': len(page)}, headers)
+        if body['id'] not in self.throttled:
+            # Every document's first write is throttled, the client retries it
+            self.throttled.add(body['id'])
+            return self.reply(429, headers = {'x-ms-retry-after-ms': '5'})
+        partition_key = json.loads(request.headers['x-ms-documentdb-partitionkey'])[0]
+        assert partition_key == self.partitionKeyOf(key, body)
+        return self.reply(200, self.store(key, body))
+
+    def store(self, key, document):
+        self.etag += 1
+        document = dict(document, _etag = '"{0}"'.format(self.etag))
+        self.documents[key][(json.dumps(self.partitionKeyOf(key, document)), document['id'])] = document
+        return document
+
+    async def document(self, request):
+        self.check(request)
+        key = (request.match_info['db'], request.match_info['coll'])
+        partition_key = json.loads(request.headers['x-ms-documentdb-partitionkey'])[0]
+        doc_key = (json.dumps(partition_key), request.match_info['id'])
+        document = self.documents[key].get(doc_key)
+        if document is None:
+            return self.reply(404)
+        if request.method == 'GET':
+            return self.reply(200, document)
+        if request.method == 'DELETE':
+            del self.documents[key][doc_key]
+            return self.reply(204)
+        if request.headers.get('If-Match') not in (None, document['_etag']):
+            return self.reply(412)
+        return self.reply(200, self.store(key, await request.json()))
+
+async def main():
+    stub = StubCosmos()
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    uri = 'http://127.0.0.1:{0}/'.format(site._server.sockets[0].getsockname()[1])
+    try:
+        async with AsyncCosmosSQL('testDatabase', uri = uri, key = KEY) as cosmos:
+            await cosmos.createContainer('Families', '/lastName')
+            families = [{'id': 'Andersen.{0}'.format(i), 'lastName': 'Andersen' if i % 2 else 'Wakefield', 'age': i}
+                        for i in range(20)]
+            await asyncio.gather(*[cosmos.upsertItem(family) for family in families])
+            assert len(stub.documents[('testDatabase', 'Families')]) == 20
+
+            # Point reads with and without the partition key, the latter by a cross partition query
+            assert (await cosmos.readItem('Andersen.3', 'Andersen'))['age'] == 3
+            assert (await cosmos.readItem('Andersen.4'))['lastName'] == 'Wakefield'
+            assert await cosmos.readItem('Andersen.99') is None
+
+            # Queries follow the continuation page by page
+            ages = []
+            async for item in cosmos.queryItems('SELECT * FROM c WHERE c.age >= @age', [{'name': '@age', 'value': 5}], max_item_count = 4):
+                ages.append(item['age'])
+            assert sorted(ages) == list(range(5, 20))
+
+            patched = await cosmos.patchItem('Andersen.5', {'registered': True})
+            assert patched['registered'] and patched['age'] == 5
+
+            await cosmos.deleteItem('Andersen.6')
+            assert await cosmos.readItem('Andersen.6', 'Wakefield') is None
+
+            # Another instance on the shared session
+            async with AsyncCosmosSQL('testDatabase', uri = uri, key = KEY) as other:
+                await other.readContainer('Families')
+                assert (await other.readItem('Andersen.7', 'Andersen'))['age'] == 7
+            session = cosmos.session
+            assert not session.closed
+        # Closed with its last user
+        assert session.closed
+        print('testAsync passed: {0} requests served'.format(stub.requests))
+    finally:
+        await runner.cleanup()
+
+def test_async():
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+if __name__ == '__main__':
+    test_async()
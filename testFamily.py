@@ -107,7 +107,7 @@ class family:
         }
         return johnson_item
 
-from CosmosSQLService import CosmosSQL
+from CosmosSQLService import CosmosSQL, QueryBuilder
 
 cosmos = CosmosSQL()
 
@@ -120,21 +120,33 @@ family_items_to_create = [family.get_andersen_family_item(), family.get_johnson_
 print('Number of families: {0}.'.format(len(family_items_to_create)))
 
  # <create_item>
-for family_item in family_items_to_create:
-    cosmos.upsertItem(family_item)
+for result in cosmos.upsertItems(family_items_to_create):
+    if result.error:
+        print('Failed to create family {0}: {1}'.format(result.item['id'], result.error))
 # </create_item>
 
+# Write items of one partition in a single round trip, all or nothing
+# <batch>
+andersen = family_items_to_create[0]
+with cosmos.batch(andersen['lastName']) as batch:
+    batch.patchItem(andersen['id'], {'district': 'WA6'})
+    # A new member of the family under an id of its own, creating an existing id fails the whole batch
+    batch.createItem(dict(andersen, id = 'Andersen_' + str(uuid.uuid4()), parents = None))
+for result in batch.results:
+    print('Batch {0} {1}: {2}'.format(result.item['op'], result.item['id'], result.error or 'ok'))
+# </batch>
+
 # Read items (key value lookups by partition key and id, aka point reads)
 # <read_item>
 for family in family_items_to_create:
-    item_response = cosmos.readItem(itemId = family['id'])
+    item_response = cosmos.readItem(itemId = family['id'], partitionKey = family['lastName'])
     print('Read item with id {0}, lastname {1}.'.format(item_response['id'], item_response['lastName']))
 # </read_item>
 
 # Query these items using the SQL query syntax. 
 # Specifying the partition key value in the query allows Cosmos DB to retrieve data only from the relevant partitions, which improves performance
 # <query_items>
-query = "SELECT * FROM c WHERE c.lastName IN ('Wakefield', 'Andersen')"
+query = QueryBuilder().whereIn('lastName', ['Wakefield', 'Andersen'])
 items = cosmos.queryItems(query)
 count = 0
 for item in items:
@@ -143,3 +155,11 @@ for item in items:
 
 print('Query returned {0} items.'.format(count))
 # </query_items>
+
+# Counts and aggregates are computed by the service, only the numbers come back
+# <aggregates>
+print('Registered families: {0}.'.format(cosmos.count('c.registered = @registered', {'@registered': True})))
+for group in cosmos.aggregate(None, 'COUNT', group_by = 'address.state'):
+    print('Families in {0}: {1}.'.format(group['address.state'], group['value']))
+print('States: {0}.'.format(', '.join(cosmos.distinct('address.state'))))
+# </aggregates>
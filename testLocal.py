@@ -0,0 +1,270 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Test CosmosSQL against the in-process LocalCosmosClient
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    python -m pytest testLocal.py    (or python testLocal.py)
+##
+## No account, config.py or network needed: parallel query merges, checkpoint stores, caches,
+## batches and the rate limiter checked against LocalCosmosClient.
+##############################################################################################
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import azure.cosmos.errors as errors
+
+from CosmosSQLCache import ItemCache, MetadataCache
+from CosmosSQLChangeFeed import FileCheckpointStore, MemoryCheckpointStore
+from CosmosSQLLocal import LocalCosmosClient
+from CosmosSQLRateLimiter import RateLimiter
+from CosmosSQLService import CosmosSQL
+from CosmosSQLTransfer import ImportCheckpoint
+
+CATEGORIES = ['books', 'games', 'music', 'tools', 'toys']
+
+def products(count = 200):
+    return [{'id': str(i), 'category': CATEGORIES[i % len(CATEGORIES)], 'price': (i * 37) % 101, 'stock': i % 3}
+            for i in range(count)]
+
+def connect(client = None, **kwargs):
+    """CosmosSQL on a fresh local client with a products container keyed by category"""
+    cosmos = CosmosSQL('testDatabase', client = client or LocalCosmosClient(), metadata_cache = MetadataCache(), **kwargs)
+    cosmos.createContainer('products', '/category')
+    return cosmos
+
+def load(cosmos, documents):
+    results = list(cosmos.upsertItems(documents))
+    assert all(result.error is None for result in results)
+    return documents
+
+class TempDir:
+    def __enter__(self):
+        self.path = tempfile.mkdtemp()
+        return self.path
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.path)
+
+def test_parallelOrderBy():
+    cosmos = connect()
+    documents = load(cosmos, products())
+    prices = [item['price'] for item in cosmos.queryItemsParallel('SELECT * FROM c ORDER BY c.price DESC', max_degree_of_parallelism = 4)]
+    assert prices == sorted((document['price'] for document in documents), reverse = True)
+    top = list(cosmos.queryItemsParallel('SELECT TOP 5 c.id, c.price FROM c ORDER BY c.price'))
+    assert [item['price'] for item in top] == sorted(document['price'] for document in documents)[:5]
+    assert sorted(item['id'] for item in cosmos.queryItemsParallel('SELECT * FROM c', page_size = 7)) == \
+        sorted(document['id'] for document in documents)
+
+def test_parallelAggregates():
+    cosmos = connect()
+    documents = load(cosmos, products())
+    prices = [document['price'] for document in documents]
+    assert cosmos.count() == len(documents)
+    assert cosmos.count('c.price > @p', {'@p': 50}) == len([p for p in prices if p > 50])
+    assert cosmos.aggregate('price', 'SUM') == sum(prices)
+    assert cosmos.aggregate('price', 'MIN') == min(prices)
+    assert cosmos.aggregate('price', 'MAX') == max(prices)
+    assert abs(cosmos.aggregate('price', 'AVG') - float(sum(prices)) / len(prices)) < 1e-9
+    # No document matches: undefined, not 0
+    assert cosmos.aggregate('price', 'SUM', 'c.price > 1000') is None
+    assert cosmos.aggregate('price', 'AVG', 'c.price > 1000') is None
+    groups = {group['category']: group['value'] for group in cosmos.aggregate('price', 'SUM', group_by = 'category')}
+    assert groups == {category: sum(d['price'] for d in documents if d['category'] == category) for category in CATEGORIES}
+    assert sorted(cosmos.distinct('stock')) == [0, 1, 2]
+
+def test_queryPagesResume():
+    cosmos = connect()
+    load(cosmos, products(50))
+    pages = cosmos.queryPages('SELECT * FROM c', page_size = 20)
+    first = next(pages)
+    assert len(first.items) == 20 and first.continuation
+    rest = [item for page in cosmos.queryPages('SELECT * FROM c', page_size = 20, continuation = first.continuation) for item in page.items]
+    assert sorted(item['id'] for item in first.items + rest) == sorted(str(i) for i in range(50))
+
+def test_changeFeedCheckpoints():
+    cosmos = connect()
+    load(cosmos, products(40))
+    store = MemoryCheckpointStore()
+    read = lambda feed: sorted(item['id'] for batch in feed.batches() for item in batch.items)
+    assert read(cosmos.changeFeed(store, name = 'sync')) == sorted(str(i) for i in range(40))
+    # Checkpointed: only the changes since
+    assert read(cosmos.changeFeed(store, name = 'sync')) == []
+    cosmos.upsertItem({'id': '7', 'category': CATEGORIES[2], 'price': 1})
+    assert read(cosmos.changeFeed(store, name = 'sync')) == ['7']
+    # Another consumer of the feed keeps its own checkpoints
+    assert len(read(cosmos.changeFeed(store, name = 'other'))) == 40
+
+def test_changeFeedFromNow():
+    cosmos = connect()
+    load(cosmos, products(10))
+    store = MemoryCheckpointStore()
+    assert list(cosmos.changeFeed(store, start_from_beginning = False).batches()) == []
+    cosmos.upsertItem({'id': 'new', 'category': 'books', 'price': 1})
+    assert [item['id'] for batch in cosmos.changeFeed(store).batches() for item in batch.items] == ['new']
+
+def test_fileCheckpointStore():
+    with TempDir() as directory:
+        path = os.path.join(directory, 'checkpoints.json')
+        cosmos = connect()
+        load(cosmos, products(30))
+        assert sum(len(batch.items) for batch in cosmos.changeFeed(FileCheckpointStore(path)).batches()) == 30
+        # A restarted consumer resumes from the file
+        assert list(cosmos.changeFeed(FileCheckpointStore(path)).batches()) == []
+        store = FileCheckpointStore(path)
+        store.put('manual', '0', 'etag')
+        assert FileCheckpointStore(path).get('manual', '0') == 'etag'
+        assert os.listdir(directory) == ['checkpoints.json']
+
+def test_importCheckpoint():
+    with TempDir() as directory:
+        path = os.path.join(directory, 'import.checkpoint')
+        checkpoint = ImportCheckpoint(path, save_every = 1)
+        assert checkpoint.resume('a.jsonl') == (0, set())
+        # Lines complete out of order: the mark only moves over consecutive lines
+        for line in (2, 1, 5, 3):
+            checkpoint.done('a.jsonl', line)
+        checkpoint.done('a.jsonl', 4, failed = True)
+        resumed = ImportCheckpoint(path)
+        assert resumed.resume('a.jsonl') == (5, {4})
+        resumed.done('a.jsonl', 4)
+        resumed.save()
+        assert ImportCheckpoint(path).resume('a.jsonl') == (5, set())
+        assert os.listdir(directory) == ['import.checkpoint']
+
+def test_exportImport():
+    with TempDir() as directory:
+        cosmos = connect()
+        documents = load(cosmos, products(120))
+        export = cosmos.exportContainer(os.path.join(directory, 'products.jsonl'), shards = 2)
+        assert export['documents'] == 120 and len(export['files']) == 2
+        target = connect()
+        report = target.importContainer(os.path.join(directory, 'products.jsonl.gz'))
+        assert report['imported'] == 120 and not report['failures']
+        imported = {item['id']: item for item in target.queryItems()}
+        assert all(imported[d['id']]['price'] == d['price'] for d in documents)
+        # Exported without system properties
+        with gzip.open(export['files'][0], 'rt') as f:
+            assert not [key for line in f for key in json.loads(line) if key.startswith('_')]
+
+def test_itemCache():
+    client = LocalCosmosClient()
+    cosmos = connect(client, cache = ItemCache(max_size = 10, ttl = 60))
+    cosmos.upsertItem({'id': '1', 'category': 'books', 'price': 5})
+    assert cosmos.readItem('1', 'books')['price'] == 5
+    assert cosmos.readItem('1', 'books')['price'] == 5
+    assert cosmos.cache.stats()['hits'] >= 1
+    # Writes through the instance keep the cache current
+    cosmos.upsertItem({'id': '1', 'category': 'books', 'price': 6})
+    assert cosmos.readItem('1', 'books')['price'] == 6
+    cosmos.deleteItem('1', 'books')
+    assert cosmos.readItem('1', 'books') is None
+
+def test_itemCacheEviction():
+    cache = ItemCache(max_size = 2, ttl = 60)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, {'id': key})
+    assert cache.get('a') is None and cache.get('c') == {'id': 'c'}
+    expired = ItemCache(ttl = 0)
+    expired.put('a', {'id': 'a'})
+    assert expired.get('a') is None
+
+def test_metadataCache():
+    with TempDir() as directory:
+        path = os.path.join(directory, 'metadata.json')
+        cache = MetadataCache(path)
+        cache.put('uri', 'dbs/d', {'id': 'd'})
+        cache.put('uri', 'dbs/d/colls/c', {'id': 'c'})
+        cache.put('uri', 'dbs/d/colls/c/pkranges', [])
+        assert MetadataCache(path).get('uri', 'dbs/d/colls/c') == {'id': 'c'}
+        cache.invalidate('uri', 'dbs/d/colls/c')
+        assert len(MetadataCache(path)) == 1
+        assert os.listdir(directory) == ['metadata.json']
+
+def test_staleContainerResolvedAgain():
+    with TempDir() as directory:
+        path = os.path.join(directory, 'metadata.json')
+        client = LocalCosmosClient()
+        CosmosSQL('testDatabase', client = client, metadata_cache = MetadataCache(path)).createContainer('products', '/category')
+        connect(client).deleteContainer('products')
+        # A warm restart on the persisted metadata still believes in the container
+        cosmos = CosmosSQL('testDatabase', client = client, metadata_cache = MetadataCache(path))
+        cosmos.createContainer('products', '/category')
+        try:
+            cosmos.upsertItem({'id': '1', 'category': 'books'})
+            assert False, 'the container is gone'
+        except errors.HTTPFailure as e:
+            assert e.status_code == 404
+        cosmos.createContainer('products', '/category')
+        assert cosmos.upsertItem({'id': '1', 'category': 'books'})['id'] == '1'
+
+def test_batch():
+    cosmos = connect()
+    cosmos.upsertItem({'id': '1', 'category': 'books', 'price': 5})
+    with cosmos.batch('books') as batch:
+        batch.patchItem('1', {'price': 6})
+        batch.createItem({'id': '2', 'category': 'books', 'price': 7})
+    assert all(result.error is None for result in batch.results)
+    assert cosmos.readItem('1', 'books')['price'] == 6
+    # All or nothing: the conflicting create rolls the patch back
+    with cosmos.batch('books') as batch:
+        batch.patchItem('1', {'price': 8})
+        batch.createItem({'id': '2', 'category': 'books', 'price': 9})
+    assert all(result.error is not None for result in batch.results)
+    assert cosmos.readItem('1', 'books')['price'] == 6
+
+def test_batchOutOfTime():
+    client = LocalCosmosClient(max_sproc_operations = 3)
+    cosmos = connect(client)
+    with cosmos.batch('books') as batch:
+        for i in range(10):
+            batch.upsertItem({'id': str(i), 'category': 'books'})
+    # Split in halves until the chunks fit the time budget
+    assert all(result.error is None for result in batch.results)
+    assert cosmos.count() == 10
+    client.max_sproc_operations = 0
+    with cosmos.batch('books') as batch:
+        batch.upsertItem({'id': 'late', 'category': 'books'})
+    assert 'out of time' in str(batch.results[0].error)
+
+def test_rateLimiter():
+    limiter = RateLimiter(100, burst = 100, initial_estimate = 10)
+    assert limiter.acquire('readItem', 100) == 100
+    start = time.monotonic()
+    limiter.acquire('readItem', 20)
+    # The bucket was empty: 20 RU at 100 RU/s
+    assert time.monotonic() - start >= 0.15 and limiter.stats()['waits'] == 1
+    estimate = limiter.acquire('queryPage')
+    assert estimate == 10
+    limiter.settle('queryPage', estimate, 30)
+    assert limiter.estimate('queryPage') > 10
+
+class CountingLimiter(RateLimiter):
+    def __init__(self, *args, **kwargs):
+        RateLimiter.__init__(self, *args, **kwargs)
+        self.acquired = {}
+
+    def acquire(self, operation, cost = None):
+        self.acquired[operation] = self.acquired.get(operation, 0) + 1
+        return RateLimiter.acquire(self, operation, cost)
+
+def test_rateLimiterGatesQueryPages():
+    limiter = CountingLimiter(100000)
+    cosmos = connect(rate_limiter = limiter)
+    load(cosmos, products(250))
+    assert len(list(cosmos.queryItems('SELECT * FROM c'))) == 250
+    # One acquisition per page (100 documents) and the final empty call, not one per document
+    assert limiter.acquired['queryItems'] <= 4
+    assert 'queryItems' in limiter.stats()['estimates']
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('testLocal passed')
@@ -0,0 +1,53 @@
+## Azure Cosmos SQL Core Sample
+##
+## Purpose: Test the query parser and normalizer
+##
+## Author : Simon Li  Feb 2020
+##
+##############################################################################################
+## Usage:
+##    python -m pytest testQuery.py    (or python testQuery.py)
+##
+## No account, config.py or network needed.
+##############################################################################################
+from CosmosSQLQuery import Query, QueryPlanCache, normalizeQuery
+
+def test_normalizeKeepsLiterals():
+    text = 'SELECT * FROM c WHERE c.done = true AND c.archived != false AND c.owner = null AND c.x != undefined'
+    assert normalizeQuery(text) == text
+    assert normalizeQuery('select *  from c where c.done = true') == 'SELECT * FROM c WHERE c.done = true'
+
+def test_normalizeCollapsesWhitespaceOutsideStrings():
+    assert normalizeQuery("  select c.id\n  FROM c\twhere c.name = 'a  b' ") == "SELECT c.id FROM c WHERE c.name = 'a  b'"
+    # Property names keep their case even when they read like keywords
+    assert normalizeQuery('select c.value from c') == 'SELECT c.value FROM c'
+
+def test_normalizeDropsComments():
+    text = """SELECT * FROM c -- every family
+    WHERE c.age > 5 /* adults
+    only */ AND c.name != '-- not a comment'
+    ORDER BY c.age -- trailing"""
+    assert normalizeQuery(text) == "SELECT * FROM c WHERE c.age > 5 AND c.name != '-- not a comment' ORDER BY c.age"
+
+def test_literals():
+    documents = [{'id': '1', 'done': True, 'owner': None}, {'id': '2', 'done': False}, {'id': '3', 'done': True, 'owner': 'a'}]
+    run = lambda text: [document['id'] for document in Query(text).run(documents)[0]]
+    assert run('SELECT * FROM c WHERE c.done = true') == ['1', '3']
+    assert run('SELECT * FROM c WHERE c.done = false') == ['2']
+    assert run('SELECT * FROM c WHERE c.owner = null') == ['1']
+    assert run('SELECT * FROM c WHERE NOT IS_DEFINED(c.owner)') == ['2']
+
+def test_planCacheSharesShapes():
+    plans = QueryPlanCache()
+    first, _ = plans.get('select * from c where c.n = @n', {'@n': 1})
+    second, plan = plans.get('select * from c where c.n = @n', {'@n': 2})
+    assert first['query'] == second['query'] == 'SELECT * FROM c WHERE c.n = @n'
+    assert second['parameters'] == [{'name': '@n', 'value': 2}]
+    assert plan.parameters == {'@n': 2}
+    assert plans.stats()['hits'] == 1
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('testQuery passed')
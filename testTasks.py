@@ -4,7 +4,7 @@
 ##
 ## Author : Simon Li  Feb 2020
 ##
-from CosmosSQLService import CosmosSQL
+from CosmosSQLService import CosmosSQL, QueryBuilder
 
 import json
 
@@ -30,12 +30,13 @@ def initialization(cosmos):
                 "done": True
             } 
         ]           
-    for task in tasks:        
-        cosmos.upsertItem(task)
+    for result in cosmos.upsertItems(tasks):
+        if result.error:
+            print('Failed to insert task {0}: {1}'.format(result.item['id'], result.error))
 
 def query(cosmos):
 # Query data
-    sql = 'SELECT t.id, t.title, t.description FROM {0} as t'.format(cosmos.container_id) 
+    sql = QueryBuilder('t').select('id', 'title', 'description')
     for task in cosmos.queryItems(sql):
         print(json.dumps(task, indent=True))
 
@@ -51,12 +52,8 @@ def patch(cosmos, id, document):
 
 def read(cosmos, id):
     # Enumerate the returned items
-    tasks = cosmos.queryItems({
-                                'query': 'SELECT r.id, r.title FROM root r WHERE r.id=@id',
-                                'parameters': [
-                                                {'name': '@id', 'value': id}
-                                            ]
-                            })                                       
+    # The container is keyed by /id, so the query only visits the document's partition
+    tasks = list(cosmos.queryItems('SELECT r.id, r.title FROM root r WHERE r.id=@id', {'@id': id}, partitionKey = id))
     for task in tasks:
         print(json.dumps(task, indent=True))
     return tasks